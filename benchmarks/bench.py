@@ -0,0 +1,193 @@
+from benchmarks.standin import StandInRepository, StandInServer
+import subprocess
+import argparse
+import resource
+import json
+import time
+import sys
+import os
+
+
+def peak_rss_megabytes():
+    """Returns the peak resident set size of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def build_repository(page_counts, audio_count):
+    return StandInRepository(
+        books={f"bench:book-{pages}": pages for pages in page_counts},
+        audio=[f"bench:audio-{number}" for number in range(1, audio_count + 1)],
+    )
+
+
+def run_scenario(server_url, pids, workers, chunk_size=None):
+    """Builds and serializes the manifest of each PID against a stand-in server, then reports how long it took.
+
+    This runs in its own process so that peak RSS belongs to one scenario.
+    """
+    from fedora.client import HTTPClient
+    from pipeline.build import ManifestBuilder
+
+    client = HTTPClient(pool_size=workers)
+    builder = ManifestBuilder(
+        server_url,
+        f"{server_url}/fedora/risearch",
+        client=client,
+        workers=workers,
+        chunk_size=chunk_size,
+    )
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        for pid in pids:
+            manifest, failures = builder.build(pid)
+            if len(failures) > 0:
+                raise Exception(f"{len(failures)} pages of {pid} failed: {failures[0]}")
+            builder.write(manifest, devnull)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "manifests": len(pids),
+        "client_requests": client.stats()["requests"],
+        "peak_rss_mb": peak_rss_megabytes(),
+        "stages": builder.timer.seconds,
+    }
+
+
+def run_benchmarks(page_counts, audio_count, latency, workers, chunk_size=None):
+    """Starts a stand-in server and runs one scenario per book size, plus one for the audio objects.
+
+    Returns:
+        list: A dict of results for each scenario.
+    """
+    repository = build_repository(page_counts, audio_count)
+    scenarios = [
+        (f"book ({pages} pages)", [f"bench:book-{pages}"]) for pages in page_counts
+    ]
+    if audio_count > 0:
+        scenarios.append((f"audio (x{audio_count})", sorted(repository.audio)))
+    results = []
+    with StandInServer(repository, latency=latency) as server:
+        for name, pids in scenarios:
+            served_before = server.requests
+            child = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.bench",
+                    "--scenario",
+                    "--server",
+                    server.url,
+                    "--workers",
+                    str(workers),
+                    *(
+                        ["--chunk-size", str(chunk_size)]
+                        if chunk_size is not None
+                        else []
+                    ),
+                    *pids,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                text=True,
+            )
+            result = json.loads(child.stdout)
+            result["name"] = name
+            result["requests"] = server.requests - served_before
+            result["manifests_per_second"] = result["manifests"] / result["seconds"]
+            results.append(result)
+    return results
+
+
+def format_results(results):
+    lines = [
+        f"{'scenario':<22}{'seconds':>10}{'requests':>10}{'peak MB':>10}{'manifests/s':>13}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['name']:<22}{result['seconds']:>10.2f}{result['requests']:>10}"
+            f"{result['peak_rss_mb']:>10.1f}{result['manifests_per_second']:>13.2f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark manifest builds against a local stand-in for Fedora, risearch, and the image server"
+    )
+    parser.add_argument(
+        "-p",
+        "--pages",
+        dest="pages",
+        help="Specify the page counts of the books to build.",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000, 5000],
+    )
+    parser.add_argument(
+        "-a",
+        "--audio",
+        dest="audio",
+        help="Specify how many audio objects to build.",
+        type=int,
+        default=20,
+    )
+    parser.add_argument(
+        "-l",
+        "--latency",
+        dest="latency",
+        help="Specify the seconds the stand-in server waits before answering each request.",
+        type=float,
+        default=0.005,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="Specify how many info.json requests can run at once for a book.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        dest="chunk_size",
+        help="Specify how many canvases of a book to build at a time while it is written.",
+        type=int,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        help="Specify a file to write results to as JSON for comparing against later runs.",
+    )
+    parser.add_argument("--scenario", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--server", dest="server", help=argparse.SUPPRESS)
+    parser.add_argument("pids", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.scenario:
+        print(
+            json.dumps(
+                run_scenario(args.server, args.pids, args.workers, args.chunk_size)
+            )
+        )
+    else:
+        results = run_benchmarks(
+            args.pages, args.audio, args.latency, args.workers, args.chunk_size
+        )
+        print(format_results(results))
+        if args.output is not None:
+            with open(args.output, "w") as output:
+                json.dump(
+                    {
+                        "latency": args.latency,
+                        "workers": args.workers,
+                        "chunk_size": args.chunk_size,
+                        "results": results,
+                    },
+                    output,
+                    indent=4,
+                )
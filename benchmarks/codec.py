@@ -0,0 +1,173 @@
+from benchmarks.standin import StandInRepository, StandInServer
+from fedora import codec
+from fedora.client import HTTPClient
+from fedora.mods import MODSRecord
+from iiif.serialize import write_manifest
+from pipeline.build import ManifestBuilder
+import argparse
+import json
+import time
+import io
+
+
+def best_of(function, repeat):
+    """Returns the fewest seconds function took over repeat calls."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def build_manifests(page_counts):
+    """Builds one book manifest for each page count against a stand-in server so they are the size of real ones."""
+    repository = StandInRepository(
+        books={f"bench:book-{pages}": pages for pages in page_counts}
+    )
+    with StandInServer(repository) as server:
+        builder = ManifestBuilder(
+            server.url, f"{server.url}/fedora/risearch", client=HTTPClient()
+        )
+        return {pages: builder.build(f"bench:book-{pages}")[0] for pages in page_counts}
+
+
+def serialize(manifest):
+    handle = io.StringIO()
+    write_manifest(manifest, handle, indent=None)
+    return handle.getvalue()
+
+
+def read_record(document):
+    record = MODSRecord(document)
+    return tuple(getattr(record, name) for name in MODSRecord.__slots__)
+
+
+def run_benchmarks(page_counts, mods_count, repeat):
+    """Times compact serialization and parsing of manifests with each installed JSON backend, and reading MODS
+    records with each installed XML backend.
+
+    The output of every backend is checked against the standard library before it is timed.
+
+    Returns:
+        list: A dict of results for each scenario and backend.
+    """
+    manifests = build_manifests(page_counts)
+    repository = StandInRepository()
+    documents = [
+        repository.mods(f"bench:{number}").encode("utf-8")
+        for number in range(mods_count)
+    ]
+    initial = (codec.json_backend, codec.xml_backend)
+    results = []
+    try:
+        codec.use_backends(json_name="json", xml_name="ElementTree")
+        expected_bodies = {pages: serialize(manifests[pages]) for pages in page_counts}
+        expected_record = read_record(documents[0])
+        for backend in codec.JSON_BACKENDS:
+            codec.use_backends(json_name=backend)
+            for pages in page_counts:
+                manifest = manifests[pages]
+                body = serialize(manifest)
+                if body != expected_bodies[pages]:
+                    raise Exception(
+                        f"The {backend} backend serialized the {pages} page manifest differently."
+                    )
+                results.append(
+                    {
+                        "name": f"manifest ({pages} pages)",
+                        "backend": backend,
+                        "kilobytes": len(body.encode("utf-8")) / 1024,
+                        "serialize_ms": best_of(lambda: serialize(manifest), repeat)
+                        * 1000,
+                        "parse_ms": best_of(lambda: codec.loads(body), repeat) * 1000,
+                    }
+                )
+        for backend in codec.XML_BACKENDS:
+            codec.use_backends(xml_name=backend)
+            if read_record(documents[0]) != expected_record:
+                raise Exception(f"The {backend} backend read MODS differently.")
+            results.append(
+                {
+                    "name": f"MODS (x{mods_count})",
+                    "backend": backend,
+                    "kilobytes": sum(len(document) for document in documents) / 1024,
+                    "serialize_ms": None,
+                    "parse_ms": best_of(
+                        lambda: [MODSRecord(document) for document in documents],
+                        repeat,
+                    )
+                    * 1000,
+                }
+            )
+    finally:
+        codec.use_backends(json_name=initial[0], xml_name=initial[1])
+    return results
+
+
+def format_results(results):
+    lines = [
+        f"{'scenario':<24}{'backend':<13}{'KB':>10}{'serialize ms':>14}{'parse ms':>12}"
+    ]
+    for result in results:
+        serialize_ms = (
+            f"{result['serialize_ms']:.2f}"
+            if result["serialize_ms"] is not None
+            else "-"
+        )
+        lines.append(
+            f"{result['name']:<24}{result['backend']:<13}{result['kilobytes']:>10.1f}{serialize_ms:>14}"
+            f"{result['parse_ms']:>12.2f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the JSON and XML backends of fedora.codec on manifests and MODS records"
+    )
+    parser.add_argument(
+        "-p",
+        "--pages",
+        dest="pages",
+        help="Specify the page counts of the book manifests to serialize and parse.",
+        nargs="+",
+        type=int,
+        default=[100, 1000, 5000],
+    )
+    parser.add_argument(
+        "-m",
+        "--mods",
+        dest="mods",
+        help="Specify how many MODS records to read.",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        dest="repeat",
+        help="Specify how many times to run each measurement.  The fastest is reported.",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        help="Specify a file to write results to as JSON for comparing against later runs.",
+    )
+    args = parser.parse_args()
+    results = run_benchmarks(args.pages, args.mods, args.repeat)
+    print(format_results(results))
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(
+                {
+                    "backends": list(codec.JSON_BACKENDS) + list(codec.XML_BACKENDS),
+                    "results": results,
+                },
+                output,
+                indent=4,
+            )
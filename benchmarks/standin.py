@@ -0,0 +1,360 @@
+from email.utils import formatdate, parsedate_to_datetime
+from fedora.tuples import parse_fedora_date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+import threading
+import hashlib
+import time
+import json
+import re
+
+MODS_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<mods xmlns="http://www.loc.gov/mods/v3" xmlns:xlink="http://www.w3.org/1999/xlink">
+    <titleInfo>
+        <title>{title}</title>
+    </titleInfo>
+    <abstract>Quarterly newsletter from Knoxville, Tennessee, covering farming and home economics.</abstract>
+    <originInfo>
+        <publisher>University of Tennessee Agricultural Experiment Station</publisher>
+        <dateIssued encoding="edtf">1963</dateIssued>
+        <dateIssued>April - June 1963</dateIssued>
+    </originInfo>
+    <subject>
+        <topic>Agriculture--Tennessee</topic>
+    </subject>
+    <subject>
+        <topic>Farm management</topic>
+    </subject>
+    <subject>
+        <geographic>Tennessee</geographic>
+    </subject>
+    <tableOfContents>Examining beef cows for pregnancies - Personnel summary - Growing corn on the plateau</tableOfContents>
+    <accessCondition type="use and reproduction" xlink:href="http://rightsstatements.org/vocab/NoC-US/1.0/">No Copyright - United States</accessCondition>
+</mods>
+"""
+
+TECHMD_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<fits xmlns="http://hul.harvard.edu/ois/xml/ns/fits/fits_output">
+    <metadata>
+        <audio>
+            <duration toolname="MediaInfo">47mn 5s</duration>
+            <duration toolname="NLNZ Metadata Extractor">0:47:05:339</duration>
+        </audio>
+    </metadata>
+</fits>
+"""
+
+
+class StandInRepository:
+    """Canned Fedora, Islandora, and IIIF image server content for a collection of books and audio objects.
+
+    Every book has pages named {book}-{n}, and everything is generated from its PID so that the repository holds
+    only the list of objects.
+
+    Args:
+        collection (str): The PID of the collection every object belongs to.
+        books (dict): The number of pages of each book keyed by PID.
+        audio (list): The PIDs of audio objects.
+        modified (str): The lastModifiedDate reported for every object and page.
+    """
+
+    def __init__(
+        self,
+        collection="collections:bench",
+        books=None,
+        audio=None,
+        modified="2020-01-01T00:00:00.000Z",
+    ):
+        self.collection = collection
+        self.books = books if books is not None else {}
+        self.audio = audio if audio is not None else []
+        self.modified = modified
+
+    def model(self, pid):
+        if pid in self.books:
+            return "islandora:bookCModel"
+        if pid in self.audio:
+            return "islandora:sp-audioCModel"
+        if self.page_book(pid) is not None:
+            return "islandora:pageCModel"
+        return None
+
+    def page_book(self, pid):
+        book, separator, number = pid.rpartition("-")
+        if separator == "" or book not in self.books or not number.isdigit():
+            return None
+        return book if 1 <= int(number) <= self.books[book] else None
+
+    def pages(self, book):
+        return [(f"{book}-{n}", n) for n in range(1, self.books.get(book, 0) + 1)]
+
+    def mods(self, pid):
+        return MODS_TEMPLATE.format(title=escape(f"Stand-in object {pid}"))
+
+    @staticmethod
+    def techmd(pid):
+        return TECHMD_TEMPLATE
+
+    def info_json(self, base, pid, datastream):
+        height, width = (3300, 2550) if datastream == "JP2" else (200, 155)
+        return {
+            "@context": "http://iiif.io/api/image/2/context.json",
+            "@id": base,
+            "protocol": "http://iiif.io/api/image",
+            "width": width,
+            "height": height,
+            "sizes": [
+                {"width": width // 4, "height": height // 4},
+                {"width": width // 2, "height": height // 2},
+                {"width": width, "height": height},
+            ],
+            "tiles": [{"width": 512, "height": 512, "scaleFactors": [1, 2, 4, 8]}],
+            "profile": [
+                "http://iiif.io/api/image/2/level2.json",
+                {"formats": ["jpg", "png"], "qualities": ["default", "gray"]},
+            ],
+        }
+
+    @staticmethod
+    def uri(pid):
+        return f"info:fedora/{pid}"
+
+    def members(self):
+        return sorted(self.books) + sorted(self.audio)
+
+    def select(self, query):
+        """Answers the risearch queries TuplesSearch makes with a CSV header and rows of values as Fedora writes them."""
+        uri = self.uri
+        if "SELECT $collection0" in query:
+            columns = re.search(r"SELECT (.*?) FROM", query).group(1).split()
+            rows = []
+            for pid, n in re.findall(
+                r"<info:fedora/([^>]+)> fedora-rels-ext:isMemberOfCollection \$collection(\d+)",
+                query,
+            ):
+                model = self.model(pid)
+                if model is None or model == "islandora:pageCModel":
+                    continue
+                for bound in ("fedora-system:FedoraObject-3.0", model):
+                    values = {
+                        f"$collection{n}": uri(self.collection),
+                        f"$model{n}": uri(bound),
+                        f"$modified{n}": self.modified,
+                    }
+                    rows.append([values.get(column, "") for column in columns])
+            for n, book in re.findall(
+                r"\$page(\d+) fedora-rels-ext:isMemberOf <info:fedora/([^>]+)> ;",
+                query,
+            ):
+                for page, number in self.pages(book):
+                    values = {f"$modified{n}": self.modified}
+                    rows.append([values.get(column, "") for column in columns])
+            return [column[1:] for column in columns], rows
+        subject = re.search(
+            r"<info:fedora/([^>]+)> fedora-rels-ext:isMemberOfCollection \$collection",
+            query,
+        )
+        if subject is not None:
+            if self.model(subject.group(1)) is None:
+                return ["collection"], []
+            return ["collection"], [[uri(self.collection)]]
+        book = re.search(
+            r"isMemberOf <info:fedora/([^>]+)> ; isl-rels-ext:isPageNumber", query
+        )
+        if book is not None:
+            return ["page", "numbers"], [
+                [uri(page), str(number)] for page, number in self.pages(book.group(1))
+            ]
+        if "SELECT $object $model $modified" in query:
+            rows = []
+            for pid in self.members():
+                rows.append(
+                    [uri(pid), uri("fedora-system:FedoraObject-3.0"), self.modified]
+                )
+                rows.append([uri(pid), uri(self.model(pid)), self.modified])
+            return ["object", "model", "modified"], rows
+        if "SELECT $book $page $number" in query:
+            return ["book", "page", "number"], [
+                [uri(book), uri(page), str(number)]
+                for book in sorted(self.books)
+                for page, number in self.pages(book)
+            ]
+        if "SELECT $book $modified" in query:
+            return ["book", "modified"], [
+                [uri(book), self.modified]
+                for book in sorted(self.books)
+                for page in self.pages(book)
+            ]
+        if "SELECT $modified" in query:
+            return ["modified"], [[self.modified]]
+        raise Exception(f"The stand-in server does not know how to answer: {query}")
+
+
+class StandInServer:
+    """A local HTTP server that answers risearch, MODS, TECHMD, info.json, and OAI-PMH requests from a
+    StandInRepository.
+
+    Every GET response carries an ETag and a Last-Modified date, and is answered with 304 Not Modified when the
+    request is conditional on them, so revalidating caches can be measured.  not_modified counts those responses.
+
+    Args:
+        repository (StandInRepository): The content to serve.
+        latency (float): Seconds to wait before answering each request.
+        oai_page_size (int): How many records each OAI-PMH ListRecords response holds before its resumptionToken.
+
+    Example:
+        >>> with StandInServer(StandInRepository(books={"bench:1": 10})) as server:
+        ...     ManifestBuilder(server.url, f"{server.url}/fedora/risearch").build("bench:1")
+    """
+
+    def __init__(
+        self, repository, latency=0.0, host="127.0.0.1", port=0, oai_page_size=100
+    ):
+        self.repository = repository
+        self.latency = latency
+        self.oai_page_size = oai_page_size
+        self.requests = 0
+        self.posts = 0
+        self.not_modified = 0
+        self.__lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_port}"
+        self.__thread = None
+
+    def count_request(self, post=False):
+        with self.__lock:
+            self.requests += 1
+            self.posts += 1 if post else 0
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self, form=None):
+                server.count_request(post=form is not None)
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                try:
+                    status, content_type, body = server.respond(
+                        self.path, form if form is not None else ""
+                    )
+                except Exception as e:
+                    status, content_type, body = 500, "text/plain", repr(e)
+                body = body.encode("utf-8")
+                headers = {"Content-Type": content_type}
+                if status == 200 and form is None:
+                    headers["ETag"] = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                    headers["Last-Modified"] = server.last_modified()
+                    if server.is_not_modified(self.headers, headers):
+                        status, body = 304, b""
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                form = self.rfile.read(int(self.headers["Content-Length"]))
+                self.do_GET(form.decode("utf-8"))
+
+        return Handler
+
+    def last_modified(self):
+        """Returns the lastModifiedDate of the repository as an HTTP date."""
+        return formatdate(parse_fedora_date(self.repository.modified), usegmt=True)
+
+    def is_not_modified(self, request_headers, headers):
+        """Returns True, and counts a 304, when a GET is conditional on the ETag or Last-Modified it would get."""
+        if request_headers.get("If-None-Match") is not None:
+            matched = headers["ETag"] in [
+                tag.strip() for tag in request_headers["If-None-Match"].split(",")
+            ]
+        elif request_headers.get("If-Modified-Since") is not None:
+            matched = parsedate_to_datetime(
+                request_headers["If-Modified-Since"]
+            ) >= parsedate_to_datetime(headers["Last-Modified"])
+        else:
+            matched = False
+        if matched:
+            with self.__lock:
+                self.not_modified += 1
+        return matched
+
+    def respond(self, path, form=""):
+        """Returns the status, content type, and body for a request path and the form sent with it by POST, if any."""
+        parts = urlsplit(path)
+        route = re.sub(r"/+", "/", unquote(parts.path))
+        repository = self.repository
+        if route == "/fedora/risearch":
+            query = parse_qs(f"{parts.query}&{form}")["query"][0]
+            header, rows = repository.select(query)
+            lines = [",".join(f'"{name}"' for name in header)]
+            lines.extend(",".join(row) for row in rows)
+            return 200, "text/plain", "\n".join(lines) + "\n"
+        if route == "/oai2":
+            return 200, "application/xml", self.list_records(parse_qs(parts.query))
+        datastream = re.fullmatch(
+            r"/collections/islandora/object/([^/]+)/datastream/(MODS|TECHMD)", route
+        )
+        if datastream is not None:
+            pid = datastream.group(1)
+            if repository.model(pid) is None:
+                return 404, "text/plain", "Not Found"
+            if datastream.group(2) == "MODS":
+                return 200, "application/xml", repository.mods(pid)
+            return 200, "application/xml", repository.techmd(pid)
+        image = re.fullmatch(
+            r"/iiif/2/collections~islandora~object~([^/]+)~datastream~([^/]+)/info\.json",
+            route,
+        )
+        if image is not None and repository.model(image.group(1)) is not None:
+            base = f"{self.url}{parts.path[: -len('/info.json')]}"
+            return (
+                200,
+                "application/json",
+                json.dumps(repository.info_json(base, image.group(1), image.group(2))),
+            )
+        return 404, "text/plain", "Not Found"
+
+    def list_records(self, arguments):
+        """Answers an OAI-PMH ListRecords request with the MODS of every member, a page at a time."""
+        offset = int(arguments.get("resumptionToken", ["0"])[0])
+        members = self.repository.members()
+        records = []
+        for pid in members[offset : offset + self.oai_page_size]:
+            mods = self.repository.mods(pid).split("?>", 1)[1]
+            records.append(
+                f"<record><header><identifier>oai:standin:{pid.replace(':', '_')}</identifier></header>"
+                f"<metadata>{mods}</metadata></record>"
+            )
+        token = offset + self.oai_page_size
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            f"<ListRecords>{''.join(records)}"
+            f"<resumptionToken>{token if token < len(members) else ''}</resumptionToken>"
+            "</ListRecords></OAI-PMH>"
+        )
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,292 @@
+from fedora.client import normalize_url
+from hashlib import sha256
+import threading
+import hmac
+import sqlite3
+import time
+import os
+import re
+
+
+class ResponseCache:
+    """A persistent, content-addressed cache of HTTP responses keyed by URL.
+
+    Bodies are stored once per sha256 digest under the objects directory, and an sqlite index maps each URL to its
+    digest along with the ETag and Last-Modified headers needed to revalidate it.  Entries are fresh for the TTL of
+    their resource type.  Once stale, they are revalidated with If-None-Match and If-Modified-Since so that an
+    unchanged resource costs a 304 instead of a full download.  When the cache grows past max_bytes, the least
+    recently used entries are evicted.
+
+    Only URLs that match a resource type in ttls are cached.  A TTL of None means the resource never goes stale,
+    which is the default for info.json since the dimensions of a JP2 do not change once it is ingested.
+
+    Entries are keyed by the url normalized like fedora.client.normalize_url, so different spellings of one resource
+    share an entry.  Responses fetched with credentials are kept apart from anonymous ones and from those of other
+    credentials, since they may differ.  They are told apart by an HMAC of the credentials with a random secret kept in
+    the directory, so the index holds nothing that could be used to guess them without that secret.
+
+    Args:
+        directory (str): Where to store the index and response bodies.
+        max_bytes (int): The size cap of the stored bodies.
+        ttls (dict): Seconds a response stays fresh keyed by resource type.
+    """
+
+    default_ttls = {"info.json": None, "MODS": 24 * 60 * 60, "TECHMD": 7 * 24 * 60 * 60}
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, ttls=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = ttls if ttls is not None else dict(self.default_ttls)
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.__secret = self.__read_secret()
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"),
+            timeout=30,
+            check_same_thread=False,
+        )
+        with self.__lock, self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, digest TEXT, size INTEGER, "
+                "etag TEXT, last_modified TEXT, stored_at REAL, last_used REAL)"
+            )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+            )
+
+    def __read_secret(self):
+        """Returns the secret of the cache directory, creating it first if this is the first cache to use it."""
+        path = os.path.join(self.directory, "secret")
+        if not os.path.exists(path):
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            descriptor = os.open(
+                temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(descriptor, "wb") as secret:
+                secret.write(os.urandom(32))
+            try:
+                os.link(temporary, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(temporary)
+        with open(path, "rb") as secret:
+            return secret.read()
+
+    def key(self, url, auth=None):
+        """Returns the key a response is stored under, the normalized url followed by an HMAC of the credentials it
+        was fetched with, if any.
+
+        Example:
+            >>> cache.key("https://Digital.lib.utk.edu/iiif/2/collections%7Eislandora%7Eobject%7Ewwiioh:2001%7Edatastream%7ETN/info.json")
+            'https://digital.lib.utk.edu/iiif/2/collections~islandora~object~wwiioh:2001~datastream~TN/info.json'
+        """
+        key = normalize_url(url)
+        if auth is not None:
+            digest = hmac.new(
+                self.__secret, repr(tuple(auth)).encode("utf-8"), sha256
+            ).hexdigest()
+            key = f"{key}#auth={digest}"
+        return key
+
+    @staticmethod
+    def resource_type(url):
+        """Returns info.json or the name of the datastream a url points to, or None if it is neither."""
+        url = url.split("#", 1)[0]
+        if url.endswith("info.json"):
+            return "info.json"
+        datastream = re.search(r"/datastreams?/([^/?]+)", url)
+        if datastream is not None:
+            return datastream.group(1)
+        return None
+
+    def is_cacheable(self, url):
+        return self.resource_type(url) in self.ttls
+
+    def __path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def lookup(self, url):
+        """Returns the index entry for a url as a dict, or None if it has not been cached."""
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(
+                "SELECT digest, etag, last_modified, stored_at FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.__connection.execute(
+                "UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url)
+            )
+        return {
+            "url": url,
+            "digest": row[0],
+            "etag": row[1],
+            "last_modified": row[2],
+            "stored_at": row[3],
+        }
+
+    def is_fresh(self, entry):
+        ttl = self.ttls.get(self.resource_type(entry["url"]))
+        return ttl is None or time.time() - entry["stored_at"] < ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def load(self, entry):
+        """Returns the cached body for an entry, or None if it has been evicted from disk."""
+        try:
+            with open(self.__path(entry["digest"]), "rb") as body:
+                return body.read()
+        except FileNotFoundError:
+            return None
+
+    def store(self, url, content, etag=None, last_modified=None):
+        digest = sha256(content).hexdigest()
+        path = self.__path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as body:
+                body.write(content)
+            os.replace(temporary, path)
+        now = time.time()
+        with self.__lock, self.__connection:
+            previous = self.__connection.execute(
+                "SELECT digest FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, len(content), etag, last_modified, now, now),
+            )
+        if previous is not None and previous[0] != digest:
+            self.__remove_if_unused(previous[0])
+        self.evict()
+
+    def __remove_if_unused(self, digest):
+        """Removes the body of a digest once no entry uses it, returning whether it was removed."""
+        with self.__lock:
+            still_used = self.__connection.execute(
+                "SELECT 1 FROM responses WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+        if still_used is not None:
+            return False
+        try:
+            os.remove(self.__path(digest))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def mark_revalidated(self, url):
+        """Restarts the TTL of an entry after the server answers 304 Not Modified."""
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "UPDATE responses SET stored_at = ? WHERE url = ?", (time.time(), url)
+            )
+
+    def size(self):
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM responses)"
+            ).fetchone()[0]
+
+    def evict(self):
+        """Drops the least recently used entries until the stored bodies fit in max_bytes.
+
+        The size of the bodies is added up once, and the size of each body is taken off as it is removed.
+        """
+        size = self.size()
+        while size > self.max_bytes:
+            with self.__lock, self.__connection:
+                row = self.__connection.execute(
+                    "SELECT url, digest, size FROM responses ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return
+                self.__connection.execute(
+                    "DELETE FROM responses WHERE url = ?", (row[0],)
+                )
+            if self.__remove_if_unused(row[1]):
+                size -= row[2]
+
+    def items(self, resource_type=None):
+        """Yields the url and body of every cached response, optionally only those of one resource type."""
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT url, digest, etag, last_modified, stored_at FROM responses"
+            ).fetchall()
+        for row in rows:
+            if (
+                resource_type is not None
+                and self.resource_type(row[0]) != resource_type
+            ):
+                continue
+            content = self.load(
+                {
+                    "url": row[0],
+                    "digest": row[1],
+                    "etag": row[2],
+                    "last_modified": row[3],
+                    "stored_at": row[4],
+                }
+            )
+            if content is not None:
+                yield row[0].split("#", 1)[0], content
+
+    def __count(self, outcome):
+        with self.__lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def fetch(self, url, send, auth=None):
+        """Returns the body of a url from the cache, revalidating or downloading it as needed.
+
+        Args:
+            url (str): The url to fetch.
+            send (function): Called with a dict of conditional headers and returns a requests.Response.
+            auth (tuple): The username and password send uses, if any, so their response is kept apart.
+
+        Returns:
+            bytes: The body of the response.
+        """
+        url = self.key(url, auth)
+        entry = self.lookup(url)
+        if entry is not None and self.is_fresh(entry):
+            content = self.load(entry)
+            if content is not None:
+                self.__count("hits")
+                return content
+        response = send(self.conditional_headers(entry) if entry is not None else {})
+        if response.status_code == 304 and entry is not None:
+            content = self.load(entry)
+            if content is not None:
+                self.mark_revalidated(url)
+                self.__count("revalidations")
+                return content
+            response = send({})
+        response.raise_for_status()
+        self.store(
+            url,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        self.__count("misses")
+        return response.content
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "bytes": self.size(),
+        }
@@ -0,0 +1,309 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from fedora.codec import loads
+from fedora.instrument import count
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit, urlunsplit
+import threading
+import requests
+import re
+
+
+class HTTPClient:
+    """A pooled HTTP client shared by the risearch, MODS, TECHMD, and info.json fetchers.
+
+    Each host gets its own keep-alive connection pool so that a manifest build pays for one TCP and TLS handshake per
+    connection rather than one per request. Requests are retried with exponential backoff on connection errors and
+    on 429 and 5xx responses.
+
+    Args:
+        pool_size (int): The number of keep-alive connections to hold open for each host.
+        pool_sizes (dict): Optional overrides of pool_size keyed by host name.
+        timeout (tuple): The connect and read timeouts in seconds.
+        retries (int): How many times to retry a failed request.
+        backoff_factor (float): The backoff factor between retries. Sleeps are {backoff factor} * (2 ** retry).
+        cache (fedora.cache.ResponseCache): An optional disk cache consulted before MODS, TECHMD, and info.json
+            requests.
+        throttle (fedora.throttle.HostThrottle): An optional per host rate and concurrency limit applied to every
+            request.
+
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        pool_sizes=None,
+        timeout=(5, 60),
+        retries=3,
+        backoff_factor=0.5,
+        cache=None,
+        throttle=None,
+    ):
+        self.pool_size = pool_size
+        self.cache = cache
+        self.throttle = throttle
+        self.pool_sizes = pool_sizes if pool_sizes is not None else {}
+        self.timeout = timeout
+        self.retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET", "HEAD", "POST"),
+        )
+        self.session = requests.Session()
+        self.requests = 0
+        self.bytes = 0
+        self.__adapters = {}
+        self.__lock = threading.Lock()
+
+    def __mount(self, url):
+        parts = urlsplit(url)
+        prefix = f"{parts.scheme}://{parts.netloc}/"
+        with self.__lock:
+            if prefix not in self.__adapters:
+                size = self.pool_sizes.get(parts.hostname, self.pool_size)
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=size, max_retries=self.retry
+                )
+                self.session.mount(prefix, adapter)
+                self.__adapters[prefix] = adapter
+
+    def __count(self, requests_made=0, bytes_read=0):
+        with self.__lock:
+            self.requests += requests_made
+            self.bytes += bytes_read
+        if requests_made > 0:
+            count("http.requests", requests_made)
+        if bytes_read > 0:
+            count("http.bytes", bytes_read)
+
+    def get(self, url, **kwargs):
+        """Sends a GET request through the pool for the host of the url and returns the requests.Response."""
+        return self.__send("GET", url, **kwargs)
+
+    def post(self, url, data, **kwargs):
+        """Sends a POST request with a form through the pool for the host of the url and returns the requests.Response."""
+        return self.__send("POST", url, data=data, **kwargs)
+
+    def __throttled(self, url):
+        return (
+            self.throttle.request(url) if self.throttle is not None else nullcontext([])
+        )
+
+    def __request(self, method, url, statuses, **kwargs):
+        self.__mount(url)
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        retries = getattr(response.raw, "retries", None)
+        for attempt in retries.history if retries is not None else ():
+            statuses.append(attempt.status)
+        statuses.append(response.status_code)
+        self.__count(requests_made=1)
+        return response
+
+    def __send(self, method, url, **kwargs):
+        with self.__throttled(url) as statuses:
+            return self.__request(method, url, statuses, **kwargs)
+
+    def __download(self, url, auth=None, headers=None):
+        response = self.get(url, auth=auth, headers=headers)
+        self.__count(bytes_read=len(response.content))
+        return response
+
+    def get_content(self, url, auth=None):
+        """Returns the body of a url as bytes, raising requests.HTTPError on a 4xx or 5xx response.
+
+        If the client has a cache and the url is a cacheable resource, the body comes from the cache when it is fresh
+        and the request is made conditional when it is stale.  Requests with credentials other than a username and
+        password tuple are never cached.
+        """
+        if (
+            self.cache is not None
+            and self.cache.is_cacheable(url)
+            and (auth is None or isinstance(auth, tuple))
+        ):
+            return self.cache.fetch(
+                url, lambda headers: self.__download(url, auth, headers), auth
+            )
+        response = self.__download(url, auth)
+        response.raise_for_status()
+        return response.content
+
+    def iter_lines(self, url, auth=None, data=None):
+        """Streams the body of a url line by line, decoded as UTF-8, without holding the whole body in memory.
+
+        The url is requested with GET, or with POST when there is a form to send as data.
+        """
+        with self.__stream(url, auth, data) as response:
+            for line in response.iter_lines():
+                self.__count(bytes_read=len(line) + 1)
+                yield line.decode("utf-8")
+
+    def iter_chunks(self, url, auth=None, chunk_size=64 * 1024, data=None):
+        """Streams the body of a url in chunks of bytes without holding the whole body in memory, sending data by POST
+        like iter_lines."""
+        with self.__stream(url, auth, data) as response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                self.__count(bytes_read=len(chunk))
+                yield chunk
+
+    @contextmanager
+    def __stream(self, url, auth, data):
+        """Sends a streamed request and holds its throttle slot until the body has been read rather than only until
+        the headers arrive, since most of the time a large risearch response takes is spent sending its body.
+        """
+        with self.__throttled(url) as statuses:
+            response = self.__request(
+                "GET" if data is None else "POST",
+                url,
+                statuses,
+                data=data,
+                auth=auth,
+                stream=True,
+            )
+            with response:
+                if response.ok:
+                    yield response
+        response.raise_for_status()
+
+    def get_text(self, url, auth=None):
+        """Returns the body of a url decoded as UTF-8."""
+        return self.get_content(url, auth=auth).decode("utf-8")
+
+    def get_json(self, url, auth=None):
+        """Returns the body of a url parsed as JSON."""
+        return loads(self.get_content(url, auth=auth))
+
+    def stats(self):
+        """Returns counters for requests made, bytes read, and connections opened and reused across every pool.
+
+        A connection is counted as reused each time a request is sent over a keep-alive connection instead of a new
+        one, which is the handshake cost the pools remove.
+        """
+        connections = 0
+        pool_requests = 0
+        with self.__lock:
+            adapters = list(self.__adapters.values())
+            totals = {"requests": self.requests, "bytes": self.bytes}
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+        totals["connections_opened"] = connections
+        totals["connections_reused"] = max(pool_requests - connections, 0)
+        if self.cache is not None:
+            totals["cache"] = self.cache.stats()
+        if self.throttle is not None:
+            totals["throttle"] = self.throttle.stats()
+        return totals
+
+    def close(self):
+        self.session.close()
+
+
+def _decode_unreserved(match):
+    character = chr(int(match.group(1), 16))
+    if character.isascii() and (character.isalnum() or character in "-._~"):
+        return character
+    return match.group(0).upper()
+
+
+def normalize_url(url):
+    """Returns a url in a form where equivalent spellings of the same resource are equal.
+
+    The scheme and host are lowercased and percent-encoded unreserved characters are decoded, so the %7E and ~
+    spellings of info.json urls used by different classes become the same.
+
+    Example:
+        >>> normalize_url("https://Digital.lib.utk.edu/iiif/2/collections%7Eislandora%7Eobject%7Ewwiioh:2001%7Edatastream%7ETN/info.json")
+        'https://digital.lib.utk.edu/iiif/2/collections~islandora~object~wwiioh:2001~datastream~TN/info.json'
+    """
+    parts = urlsplit(url)
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            re.sub(r"%([0-9A-Fa-f]{2})", _decode_unreserved, parts.path),
+            re.sub(r"%([0-9A-Fa-f]{2})", _decode_unreserved, parts.query),
+            parts.fragment,
+        )
+    )
+
+
+class MemoClient:
+    """Wraps a client for the length of one build so that no resource is downloaded twice.
+
+    Responses are remembered by normalized url.  When several threads ask for the same url at once, the first one
+    fetches it and the others wait for its result instead of sending their own request.  Failures are remembered
+    too, since the wrapped client has already retried them.  Streaming methods and anything else are passed through
+    to the wrapped client.  fetched counts the bytes of every response it downloaded.
+
+    Only the most recently used responses are remembered, so a book with thousands of pages, each of which is asked
+    for once, does not keep every info.json in memory.
+
+    Args:
+        client (HTTPClient): The client that makes requests.
+        max_entries (int): How many responses to remember.
+    """
+
+    def __init__(self, client, max_entries=1024):
+        self.client = client
+        self.max_entries = max_entries
+        self.hits = 0
+        self.fetched = 0
+        self.__responses = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_content(self, url, auth=None):
+        """Returns the body of a url as bytes, fetching it only the first time it is asked for."""
+        key = (normalize_url(url), auth)
+        with self.__lock:
+            response = self.__responses.get(key)
+            fetching = response is None
+            if fetching:
+                response = self.__responses[key] = Future()
+                if len(self.__responses) > self.max_entries:
+                    self.__responses.popitem(last=False)
+            else:
+                self.__responses.move_to_end(key)
+                self.hits += 1
+        if not fetching:
+            count("memo.hits")
+        if fetching:
+            try:
+                content = self.client.get_content(url, auth=auth)
+            except Exception as e:
+                response.set_exception(e)
+            else:
+                with self.__lock:
+                    self.fetched += len(content)
+                response.set_result(content)
+        return response.result()
+
+    def get_text(self, url, auth=None):
+        """Returns the body of a url decoded as UTF-8."""
+        return self.get_content(url, auth=auth).decode("utf-8")
+
+    def get_json(self, url, auth=None):
+        """Returns the body of a url parsed as JSON."""
+        return loads(self.get_content(url, auth=auth))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """Returns the process wide HTTPClient used when a class is not handed one explicitly."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
@@ -0,0 +1,139 @@
+from importlib.util import find_spec
+
+
+def _load_json():
+    import json
+
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+    return dumps, json.loads
+
+
+def _load_orjson():
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+
+    return dumps, orjson.loads
+
+
+def _load_msgspec():
+    import msgspec
+
+    def dumps(value):
+        return msgspec.json.encode(value).decode("utf-8")
+
+    return dumps, msgspec.json.decode
+
+
+def _load_element_tree():
+    from xml.etree import ElementTree
+
+    return ElementTree.iterparse, ElementTree.XMLPullParser, ElementTree.tostring
+
+
+def _load_lxml():
+    from lxml import etree
+
+    def iterparse(source, events=("end",)):
+        return etree.iterparse(
+            source, events=events, remove_comments=True, remove_pis=True
+        )
+
+    def pull_parser(events=("end",)):
+        return etree.XMLPullParser(events=events, remove_comments=True, remove_pis=True)
+
+    return iterparse, pull_parser, etree.tostring
+
+
+JSON_BACKENDS = {"json": _load_json}
+if find_spec("msgspec") is not None:
+    JSON_BACKENDS["msgspec"] = _load_msgspec
+if find_spec("orjson") is not None:
+    JSON_BACKENDS["orjson"] = _load_orjson
+
+XML_BACKENDS = {"ElementTree": _load_element_tree}
+if find_spec("lxml") is not None:
+    XML_BACKENDS["lxml"] = _load_lxml
+
+json_backend = next(
+    name for name in ("orjson", "msgspec", "json") if name in JSON_BACKENDS
+)
+xml_backend = "lxml" if "lxml" in XML_BACKENDS else "ElementTree"
+_json = None
+_xml = None
+
+
+def use_backends(json_name=None, xml_name=None):
+    """Chooses which installed libraries encode and decode JSON and parse XML for every caller of this module.
+
+    When this module is imported, the fastest installed backends are chosen: orjson, then msgspec, then the standard
+    library for JSON, and lxml, then ElementTree for XML.  A backend is only imported the first time it is used, so
+    importing this module stays cheap.  Compact JSON is the same bytes from every backend.
+
+    Args:
+        json_name (str): A key of JSON_BACKENDS, or None to keep the current JSON backend.
+        xml_name (str): A key of XML_BACKENDS, or None to keep the current XML backend.
+
+    Example:
+        >>> use_backends(json_name="json", xml_name="ElementTree")
+    """
+    global json_backend, xml_backend, _json, _xml
+    if json_name is not None:
+        if json_name not in JSON_BACKENDS:
+            raise Exception(
+                f"The {json_name} JSON backend is not installed.  Choose from {', '.join(JSON_BACKENDS)}."
+            )
+        json_backend = json_name
+        _json = None
+    if xml_name is not None:
+        if xml_name not in XML_BACKENDS:
+            raise Exception(
+                f"The {xml_name} XML backend is not installed.  Choose from {', '.join(XML_BACKENDS)}."
+            )
+        xml_backend = xml_name
+        _xml = None
+
+
+def _json_functions():
+    global _json
+    if _json is None:
+        _json = JSON_BACKENDS[json_backend]()
+    return _json
+
+
+def _xml_functions():
+    global _xml
+    if _xml is None:
+        _xml = XML_BACKENDS[xml_backend]()
+    return _xml
+
+
+def dumps(value):
+    """Returns a value as compact JSON with no whitespace or escaping of non-ASCII characters."""
+    return _json_functions()[0](value)
+
+
+def loads(document):
+    """Returns the value of a JSON document given as bytes or str."""
+    return _json_functions()[1](document)
+
+
+def iterparse(source, events=("end",)):
+    """Yields events and elements while parsing a binary file handle, like xml.etree.ElementTree.iterparse.
+
+    Comments and processing instructions are left out with every backend.
+    """
+    return _xml_functions()[0](source, events=events)
+
+
+def pull_parser(events=("end",)):
+    """Returns a parser that is fed chunks and yields events, like xml.etree.ElementTree.XMLPullParser."""
+    return _xml_functions()[1](events=events)
+
+
+def tostring(element):
+    """Returns an element serialized as bytes."""
+    return _xml_functions()[2](element)
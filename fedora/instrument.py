@@ -0,0 +1,305 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from fedora.codec import dumps
+import threading
+import time
+import sys
+import os
+
+_active = ContextVar("instrument_active", default=None)
+_inactive = nullcontext()
+
+
+class Recorder:
+    """Collects the spans and counters of one build, from every thread that works on it.
+
+    Args:
+        name (str): The name of the root span, like build.
+        **attributes: Details of the build, like its pid, that are copied to the report and the root span.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.counters = {}
+        self.started = time.time_ns()
+        self.finished = None
+        self.__next_id = 0
+        self.__lock = threading.Lock()
+
+    def new_span_id(self):
+        with self.__lock:
+            self.__next_id += 1
+            return f"{self.__next_id:016x}"
+
+    def add_span(self, span_id, parent_id, name, start, end, attributes):
+        with self.__lock:
+            self.spans.append((span_id, parent_id, name, start, end, attributes))
+
+    def add(self, name, amount=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        self.finished = time.time_ns()
+
+    def report(self):
+        """Returns how many times each kind of span ran, how long they took in total and at most, and the counters."""
+        spans = {}
+        with self.__lock:
+            for _, _, name, start, end, _ in self.spans:
+                seconds = (end - start) / 1e9
+                summary = spans.setdefault(
+                    name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+                )
+                summary["count"] += 1
+                summary["seconds"] += seconds
+                summary["max_seconds"] = max(summary["max_seconds"], seconds)
+            counters = dict(self.counters)
+        finished = self.finished if self.finished is not None else time.time_ns()
+        return {
+            "name": self.name,
+            "attributes": self.attributes,
+            "seconds": (finished - self.started) / 1e9,
+            "spans": spans,
+            "counters": counters,
+        }
+
+    def otel(self):
+        """Returns the spans as an OTLP JSON trace, the format the OpenTelemetry collector reads from files."""
+        with self.__lock:
+            spans = list(self.spans)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otel_attributes(
+                            {"service.name": "iiif-manifest-generator"}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "fedora.instrument"},
+                            "spans": [
+                                _otel_span(self.trace_id, *span) for span in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+def _otel_attributes(attributes):
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            values.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            values.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            values.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            values.append({"key": key, "value": {"stringValue": str(value)}})
+    return values
+
+
+def _otel_span(trace_id, span_id, parent_id, name, start, end, attributes):
+    span = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start),
+        "endTimeUnixNano": str(end),
+        "attributes": _otel_attributes(attributes),
+    }
+    if parent_id is not None:
+        span["parentSpanId"] = parent_id
+    if "error" in attributes:
+        span["status"] = {"code": 2, "message": attributes["error"]}
+    return span
+
+
+class _Span:
+    __slots__ = (
+        "recorder",
+        "name",
+        "attributes",
+        "span_id",
+        "parent_id",
+        "start",
+        "token",
+    )
+
+    def __init__(self, recorder, parent_id, name, attributes):
+        self.recorder = recorder
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.span_id = recorder.new_span_id()
+        self.start = None
+        self.token = None
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self.token = _active.set((self.recorder, self.span_id))
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        _active.reset(self.token)
+        if error is not None:
+            self.attributes["error"] = repr(error)
+        self.recorder.add_span(
+            self.span_id,
+            self.parent_id,
+            self.name,
+            self.start,
+            time.time_ns(),
+            self.attributes,
+        )
+        return False
+
+
+def span(name, **attributes):
+    """Times the work inside the context as a span of the build being recorded, if there is one.
+
+    Spans opened inside the context, including in threads started with bind, are its children.  When nothing is being
+    recorded this does nothing, so it is cheap enough to leave around every request.
+
+    Example:
+        >>> with span("info.json", pid="agrtfhs:2279"):
+        ...     info = client.get_json(url)
+    """
+    active = _active.get()
+    if active is None:
+        return _inactive
+    return _Span(active[0], active[1], name, attributes)
+
+
+def record(name, start, end, **attributes):
+    """Adds a span for work that was already timed, like a stream that was read lazily, with times from time.time_ns."""
+    active = _active.get()
+    if active is not None:
+        recorder, parent_id = active
+        recorder.add_span(
+            recorder.new_span_id(), parent_id, name, start, end, attributes
+        )
+
+
+def count(name, amount=1):
+    """Adds to a counter of the build being recorded, if there is one."""
+    active = _active.get()
+    if active is not None:
+        active[0].add(name, amount)
+
+
+def bind(function):
+    """Returns function wrapped to run in a copy of the current context so spans it opens in another thread belong to
+    the same build.  Bind once for each submission to a thread pool, since a context can only run in one thread at once.
+
+    Example:
+        >>> executor.submit(bind(build_canvas), page)
+    """
+    if _active.get() is None:
+        return function
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+@contextmanager
+def recording(recorder, name=None, **attributes):
+    """Records spans and counters in the context to recorder, inside a root span named name or after the recorder.
+
+    A build that moves between threads can be recorded in parts by entering this once in each thread.  With a
+    recorder of None, nothing is recorded.
+    """
+    if recorder is None:
+        yield None
+        return
+    token = _active.set((recorder, None))
+    try:
+        with span(
+            name if name is not None else recorder.name,
+            **(attributes if len(attributes) > 0 else recorder.attributes),
+        ):
+            yield recorder
+    finally:
+        _active.reset(token)
+
+
+class ReportWriter:
+    """Writes the report of each recorded build as a line of JSON, and optionally its spans as a line of OTLP JSON.
+
+    Args:
+        reports (file): A text file handle to write reports to, or None to not write them.
+        spans (file): A text file handle to write spans to, or None to not write them.
+    """
+
+    def __init__(self, reports=None, spans=None):
+        self.reports = reports
+        self.spans = spans
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def recording(self, name, **attributes):
+        """Records the context as one build and writes it when the context exits, even if it raised."""
+        recorder = Recorder(name, **attributes)
+        try:
+            with recording(recorder):
+                yield recorder
+        finally:
+            self.write(recorder)
+
+    def write(self, recorder):
+        recorder.finish()
+        with self.__lock:
+            if self.reports is not None:
+                self.reports.write(dumps(recorder.report()) + "\n")
+                self.reports.flush()
+            if self.spans is not None:
+                self.spans.write(dumps(recorder.otel()) + "\n")
+                self.spans.flush()
+
+
+class Profiler:
+    """Profiles the calling thread with cProfile, along with every thread started while it runs, so work done in
+    thread pools shows up in the statistics.
+
+    Python 3.12 and later profile every thread from a single profiler.  Before that, each new thread gets its own
+    profiler and their statistics are combined.
+    """
+
+    def __init__(self):
+        import cProfile
+
+        self.__profile = cProfile.Profile
+        self.profiles = [cProfile.Profile()]
+        self.__lock = threading.Lock()
+
+    def __profile_thread(self, frame, event, argument):
+        profile = self.__profile()
+        with self.__lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.__profile_thread)
+        self.profiles[0].enable()
+        return self
+
+    def stop(self):
+        self.profiles[0].disable()
+        threading.setprofile(None)
+
+    def stats(self, stream=None):
+        """Returns the combined statistics as a pstats.Stats."""
+        import pstats
+
+        stats = pstats.Stats(self.profiles[0], stream=stream)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        return stats
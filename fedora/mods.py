@@ -1,6 +1,132 @@
-import requests
-import xmltodict
-import arrow
+from fedora.client import default_client
+from fedora.codec import iterparse
+from fedora.instrument import count, span
+from datetime import date
+import io
+import re
+
+
+def _local_name(name):
+    return name.rsplit("}", 1)[-1]
+
+
+def _text(element):
+    return element.text.strip() if element.text is not None else ""
+
+
+def _format_navigation_date(value):
+    match = re.fullmatch(r"([0-9]{4})(?:-([0-9]{2})(?:-([0-9]{2}))?)?", value)
+    if match is not None:
+        year, month, day = (int(part) if part else 1 for part in match.groups())
+        return f"{date(year, month, day).isoformat()}T00:00:00Z"
+    import arrow
+
+    return f"{arrow.get(value).format('YYYY-MM-DD')}T00:00:00Z"
+
+
+class MODSRecord:
+    """The parts of a MODS record used to describe a manifest, read in a single pass over the document.
+
+    Only children of the top level mods element are read, so titles, dates, and subjects of related items are ignored.
+    Elements are matched by local name so records with or without the mods namespace or prefix are read the same way.
+
+    Attributes:
+        title (str): The first title.
+        main_title (str): The first title of a titleInfo without a type, so alternative titles are skipped.
+        abstract (str): The first abstract.
+        rights (str): The first accessCondition/@xlink:href.
+        attribution (str): The text of the first accessCondition.
+        topics (list): Every subject/topic in document order.  A subject with several topics adds each of them, where
+            the dictionary this replaced nested them in a list of their own.
+        publisher (str): The first originInfo/publisher.
+        table_of_contents (str): The first tableOfContents, or None if there is not one.
+        navigation_date (str): The dateIssued when there is only one and it has attributes, or else the first encoded
+            dateIssued, or else the first encoded dateCreated, as an xsd:dateTime, or None.
+    """
+
+    __slots__ = (
+        "title",
+        "main_title",
+        "abstract",
+        "rights",
+        "attribution",
+        "topics",
+        "publisher",
+        "table_of_contents",
+        "navigation_date",
+    )
+
+    def __init__(self, document):
+        self.title = None
+        self.main_title = None
+        self.abstract = None
+        self.rights = None
+        self.attribution = None
+        self.topics = []
+        self.publisher = None
+        self.table_of_contents = None
+        self.navigation_date = None
+        self.__read(document)
+        self.title = self.title if self.title is not None else ""
+        self.main_title = self.main_title if self.main_title is not None else self.title
+        self.abstract = self.abstract if self.abstract is not None else ""
+        self.rights = self.rights if self.rights is not None else ""
+        self.attribution = self.attribution if self.attribution is not None else ""
+        self.publisher = self.publisher if self.publisher is not None else ""
+
+    def __read(self, document):
+        if isinstance(document, str):
+            document = document.encode("utf-8")
+        dates_issued = []
+        date_created = None
+        path = []
+        parents = []
+        for event, element in iterparse(io.BytesIO(document), events=("start", "end")):
+            if event == "start":
+                path.append(_local_name(element.tag))
+                parents.append(element)
+                continue
+            location = tuple(path[1:])
+            if location == ("titleInfo", "title"):
+                if self.title is None:
+                    self.title = _text(element)
+                if self.main_title is None and "type" not in parents[-2].attrib:
+                    self.main_title = _text(element)
+            elif location == ("abstract",) and self.abstract is None:
+                self.abstract = _text(element)
+            elif location == ("accessCondition",):
+                for name, value in element.attrib.items():
+                    if _local_name(name) == "href" and self.rights is None:
+                        self.rights = value
+                if self.attribution is None and _text(element) != "":
+                    self.attribution = _text(element)
+            elif location == ("subject", "topic"):
+                self.topics.append(_text(element))
+            elif location == ("originInfo", "publisher") and self.publisher is None:
+                self.publisher = _text(element)
+            elif location == ("originInfo", "dateIssued"):
+                dates_issued.append((_text(element), element.attrib))
+            elif location == ("originInfo", "dateCreated") and date_created is None:
+                if "encoding" in element.attrib:
+                    date_created = _text(element)
+            elif location == ("tableOfContents",) and self.table_of_contents is None:
+                self.table_of_contents = _text(element)
+            path.pop()
+            parents.pop()
+            if len(path) == 1:
+                element.clear()
+        if len(dates_issued) == 1 and len(dates_issued[0][1]) > 0:
+            try:
+                self.navigation_date = _format_navigation_date(dates_issued[0][0])
+                return
+            except ValueError:
+                pass
+        encoded = [
+            text for text, attributes in dates_issued if "encoding" in attributes
+        ]
+        date = encoded[0] if len(encoded) > 0 else date_created
+        if date is not None:
+            self.navigation_date = _format_navigation_date(date)
 
 
 class MODSScraper:
@@ -9,19 +135,28 @@ class MODSScraper:
         fedora_pid,
         islandora_frontend="https://digital.lib.utk.edu/collections/",
         presentation_api_version=2,
+        client=None,
+        source=None,
     ):
         self.pid = fedora_pid
-        self.mods_xml = self.__get_mods(
+        self.client = client if client is not None else default_client()
+        self.source = source
+        mods = self.__get_mods(
             f"{islandora_frontend}/islandora/object/{fedora_pid}/datastream/MODS"
         )
-        self.mods_dict = xmltodict.parse(self.mods_xml)
+        with span("mods.parse", pid=fedora_pid):
+            self.record = MODSRecord(mods)
         self.label = self.get_title()
         self.description = self.get_abstract()
         self.navigation_date = self.get_navigation_date()
 
-    @staticmethod
-    def __get_mods(uri):
-        return requests.get(uri).content.decode("utf-8")
+    def __get_mods(self, uri):
+        with span("mods.fetch", pid=self.pid):
+            mods = self.source.get(self.pid) if self.source is not None else None
+            if mods is not None:
+                count("mods.from_source")
+                return mods
+            return self.client.get_content(uri)
 
     def get_title(self):
         """
@@ -31,13 +166,9 @@ class MODSScraper:
         intended to be displayed as a short, textual surrogate for the resource if a human needs to make a distinction
         between it and similar resources, for example between pages or between a choice of images to display.
 
-        @todo: This needs refinement.  Grabs first title value in a messy way that wasn't thought out very much.
+        @todo: This needs refinement.  Grabs the first title even if it is an alternative title.
         """
-        if type(self.mods_dict["mods"]["titleInfo"]) is list:
-            titles = [title["title"] for title in self.mods_dict["mods"]["titleInfo"]]
-            return titles[0]
-        else:
-            return self.mods_dict["mods"]["titleInfo"]["title"]
+        return self.record.title
 
     def get_abstract(self):
         """
@@ -53,16 +184,14 @@ class MODSScraper:
         A manifest must have at least one label, such as the name of the object or title of the intellectual work that
         it embodies.
         """
-        try:
-            return self.mods_dict["mods"]["abstract"]
-        except KeyError:
-            return ""
+        return self.record.abstract
 
     def __get_abstract_v3(self):
-        if self.get_abstract() != "":
+        abstract = self.get_abstract()
+        if abstract != "":
             return {
                 "label": {"en": ["Abstract"]},
-                "value": {"en": [self.get_abstract()]},
+                "value": {"en": [abstract]},
             }
         else:
             return ""
@@ -86,10 +215,7 @@ class MODSScraper:
         the requiredStatement property or in the metadata property. The value must be a string. If the value is drawn
         from Creative Commons or RightsStatements.org, then the string must be a URI defined by that specification.
         """
-        try:
-            return self.mods_dict["mods"]["accessCondition"]["@xlink:href"]
-        except KeyError:
-            return ""
+        return self.record.rights
 
     def get_attribution(self):
         """
@@ -102,10 +228,7 @@ class MODSScraper:
         display. If there are multiple values of the same or unspecified language, then all of those values must be
         displayed.
         """
-        try:
-            return self.mods_dict["mods"]["accessCondition"]["#text"]
-        except KeyError:
-            return ""
+        return self.record.attribution
 
     def get_other_metadata(self):
         """
@@ -134,22 +257,15 @@ class MODSScraper:
         """
         Gets topics from a MODS record.
 
-        @todo: This code is somewhat problematic.  It assumes that there is more than one subject.  If there was only
-        one subject, this would throw an exception.
+        Every topic of every subject is returned in one flat list, so a subject with several topics adds each of them.
 
         """
-        if "subject" in self.mods_dict["mods"]:
-            return [
-                subject["topic"]
-                for subject in self.mods_dict["mods"]["subject"]
-                if "topic" in subject
-            ]
-        else:
-            return []
+        return self.record.topics
 
     def __get_topics_v3(self):
-        if len(self.get_topics()) != 0:
-            return {"label": {"en": ["Topics"]}, "value": {"en": self.get_topics()}}
+        topics = self.get_topics()
+        if len(topics) != 0:
+            return {"label": {"en": ["Topics"]}, "value": {"en": topics}}
         else:
             return ""
 
@@ -158,17 +274,14 @@ class MODSScraper:
         Gets the publisher of a book if one exists.
 
         """
-        try:
-            if "publisher" in self.mods_dict["mods"]["originInfo"]:
-                return self.mods_dict["mods"]["originInfo"]["publisher"]
-        except KeyError:
-            return ""
+        return self.record.publisher
 
     def __get_publisher_v3(self):
-        if self.get_publisher() != "":
+        publisher = self.get_publisher()
+        if publisher != "":
             return {
                 "label": {"en": ["Publisher"]},
-                "value": {"en": [self.get_publisher()]},
+                "value": {"en": [publisher]},
             }
         else:
             return ""
@@ -177,8 +290,7 @@ class MODSScraper:
         """
         Gets the table of contents if one exists.
         """
-        if "tableOfContents" in self.mods_dict["mods"]:
-            return self.mods_dict["mods"]["tableOfContents"]
+        return self.record.table_of_contents
 
     def get_navigation_date(self):
         """
@@ -193,53 +305,19 @@ class MODSScraper:
         the user, should be included in the metadata property for human consumption. A collection or manifest may have
         exactly one navigation date associated with it."
 
-        This is messy.  First, it looks for dateIssued only because we have complex data for dates.  Ideally, this would
-        look for other things, but I don't know where to look for an exhaustive list for this.
+        This is messy.  It looks for a lone dateIssued with attributes first, then a dateIssued with an encoding, then
+        a dateCreated with an encoding, because we have complex data for dates.  Ideally, this would look for other
+        things, but I don't know where to look for an exhaustive list for this.
 
-        Another possible issue: this looks for two types: dict and list.  If dateIssue is only one value, is it a dict
-        or an OrderedDict?
-        @todo: What does xmltodict do with single values? Should it be OrderedDict instead?
         @todo: What other dates should this look for?
 
         Returns:
             Tuple: A tuple with a boolean of whether there is a date and a string of the xsd formatted date.
 
         """
-        try:
-            if "dateIssued" in self.mods_dict["mods"]["originInfo"]:
-                if type(self.mods_dict["mods"]["originInfo"]["dateIssued"]) is dict:
-                    return (
-                        True,
-                        f"{str(arrow.get(self.mods_dict['mods']['originInfo']['dateIssued']['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                    )
-                elif type(self.mods_dict["mods"]["originInfo"]["dateIssued"]) is list:
-                    for date in self.mods_dict["mods"]["originInfo"]["dateIssued"]:
-                        if "@encoding" in date:
-                            return (
-                                True,
-                                f"{str(arrow.get(date['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                            )
-            if "dateCreated" in self.mods_dict["mods"]["originInfo"]:
-                if (
-                    type(self.mods_dict["mods"]["originInfo"]["dateCreated"]) is dict
-                    and "@encoding"
-                    in self.mods_dict["mods"]["originInfo"]["dateCreated"]
-                ):
-                    return (
-                        True,
-                        f"{str(arrow.get(self.mods_dict['mods']['originInfo']['dateCreated']['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                    )
-                elif type(self.mods_dict["mods"]["originInfo"]["dateCreated"]) is list:
-                    for date in self.mods_dict["mods"]["originInfo"]["dateCreated"]:
-                        if "@encoding" in date:
-                            return (
-                                True,
-                                f"{str(arrow.get(date['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                            )
-            else:
-                return False, ""
-        except KeyError:
+        if self.record.navigation_date is None:
             return False, ""
+        return True, self.record.navigation_date
 
     def build_iiif_descriptive_metadata_v2(self):
         metadata = {
@@ -261,8 +339,8 @@ class MODSScraper:
             "rights": self.get_license_or_rights(),
             "metadata": self.build_iiif_v3_metadata_section(),
         }
-        if self.get_abstract() != "":
-            metadata["summary"] = {"en": [self.get_abstract()]}
+        if self.description != "":
+            metadata["summary"] = {"en": [self.description]}
         if self.navigation_date[0] is True:
             metadata["navDate"] = self.navigation_date[1]
         return metadata
@@ -282,32 +360,30 @@ class MODSParser:
         fedora_pid,
         fedora_url="http://localhost:8080",
         auth=("fedoraAdmin", "fedoraAdmin"),
+        client=None,
+        source=None,
     ):
         self.pid = fedora_pid
+        self.client = client if client is not None else default_client()
+        self.source = source
         self.url = fedora_url
         self.auth = (auth,)
-        self.mods_xml = self.__get_mods(
-            f"{fedora_url}/fedora/objects/{fedora_pid}/datastreams/MODS/content", auth
+        self.record = MODSRecord(
+            self.__get_mods(
+                f"{fedora_url}/fedora/objects/{fedora_pid}/datastreams/MODS/content",
+                auth,
+            )
         )
-        self.mods_dict = xmltodict.parse(self.mods_xml)
         self.label = self.get_label()
         self.navigation_date = self.get_navigation_date()
 
-    @staticmethod
-    def __get_mods(uri, auth):
-        return requests.get(uri, auth=auth).content.decode("utf-8")
+    def __get_mods(self, uri, auth):
+        mods = self.source.get(self.pid) if self.source is not None else None
+        return mods if mods is not None else self.client.get_content(uri, auth=auth)
 
     def get_label(self):
         """Find a label for the object based on this xpath: mods:titleInfo[not(@type="alternative")]/mods:title"""
-        if type(self.mods_dict["mods"]["titleInfo"]) is list:
-            titles = [
-                title["title"]
-                for title in self.mods_dict["mods"]["titleInfo"]
-                if "@type" not in title
-            ]
-            return titles[0]
-        else:
-            return self.mods_dict["mods"]["titleInfo"]["title"]
+        return self.record.main_title
 
     def get_license_or_rights(self):
         """
@@ -328,10 +404,7 @@ class MODSParser:
         the requiredStatement property or in the metadata property. The value must be a string. If the value is drawn
         from Creative Commons or RightsStatements.org, then the string must be a URI defined by that specification.
         """
-        try:
-            return self.mods_dict["mods"]["accessCondition"]["@xlink:href"]
-        except KeyError:
-            return ""
+        return self.record.rights
 
     def get_attribution(self):
         """
@@ -344,10 +417,7 @@ class MODSParser:
         display. If there are multiple values of the same or unspecified language, then all of those values must be
         displayed.
         """
-        try:
-            return self.mods_dict["mods"]["accessCondition"]["#text"]
-        except KeyError:
-            return ""
+        return self.record.attribution
 
     def get_abstract(self):
         """
@@ -363,10 +433,7 @@ class MODSParser:
         A manifest must have at least one label, such as the name of the object or title of the intellectual work that
         it embodies.
         """
-        try:
-            return self.mods_dict["mods"]["abstract"]
-        except KeyError:
-            return ""
+        return self.record.abstract
 
     def get_navigation_date(self):
         """
@@ -381,53 +448,19 @@ class MODSParser:
         the user, should be included in the metadata property for human consumption. A collection or manifest may have
         exactly one navigation date associated with it."
 
-        This is messy.  First, it looks for dateIssued only because we have complex data for dates.  Ideally, this would
-        look for other things, but I don't know where to look for an exhaustive list for this.
+        This is messy.  It looks for a lone dateIssued with attributes first, then a dateIssued with an encoding, then
+        a dateCreated with an encoding, because we have complex data for dates.  Ideally, this would look for other
+        things, but I don't know where to look for an exhaustive list for this.
 
-        Another possible issue: this looks for two types: dict and list.  If dateIssue is only one value, is it a dict
-        or an OrderedDict?
-        @todo: What does xmltodict do with single values? Should it be OrderedDict instead?
         @todo: What other dates should this look for?
 
         Returns:
             Tuple: A tuple with a boolean of whether there is a date and a string of the xsd formatted date.
 
         """
-        try:
-            if "dateIssued" in self.mods_dict["mods"]["originInfo"]:
-                if type(self.mods_dict["mods"]["originInfo"]["dateIssued"]) is dict:
-                    return (
-                        True,
-                        f"{str(arrow.get(self.mods_dict['mods']['originInfo']['dateIssued']['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                    )
-                elif type(self.mods_dict["mods"]["originInfo"]["dateIssued"]) is list:
-                    for date in self.mods_dict["mods"]["originInfo"]["dateIssued"]:
-                        if "@encoding" in date:
-                            return (
-                                True,
-                                f"{str(arrow.get(date['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                            )
-            if "dateCreated" in self.mods_dict["mods"]["originInfo"]:
-                if (
-                    type(self.mods_dict["mods"]["originInfo"]["dateCreated"]) is dict
-                    and "@encoding"
-                    in self.mods_dict["mods"]["originInfo"]["dateCreated"]
-                ):
-                    return (
-                        True,
-                        f"{str(arrow.get(self.mods_dict['mods']['originInfo']['dateCreated']['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                    )
-                elif type(self.mods_dict["mods"]["originInfo"]["dateCreated"]) is list:
-                    for date in self.mods_dict["mods"]["originInfo"]["dateCreated"]:
-                        if "@encoding" in date:
-                            return (
-                                True,
-                                f"{str(arrow.get(date['#text']).format('YYYY-MM-DD'))}T00:00:00Z",
-                            )
-            else:
-                return False, ""
-        except KeyError:
+        if self.record.navigation_date is None:
             return False, ""
+        return True, self.record.navigation_date
 
     def build_iiif_descriptive_metadata_v2(self):
         metadata = {
@@ -1,25 +1,181 @@
-import requests
+from fedora.client import default_client
+from fedora.instrument import record
+from fedora.tuples import parse_fedora_date, read_csv, read_sparql_xml, read_tsv
+from urllib.parse import quote, urlencode
+import time
+import re
+
+PREFIXES = (
+    ("fedora-model", "info:fedora/fedora-system:def/model#"),
+    ("fedora-rels-ext", "info:fedora/fedora-system:def/relations-external#"),
+    ("fedora-view", "info:fedora/fedora-system:def/view#"),
+    ("isl-rels-ext", "http://islandora.ca/ontology/relsext#"),
+)
+
+MAX_GET_URL_LENGTH = 4000
+
+
+def _timed_rows(rows, select):
+    start = time.time_ns()
+    number = 0
+    for row in rows:
+        number += 1
+        yield row
+    record(
+        "risearch.query",
+        start,
+        time.time_ns(),
+        select=select,
+        rows=number,
+    )
+
+
+def object_uri(pid):
+    """Returns the Fedora object URI of a PID as a SPARQL IRI, refusing PIDs that could change the query around it.
+
+    Example:
+        >>> object_uri("agrtfhs:2275")
+        '<info:fedora/agrtfhs:2275>'
+    """
+    if re.search(r'[\s<>"{}|^`\\]', pid) is not None or pid == "":
+        raise Exception(f"{pid!r} is not a PID that can be used in a query.")
+    return f"<info:fedora/{pid}>"
+
+
+def _prefixes(pattern):
+    return "".join(
+        f"PREFIX {name}: <{uri}> " for name, uri in PREFIXES if f"{name}:" in pattern
+    )
+
+
+class SparqlTemplate:
+    """A SPARQL SELECT against the resource index that is put together once and filled in for each query.
+
+    Only the PREFIX declarations the pattern uses are written.  Placeholders in the pattern are written like {pid}
+    and literal braces like {{ and }}, as in str.format.  Values are inserted with object_uri, so each must be a PID.
+
+    Args:
+        select (str): The variables to select, like "$page $numbers".
+        where (str): The graph pattern inside WHERE, without its surrounding braces.
+
+    Example:
+        >>> PAGES.render(pid="agrtfhs:2275")
+        'PREFIX fedora-rels-ext: <info:fedora/fedora-system:def/relations-external#> PREFIX isl-rels-ext: ...'
+    """
+
+    def __init__(self, select, where):
+        self.select = select
+        self.text = (
+            f"{_prefixes(where)}SELECT {select} FROM <#ri> WHERE {{{{ {where} }}}}"
+        )
+
+    def render(self, **pids):
+        """Returns the query with each placeholder replaced by the object URI of a PID."""
+        return self.text.format(**{name: object_uri(pid) for name, pid in pids.items()})
+
+
+class SparqlUnion:
+    """A SPARQL SELECT that is a UNION of patterns for each of many PIDs, for looking them up with one query.
+
+    Each pattern has the object URI of its PID bound in place, so the resource index looks up the triples of that
+    PID rather than scanning every triple of the predicate.  The resource index only speaks SPARQL 1.0, which has
+    neither VALUES nor BIND to report which PID a row belongs to, so each PID gets its own numbered copy of the
+    variables, like $collection0 and $collection1, and read tells rows apart by which of them are bound.
+
+    Args:
+        variables (tuple): The names of the variables each PID has, without the $.
+        patterns (str): The patterns of each PID, with {pid} and {n} placeholders, like
+            "{pid} fedora-model:hasModel $model{n} .".  Each is a branch of the UNION.
+    """
+
+    def __init__(self, variables, *patterns):
+        self.variables = variables
+        self.select = " ".join(f"${variable}" for variable in variables)
+        self.patterns = [f"{{{{ {pattern} }}}}" for pattern in patterns]
+        self.text = f"{_prefixes(' '.join(patterns))}SELECT {{select}} FROM <#ri> WHERE {{{{ {{branches}} }}}}"
+
+    def render(self, pids):
+        """Returns the query for a list of PIDs."""
+        return self.text.format(
+            select=" ".join(
+                f"${variable}{n}"
+                for n in range(len(pids))
+                for variable in self.variables
+            ),
+            branches=" UNION ".join(
+                pattern.format(pid=object_uri(pid), n=n)
+                for n, pid in enumerate(pids)
+                for pattern in self.patterns
+            ),
+        )
+
+    def read(self, pids, rows):
+        """Yields the PID and the values of its variables for each row of the query rendered for a list of PIDs.
+
+        Variables a row does not bind are None.
+        """
+        width = len(self.variables)
+        for row in rows:
+            for n, pid in enumerate(pids):
+                values = tuple(
+                    value if value not in ("", None) else None
+                    for value in row[n * width : (n + 1) * width]
+                )
+                if any(value is not None for value in values):
+                    yield pid, values
+                    break
+
+
+PAGES = SparqlTemplate(
+    "$page $numbers",
+    "$page fedora-rels-ext:isMemberOf {pid} ; isl-rels-ext:isPageNumber $numbers .",
+)
+PARENT_COLLECTION = SparqlTemplate(
+    "$collection", "{pid} fedora-rels-ext:isMemberOfCollection $collection ."
+)
+COLLECTIONS_AND_MODELS = SparqlUnion(
+    ("collection", "model"),
+    "{pid} fedora-rels-ext:isMemberOfCollection $collection{n} ; fedora-model:hasModel $model{n} .",
+)
+COLLECTIONS_MODELS_AND_LAST_MODIFIED = SparqlUnion(
+    ("collection", "model", "modified"),
+    "{pid} fedora-rels-ext:isMemberOfCollection $collection{n} ; fedora-model:hasModel $model{n} ; "
+    "fedora-view:lastModifiedDate $modified{n} .",
+    "$page{n} fedora-rels-ext:isMemberOf {pid} ; fedora-view:lastModifiedDate $modified{n} .",
+)
+COLLECTION_MEMBERS = SparqlTemplate(
+    "$object $model $modified",
+    "$object fedora-rels-ext:isMemberOfCollection {pid} ; fedora-model:hasModel $model ; "
+    "fedora-view:lastModifiedDate $modified .",
+)
+COLLECTION_PAGES = SparqlTemplate(
+    "$book $page $number",
+    "$book fedora-rels-ext:isMemberOfCollection {pid} . $page fedora-rels-ext:isMemberOf $book ; "
+    "isl-rels-ext:isPageNumber $number .",
+)
+COLLECTION_PAGES_LAST_MODIFIED = SparqlTemplate(
+    "$book $modified",
+    "$book fedora-rels-ext:isMemberOfCollection {pid} . $page fedora-rels-ext:isMemberOf $book ; "
+    "fedora-view:lastModifiedDate $modified .",
+)
+LAST_MODIFIED = SparqlTemplate(
+    "$modified",
+    "{{ {pid} fedora-view:lastModifiedDate $modified . }} UNION {{ $page fedora-rels-ext:isMemberOf {pid} ; "
+    "fedora-view:lastModifiedDate $modified . }}",
+)
 
 
 class ResourceIndexSearch:
-    def __init__(self, risearch_endpoint="http://localhost:8080/fedora/risearch"):
+    def __init__(
+        self, risearch_endpoint="http://localhost:8080/fedora/risearch", client=None
+    ):
         self.risearch_endpoint = risearch_endpoint
+        self.client = client if client is not None else default_client()
 
     @staticmethod
     def escape_query(query):
-        return (
-            query.replace("*", "%2A")
-            .replace(" ", "%20")
-            .replace("<", "%3C")
-            .replace(":", "%3A")
-            .replace(">", "%3E")
-            .replace("#", "%23")
-            .replace("\n", "")
-            .replace("?", "%3F")
-            .replace("{", "%7B")
-            .replace("}", "%7D")
-            .replace("/", "%2F")
-        )
+        """Percent-encodes a query to be sent as the value of the query parameter of a url."""
+        return quote(query.replace("\n", ""), safe="")
 
     def validate_language(self, language):
         if language in self.valid_languages:
@@ -39,15 +195,15 @@ class ResourceIndexSearch:
 
 
 class TriplesSearch(ResourceIndexSearch):
-    def __init__(self, language="spo", riformat="Turtle"):
-        ResourceIndexSearch.__init__(self)
+    def __init__(self, language="spo", riformat="Turtle", client=None):
+        ResourceIndexSearch.__init__(self, client=client)
         self.valid_languages = ("spo", "itql", "sparql")
         self.valid_formats = ("N-Triples", "Notation 3", "RDF/XML", "Turtle")
         self.language = self.validate_language(language)
         self.format = self.validate_format(riformat)
-        self.base_url = (
-            f"{self.risearch_endpoint}?type=triples"
-            f"&lang={self.language}&format={self.format}"
+        self.base_url = f"{self.risearch_endpoint}?" + urlencode(
+            {"type": "triples", "lang": self.language, "format": self.format},
+            quote_via=quote,
         )
 
     def get_pages_from_a_book(self, book_pid):
@@ -56,10 +212,9 @@ class TriplesSearch(ResourceIndexSearch):
                 f"You must use spo as language for this method.  You used {self.language}."
             )
         spo_query = self.escape_query(
-            f"* <info:fedora/fedora-system:def/relations-external#isMemberOf> <info:fedora/{book_pid}>"
+            f"* <info:fedora/fedora-system:def/relations-external#isMemberOf> {object_uri(book_pid)}"
         )
-        r = requests.get(f"{self.base_url}&query={spo_query}")
-        return r.content.decode("utf-8")
+        return self.client.get_text(f"{self.base_url}&query={spo_query}")
 
     def get_pages_and_page_numbers(self, book_pid):
         """
@@ -72,42 +227,86 @@ class TriplesSearch(ResourceIndexSearch):
             )
         sparql_query = self.escape_query(
             f"SELECT ?page ?pagenumber FROM <#ri> WHERE {{ ?page "
-            f"<info:fedora/fedora-system:def/relations-external#isMemberOf> <info:fedora/{book_pid}>. ?page "
+            f"<info:fedora/fedora-system:def/relations-external#isMemberOf> {object_uri(book_pid)}. ?page "
             f"<http://islandora.ca/ontology/relsext#isPageNumber> ?pagenumber. }} LIMIT 10"
         )
-        return requests.get(f"{self.base_url}&query={sparql_query}").content.decode(
-            "utf-8"
-        )
+        return self.client.get_text(f"{self.base_url}&query={sparql_query}")
 
 
 class TuplesSearch(ResourceIndexSearch):
+    """Reads tuples from the resource index with the prepared queries of this module.
+
+    Args:
+        post (bool): Send every query by POST if True, never if False, or only queries too long for a url if None.
+    """
+
     def __init__(
         self,
         language="sparql",
         riformat="CSV",
         ri_endpoint="http://localhost:8080/fedora/risearch",
+        client=None,
+        post=None,
     ):
-        super().__init__(ri_endpoint)
-        ResourceIndexSearch.__init__(self)
+        super().__init__(ri_endpoint, client=client)
         self.valid_languages = ("itql", "sparql")
         self.valid_formats = ("CSV", "Simple", "Sparql", "TSV")
         self.language = self.validate_language(language)
         self.format = self.validate_format(riformat)
-        self.base_url = (
-            f"{self.risearch_endpoint}?type=tuples"
-            f"&lang={self.language}&format={self.format}"
+        self.post = post
+        self.base_url = f"{self.risearch_endpoint}?" + urlencode(
+            {"type": "tuples", "lang": self.language, "format": self.format},
+            quote_via=quote,
         )
 
-    @staticmethod
-    def __clean_csv_results(split_results, uri_prefix):
-        results = []
-        for result in split_results:
-            if result.startswith(uri_prefix):
-                new_result = result.split(",")
-                results.append(
-                    (new_result[0].replace(uri_prefix, ""), int(new_result[1]))
-                )
-        return sorted(results, key=lambda x: x[1])
+    def read_tuples(self, query, select=None):
+        """
+        Lazily yields typed rows for a query, reading the response as it streams in.
+
+        The query is sent in the url, or as a form by POST when post is True, or when post is None and the url would
+        be longer than MAX_GET_URL_LENGTH.  Fedora object URIs are returned as PIDs and integers as ints.  Only the
+        CSV, TSV, and Sparql formats can be read.  Once every row is read, the query is recorded as a risearch.query
+        span of the build being recorded by fedora.instrument, if there is one.
+
+        Args:
+            query (str): The query, not yet encoded.
+            select (str): The variables the query selects, to name its span.
+
+        Returns:
+            generator: Tuples with one value per variable in the query.
+        """
+        url = f"{self.base_url}&query={self.escape_query(query)}"
+        data = None
+        if self.post or (self.post is None and len(url) > MAX_GET_URL_LENGTH):
+            url, data = self.base_url, {"query": query}
+        if select is None:
+            select = re.search(r"SELECT(.*?)FROM", query)
+            select = select.group(1).strip() if select is not None else ""
+        if self.format == "CSV":
+            return _timed_rows(read_csv(self.client.iter_lines(url, data=data)), select)
+        elif self.format == "TSV":
+            return _timed_rows(read_tsv(self.client.iter_lines(url, data=data)), select)
+        elif self.format == "Sparql":
+            return _timed_rows(
+                read_sparql_xml(self.client.iter_chunks(url, data=data)), select
+            )
+        else:
+            raise Exception(
+                f"Cannot read tuples in the {self.format} format.  Use CSV, TSV, or Sparql."
+            )
+
+    def select(self, template, *args, **pids):
+        """Reads the tuples of a SparqlTemplate or SparqlUnion filled in with PIDs.
+
+        Example:
+            >>> list(TuplesSearch().select(PARENT_COLLECTION, pid="agrtfhs:2275"))
+            [('collections:agrtfhs',)]
+        """
+        if self.language != "sparql":
+            raise Exception(
+                f"You must use sparql as the language for this method.  You used {self.language}."
+            )
+        return self.read_tuples(template.render(*args, **pids), template.select)
 
     def get_pages_and_page_numbers(self, pid):
         """
@@ -127,81 +326,165 @@ class TuplesSearch(ResourceIndexSearch):
             ('agrtfhs:2277', 15), ('agrtfhs:2276', 16)]
 
         """
-        if self.language != "sparql":
-            raise Exception(
-                f"You must use sparql as the language for this method.  You used {self.language}."
-            )
-        sparql_query = self.escape_query(
-            f"PREFIX fedora-model: <info:fedora/fedora-system:def/model#> PREFIX fedora-rels-ext: "
-            f"<info:fedora/fedora-system:def/relations-external#> PREFIX isl-rels-ext: "
-            f"<http://islandora.ca/ontology/relsext#> SELECT $page $numbers FROM <#ri> WHERE {{ $page "
-            f"fedora-rels-ext:isMemberOf <info:fedora/{pid}> ; isl-rels-ext:isPageNumber $numbers .}}"
-        )
-        results = (
-            requests.get(f"{self.base_url}&query={sparql_query}")
-            .content.decode("utf-8")
-            .split("\n")
-        )
-        return self.__clean_csv_results(results, "info:fedora/")
+        return sorted(self.select(PAGES, pid=pid), key=lambda x: x[1])
 
     def get_parent_collection(self, pid):
-        if self.language != "sparql":
-            raise Exception(
-                f"You must use sparql as the language for this method.  You used {self.language}."
-            )
-        sparql_query = self.escape_query(
-            f"PREFIX fedora-model: <info:fedora/fedora-system:def/model#> PREFIX fedora-rels-ext: "
-            f"<info:fedora/fedora-system:def/relations-external#> PREFIX isl-rels-ext: "
-            f"<http://islandora.ca/ontology/relsext#> SELECT $collection FROM <#ri> WHERE {{ <info:fedora/{pid}> "
-            f"fedora-rels-ext:isMemberOfCollection $collection . }}"
-        )
-        results = (
-            requests.get(f"{self.base_url}&query={sparql_query}")
-            .content.decode("utf-8")
-            .split("\n")
-        )
-        return [
-            result.replace("info:fedora/", "")
-            for result in results
-            if result.startswith("info:fedora")
-        ][0]
+        return [result[0] for result in self.select(PARENT_COLLECTION, pid=pid)][0]
 
     def get_collection_and_content_model(self, pid):
         """
         Gets the collection a pid belongs to and its content model.
 
+        A pid that belongs to several collections or has several content models gets the first of each in sorted order.
+        Use get_collections_and_content_models to see all of them, or to look up many pids at once.
+
         Args:
             pid (str): the pid that you want to determine.
         Returns:
             list: A list with the collection pid in index 0 and the content model in index 1.
 
-        @todo: This assumes a pid only belongs to one collection.  This is naive and needs to be addressed.
-
         Example:
             >>> TuplesSearch(language="sparql").get_collection_and_content_model("agrtfhs:2275")
             ['collections:agrtfhs', 'islandora:bookCModel']
         """
-        if self.language != "sparql":
+        collections, models = self.get_collections_and_content_models([pid])[pid]
+        if len(collections) == 0 or len(models) == 0:
             raise Exception(
-                f"You must use sparql as the language for this method.  You used {self.language}."
+                f"Could not find a collection and content model for {pid} in the resource index."
             )
-        sparql_query = self.escape_query(
-            f"PREFIX fedora-model: <info:fedora/fedora-system:def/model#> PREFIX fedora-rels-ext: "
-            f"<info:fedora/fedora-system:def/relations-external#> PREFIX isl-rels-ext: "
-            f"<http://islandora.ca/ontology/relsext#> SELECT $collection $model FROM <#ri> WHERE {{ <info:fedora/{pid}> "
-            f"fedora-rels-ext:isMemberOfCollection $collection ; fedora-model:hasModel $model . }}"
-        )
-        results = (
-            [
-                pair
-                for pair in requests.get(f"{self.base_url}&query={sparql_query}")
-                .content.decode("utf-8")
-                .split("\n")
-            ][2]
-            .replace("info:fedora/", "")
-            .split(",")
+        return [collections[0], models[0]]
+
+    def get_collections_and_content_models(
+        self, pids, chunk_size=100, last_modified=False
+    ):
+        """
+        Gets every collection and content model of many pids with one query for each chunk_size of them.
+
+        Each chunk is a UNION of one pattern per pid with the pid bound as its subject, since the SPARQL of the resource
+        index has no VALUES.  Content models in the fedora-system namespace are left out.
+
+        Args:
+            pids (list): The pids to look up.
+            chunk_size (int): How many pids to look up in each query.  Queries too long for a url are sent by POST.
+            last_modified (bool): Also look up the latest lastModifiedDate of each pid and its pages in the same
+                queries, like get_last_modified does for one pid.
+
+        Returns:
+            dict: A tuple of the sorted lists of collections and of content models keyed by every pid in pids.  Both
+                lists are empty for a pid that is not in the resource index.  With last_modified, each tuple also has
+                the latest lastModifiedDate, or None for a pid that is not in the resource index.
+
+        Example:
+            >>> TuplesSearch(language="sparql").get_collections_and_content_models(["agrtfhs:2275"])
+            {'agrtfhs:2275': (['collections:agrtfhs'], ['islandora:bookCModel'])}
+        """
+        template = (
+            COLLECTIONS_MODELS_AND_LAST_MODIFIED
+            if last_modified
+            else COLLECTIONS_AND_MODELS
         )
-        return results
+        found = {pid: (set(), set(), set()) for pid in pids}
+        unique = list(found)
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start : start + chunk_size]
+            for pid, values in template.read(chunk, self.select(template, chunk)):
+                collection, model = values[0], values[1]
+                if collection is not None:
+                    found[pid][0].add(collection)
+                if model is not None and not model.startswith("fedora-system:"):
+                    found[pid][1].add(model)
+                if last_modified and values[2] is not None:
+                    found[pid][2].add(values[2])
+        if not last_modified:
+            return {
+                pid: (sorted(collections), sorted(models))
+                for pid, (collections, models, _) in found.items()
+            }
+        return {
+            pid: (
+                sorted(collections),
+                sorted(models),
+                max(dates, key=parse_fedora_date) if len(dates) > 0 else None,
+            )
+            for pid, (collections, models, dates) in found.items()
+        }
+
+    def get_collection_members(self, collection_pid):
+        """
+        Returns every object in a collection with its content model and the date it was last modified.
+
+        Objects with more than one content model are reported once with their non fedora-system model.
+
+        Args:
+            collection_pid (str): The PID of the collection.
+
+        Returns:
+            list: A sorted list of tuples with the pid, content model, and lastModifiedDate of each member.
+        """
+        members = {}
+        for pid, model, modified in self.select(COLLECTION_MEMBERS, pid=collection_pid):
+            if not model.startswith("fedora-system:"):
+                members[pid] = (pid, model, modified)
+        return sorted(members.values())
+
+    def get_collection_pages(self, collection_pid):
+        """
+        Returns the pages and page numbers of every book in a collection from a single streamed query.
+
+        This replaces one get_pages_and_page_numbers request per book when building a whole collection.
+
+        Args:
+            collection_pid (str): The PID of the collection.
+
+        Returns:
+            dict: Sorted lists of tuples with the pid of the page and the corresponding page number keyed by book.
+
+        Example:
+            >>> TuplesSearch(language="sparql").get_collection_pages("collections:agrtfhs")["agrtfhs:2275"][:2]
+            [('agrtfhs:2279', 1), ('agrtfhs:2278', 2)]
+        """
+        books = {}
+        for book, page, number in self.select(COLLECTION_PAGES, pid=collection_pid):
+            books.setdefault(book, []).append((page, number))
+        for pages in books.values():
+            pages.sort(key=lambda page: page[1])
+        return books
+
+    def get_collection_pages_last_modified(self, collection_pid):
+        """
+        Returns the most recent lastModifiedDate of the pages of every book in a collection.
+
+        Args:
+            collection_pid (str): The PID of the collection.
+
+        Returns:
+            dict: The latest lastModifiedDate of any page keyed by book.
+        """
+        books = {}
+        for book, modified in self.select(
+            COLLECTION_PAGES_LAST_MODIFIED, pid=collection_pid
+        ):
+            if book not in books or parse_fedora_date(books[book]) < parse_fedora_date(
+                modified
+            ):
+                books[book] = modified
+        return books
+
+    def get_last_modified(self, pid):
+        """
+        Returns the most recent lastModifiedDate of an object and any of its pages.
+
+        Fedora updates the lastModifiedDate of an object when any of its datastreams change, so this also reflects
+        changes to MODS.
+
+        Args:
+            pid (str): The PID of the object.
+
+        Returns:
+            str: The latest lastModifiedDate, or None if the object is not in the resource index.
+        """
+        dates = [result[0] for result in self.select(LAST_MODIFIED, pid=pid)]
+        return max(dates, key=parse_fedora_date) if len(dates) > 0 else None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+from fedora.client import default_client
+from fedora.codec import iterparse, pull_parser, tostring
+from urllib.parse import quote
+import threading
+import base64
+import os
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def pid_from_oai_identifier(identifier):
+    """Returns the PID an Islandora OAI-PMH identifier refers to.
+
+    Islandora writes the PID with _ in place of : after the last : of the identifier, so PIDs with _ in their
+    namespace cannot be told apart from this alone.
+
+    Example:
+        >>> pid_from_oai_identifier("oai:digital.lib.utk.edu:agrtfhs_2275")
+        'agrtfhs:2275'
+    """
+    return identifier.rsplit(":", 1)[-1].replace("_", ":", 1)
+
+
+def read_foxml_mods(handle):
+    """Returns the latest version of the MODS datastream in a FOXML document as bytes, or None if it has no MODS.
+
+    Both inline XML and managed datastreams with base64 binaryContent are read.  Other datastreams are discarded as
+    they are parsed.
+    """
+    mods = None
+    for event, element in iterparse(handle, events=("end",)):
+        if _local_name(element.tag) != "datastream":
+            continue
+        if element.attrib.get("ID") == "MODS":
+            versions = [
+                child
+                for child in element
+                if _local_name(child.tag) == "datastreamVersion"
+            ]
+            for child in versions[-1] if len(versions) > 0 else []:
+                if _local_name(child.tag) == "xmlContent" and len(child) > 0:
+                    mods = tostring(child[0])
+                elif _local_name(child.tag) == "binaryContent":
+                    mods = base64.b64decode("".join(child.text.split()))
+        element.clear()
+    return mods
+
+
+class ExportDirectorySource:
+    """Reads MODS for many objects from a local directory instead of requesting each datastream.
+
+    The directory may hold MODS records or FOXML exports, named after the PID with _ in place of :, like
+    agrtfhs_2275.xml, or like a file in the Fedora object store, like info%3Afedora%2Fagrtfhs%3A2275.  Files are only
+    read when their MODS is asked for, so large exports can be used without scanning them first.
+
+    Args:
+        directory (str): The flat directory of exported files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __find(self, pid):
+        for name in (
+            f"{pid.replace(':', '_')}.xml",
+            quote(f"info:fedora/{pid}", safe=""),
+        ):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get(self, pid):
+        """Returns the MODS of a PID as bytes, or None if it is not in the directory."""
+        path = self.__find(pid)
+        if path is None:
+            return None
+        with open(path, "rb") as export:
+            root = next(iterparse(export, events=("start",)))[1]
+            export.seek(0)
+            if _local_name(root.tag) == "digitalObject":
+                return read_foxml_mods(export)
+            return export.read()
+
+
+class OAISource:
+    """Harvests MODS for every record of an OAI-PMH ListRecords response so objects can be built without requesting
+    their MODS one at a time.
+
+    Responses are parsed as they stream in, and resumption tokens are followed until the list is complete.  Deleted
+    records are skipped.
+
+    Args:
+        endpoint (str): The OAI-PMH endpoint, like https://digital.lib.utk.edu/oai2.
+        metadata_prefix (str): The metadata format to harvest.
+        set_spec (str): An optional set to limit the harvest to, like collections_agrtfhs.
+        client (fedora.client.HTTPClient): The HTTP client used to harvest.
+    """
+
+    def __init__(self, endpoint, metadata_prefix="mods", set_spec=None, client=None):
+        self.endpoint = endpoint
+        self.metadata_prefix = metadata_prefix
+        self.set_spec = set_spec
+        self.client = client if client is not None else default_client()
+        self.records = None
+        self.__lock = threading.Lock()
+
+    def __read_page(self, url):
+        parser = pull_parser(events=("start", "end"))
+        records = []
+        token = None
+        parent = None
+        for chunk in self.client.iter_chunks(url):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                name = _local_name(element.tag)
+                if event == "start":
+                    if name == "ListRecords":
+                        parent = element
+                elif name == "error" and element.attrib.get("code") != "noRecordsMatch":
+                    raise Exception(
+                        f"{self.endpoint} returned an OAI-PMH error: {element.attrib.get('code')} {element.text}"
+                    )
+                elif name == "resumptionToken":
+                    token = element.text.strip() if element.text else None
+                elif name == "record":
+                    records.append(self.__read_record(element))
+                    if parent is not None:
+                        parent.remove(element)
+        parser.close()
+        return [record for record in records if record is not None], token
+
+    @staticmethod
+    def __read_record(element):
+        identifier = None
+        metadata = None
+        for child in element:
+            if _local_name(child.tag) == "header":
+                if child.attrib.get("status") == "deleted":
+                    return None
+                for field in child:
+                    if _local_name(field.tag) == "identifier":
+                        identifier = field.text.strip()
+            elif _local_name(child.tag) == "metadata" and len(child) > 0:
+                metadata = tostring(child[0])
+        if identifier is None or metadata is None:
+            return None
+        return pid_from_oai_identifier(identifier), metadata
+
+    def harvest(self):
+        """Harvests every record, following resumption tokens.
+
+        Returns:
+            int: The number of records harvested.
+        """
+        records = {}
+        url = f"{self.endpoint}?verb=ListRecords&metadataPrefix={quote(self.metadata_prefix)}"
+        if self.set_spec is not None:
+            url = f"{url}&set={quote(self.set_spec)}"
+        while url is not None:
+            page, token = self.__read_page(url)
+            records.update(page)
+            url = (
+                f"{self.endpoint}?verb=ListRecords&resumptionToken={quote(token, safe='')}"
+                if token
+                else None
+            )
+        self.records = records
+        return len(records)
+
+    def get(self, pid):
+        """Returns the harvested MODS of a PID as bytes, or None if it was not harvested."""
+        with self.__lock:
+            if self.records is None:
+                self.harvest()
+        return self.records.get(pid)
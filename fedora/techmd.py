@@ -1,20 +1,43 @@
-import requests
-import xmltodict
+from fedora.client import default_client
+from fedora.codec import iterparse
+from fedora.instrument import span
+import io
+
+
+def _local_name(name):
+    return name.rsplit("}", 1)[-1]
 
 
 class TechnicalMetadataScraper:
     def __init__(
-        self, fedora_pid, islandora_frontend="https://digital.lib.utk.edu/collections/"
+        self,
+        fedora_pid,
+        islandora_frontend="https://digital.lib.utk.edu/collections/",
+        client=None,
     ):
         self.pid = fedora_pid
+        self.client = client if client is not None else default_client()
         self.tech_md = (
             f"{islandora_frontend}/islandora/object/{fedora_pid}/datastream/TECHMD"
         )
-        self.tech_md_dict = self.__get_techmd(self.tech_md)
-
-    @staticmethod
-    def __get_techmd(uri):
-        return xmltodict.parse(requests.get(uri).content.decode("utf-8"))
+        self.durations = self.__get_durations(self.tech_md)
+
+    def __get_durations(self, uri):
+        with span("techmd.fetch", pid=self.pid):
+            document = self.client.get_content(uri)
+        durations = {}
+        path = []
+        with span("techmd.parse", pid=self.pid):
+            for event, element in iterparse(
+                io.BytesIO(document), events=("start", "end")
+            ):
+                if event == "start":
+                    path.append(_local_name(element.tag))
+                    continue
+                if path == ["fits", "metadata", "audio", "duration"]:
+                    durations.setdefault(element.attrib.get("toolname"), element.text)
+                path.pop()
+        return durations
 
     def get_nlnz_duration(self):
         """Gets the value of nlnz duration in seconds for easy share to IIIF manifest.txt
@@ -24,11 +47,7 @@ class TechnicalMetadataScraper:
             2825.339
 
         """
-        duration = [
-            duration["#text"]
-            for duration in self.tech_md_dict["fits"]["metadata"]["audio"]["duration"]
-            if duration["@toolname"] == "NLNZ Metadata Extractor"
-        ][0]
+        duration = self.durations["NLNZ Metadata Extractor"]
         duration_split = duration.split(":")
         hours = int(duration_split[0]) * 60 * 60
         minutes = int(duration_split[1]) * 60
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import threading
+import time
+
+
+class TokenBucket:
+    """Limits how often requests start to a steady rate while allowing short bursts.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (int): The most tokens that can accumulate while idle.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError(f"The rate of a token bucket must be above 0, not {rate}.")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """Limits how many requests are in flight, adjusting the limit with additive increase and multiplicative decrease.
+
+    Each successful response raises the limit by 1 / limit, so it grows by about one per round of requests.  A 429 or
+    5xx response, a connection error, or an average latency more than latency_tolerance times the baseline halves
+    it, at most once per cooldown so one burst of errors does not collapse it to the minimum.
+
+    The baseline is the best average latency seen, drifting toward the current average by baseline_decay of the gap
+    after each response.  One unusually fast early response, or a server that has since settled at a slower normal,
+    then stops the limit from being halved after a few dozen responses instead of keeping it at the minimum for good.
+
+    Args:
+        initial (int): The limit to start with.
+        minimum (int): The limit never drops below this.
+        maximum (int): The limit never rises above this.
+        latency_tolerance (float): How many times the best average latency is treated as congestion.
+        cooldown (float): Seconds to wait after decreasing the limit before decreasing it again.
+        baseline_decay (float): The fraction of the gap to the current average latency the baseline closes after each
+            response.
+    """
+
+    def __init__(
+        self,
+        initial=8,
+        minimum=1,
+        maximum=64,
+        latency_tolerance=3.0,
+        cooldown=1.0,
+        baseline_decay=0.01,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.baseline_decay = baseline_decay
+        self.in_flight = 0
+        self.decreases = 0
+        self.latency = None
+        self.best_latency = None
+        self.__decreased_at = 0.0
+        self.__condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until fewer requests than the limit are in flight, then counts one more."""
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.in_flight += 1
+
+    def release(self, congested, seconds):
+        """Counts a request as finished and adjusts the limit.
+
+        Args:
+            congested (bool): Whether the server signaled it is overloaded, with a 429 or 5xx or by failing.
+            seconds (float): How long the request took.
+        """
+        with self.__condition:
+            self.in_flight -= 1
+            if not congested:
+                self.latency = (
+                    seconds
+                    if self.latency is None
+                    else 0.8 * self.latency + 0.2 * seconds
+                )
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+                else:
+                    self.best_latency += self.baseline_decay * (
+                        self.latency - self.best_latency
+                    )
+                congested = self.latency > self.best_latency * self.latency_tolerance
+            now = time.monotonic()
+            if congested and now - self.__decreased_at >= self.cooldown:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreases += 1
+                self.__decreased_at = now
+            elif not congested:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.__condition.notify_all()
+
+
+def _is_congested(status):
+    return status is None or status == 429 or status >= 500
+
+
+class HostThrottle:
+    """Applies a token bucket and an adaptive concurrency limit to the requests sent to each host.
+
+    Hosts without a rate of their own use the default rate, and no rate means only concurrency is limited.
+
+    Args:
+        rate (float): The default requests per second allowed to each host, or None for no rate limit.
+        rates (dict): Requests per second keyed by host name, overriding rate.
+        initial_concurrency (int): How many requests each host starts with in flight at once.
+        max_concurrency (int): The most requests each host can have in flight at once.
+
+    Example:
+        >>> client = HTTPClient(throttle=HostThrottle(rate=20, rates={"localhost": 50}))
+    """
+
+    def __init__(
+        self, rate=None, rates=None, initial_concurrency=8, max_concurrency=64
+    ):
+        for limit in (rate, *(rates.values() if rates is not None else ())):
+            if limit is not None and limit <= 0:
+                raise ValueError(f"Rates must be above 0, not {limit}.")
+        self.rate = rate
+        self.rates = rates if rates is not None else {}
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+
+    def __host(self, host):
+        with self.__lock:
+            if host not in self.__hosts:
+                rate = self.rates.get(host, self.rate)
+                self.__hosts[host] = (
+                    TokenBucket(rate) if rate is not None else None,
+                    AdaptiveLimit(
+                        initial=min(self.initial_concurrency, self.max_concurrency),
+                        maximum=self.max_concurrency,
+                    ),
+                )
+            return self.__hosts[host]
+
+    @contextmanager
+    def request(self, url):
+        """Waits until a request to the host of url is allowed, then yields a list to append response statuses to.
+
+        Every status appended, including those of retries, is used to adjust the limit.  A request that raises is
+        treated as a sign of congestion.
+        """
+        bucket, limit = self.__host(urlsplit(url).hostname)
+        if bucket is not None:
+            bucket.acquire()
+        limit.acquire()
+        statuses = []
+        start = time.monotonic()
+        try:
+            yield statuses
+        except Exception:
+            statuses.append(None)
+            raise
+        finally:
+            limit.release(
+                any(_is_congested(status) for status in statuses),
+                time.monotonic() - start,
+            )
+
+    def stats(self):
+        """Returns the current concurrency limit, requests in flight, and decreases of each host."""
+        with self.__lock:
+            hosts = dict(self.__hosts)
+        return {
+            host: {
+                "limit": int(limit.limit),
+                "in_flight": limit.in_flight,
+                "decreases": limit.decreases,
+            }
+            for host, (bucket, limit) in hosts.items()
+        }
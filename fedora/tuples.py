@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+from fedora.codec import pull_parser
+import csv
+import re
+
+
+def convert_value(value):
+    """Converts a value from a risearch tuple to a Python type.
+
+    Fedora object URIs become PIDs, integers become ints, and anything else is returned as a string.
+
+    Example:
+        >>> convert_value("info:fedora/agrtfhs:2279")
+        'agrtfhs:2279'
+        >>> convert_value("16")
+        16
+    """
+    if value.startswith("info:fedora/"):
+        return value[len("info:fedora/") :]
+    if re.fullmatch(r"-?[0-9]+", value):
+        return int(value)
+    return value
+
+
+def parse_fedora_date(value):
+    """Converts a Fedora lastModifiedDate like 2019-06-19T15:03:41.536Z to seconds since the epoch."""
+    for date_format in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            return (
+                datetime.strptime(value, date_format)
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+            )
+        except ValueError:
+            continue
+    raise ValueError(f"{value} is not a Fedora lastModifiedDate.")
+
+
+def read_csv(lines):
+    """Lazily yields typed rows from the lines of a CSV result, skipping the header.
+
+    Quoted values with commas or escaped quotes are handled by the csv module rather than split by hand.
+    """
+    rows = csv.reader(lines)
+    next(rows, None)
+    for row in rows:
+        if len(row) > 0:
+            yield tuple(convert_value(value) for value in row)
+
+
+_NTRIPLES_ESCAPES = {
+    "t": "\t",
+    "b": "\b",
+    "n": "\n",
+    "r": "\r",
+    "f": "\f",
+    '"': '"',
+    "'": "'",
+    "\\": "\\",
+}
+
+
+def _unescape_ntriples(match):
+    code = match.group(1) or match.group(2)
+    if code is not None:
+        return chr(int(code, 16))
+    return _NTRIPLES_ESCAPES.get(match.group(3), match.group(0))
+
+
+def _read_ntriples_term(term):
+    if term.startswith("<") and term.endswith(">"):
+        return term[1:-1]
+    literal = re.fullmatch(r'"((?:[^"\\]|\\.)*)"(?:\^\^<[^>]*>|@[A-Za-z-]+)?', term)
+    if literal is not None:
+        return re.sub(
+            r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))",
+            _unescape_ntriples,
+            literal.group(1),
+        )
+    return term
+
+
+def read_tsv(lines):
+    """Lazily yields typed rows from the lines of a TSV result, skipping the header.
+
+    Values may be written as N-Triples terms, like <info:fedora/agrtfhs:2279> or "1", or as bare values.
+    """
+    lines = iter(lines)
+    next(lines, None)
+    for line in lines:
+        if line != "":
+            yield tuple(
+                convert_value(_read_ntriples_term(term)) for term in line.split("\t")
+            )
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _read_binding(element):
+    if "uri" in element.attrib:
+        return element.attrib["uri"]
+    for child in element:
+        if _local_name(child.tag) in ("uri", "literal", "bnode"):
+            return child.text if child.text is not None else ""
+    return element.text if element.text is not None else ""
+
+
+def read_sparql_xml(chunks):
+    """Lazily yields typed rows from the chunks of a Sparql XML result.
+
+    Both the result format Fedora writes, where each result has an element named after the variable, and the W3C
+    format with binding elements are supported.  Each result is discarded as soon as it is read so memory stays
+    constant regardless of the number of results.
+    """
+    parser = pull_parser(events=("start", "end"))
+    variables = []
+    results = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            name = _local_name(element.tag)
+            if event == "start":
+                if name == "results":
+                    results = element
+            elif name == "variable":
+                variables.append(element.attrib["name"])
+            elif name == "result":
+                values = {}
+                for child in element:
+                    if _local_name(child.tag) == "binding":
+                        values[child.attrib["name"]] = _read_binding(child)
+                    else:
+                        values[_local_name(child.tag)] = _read_binding(child)
+                yield tuple(
+                    convert_value(values[variable]) if variable in values else None
+                    for variable in variables
+                )
+                element.clear()
+                if results is not None:
+                    results.remove(element)
+    parser.close()
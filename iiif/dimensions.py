@@ -0,0 +1,241 @@
+from fedora.cache import ResponseCache
+from fedora.codec import dumps, loads
+from urllib.parse import unquote
+import argparse
+import threading
+import sqlite3
+import struct
+import sys
+import os
+import re
+
+
+class DimensionIndex:
+    """A persistent index of the image dimensions and service details of Fedora datastreams.
+
+    The height and width of a JP2 never change once it is ingested, so after a datastream has been indexed, canvases
+    can be built from the index instead of requesting its info.json from the image server.  Only the parts of
+    info.json that canvases use are kept: the service @id, @context, profile, height, width, and, when known, sizes.
+
+    Args:
+        path (str): The sqlite file that holds the index.
+    """
+
+    default_context = "http://iiif.io/api/image/2/context.json"
+    default_profile = ["http://iiif.io/api/image/2/level2.json"]
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS dimensions (pid TEXT, datastream TEXT, height INTEGER, width INTEGER, "
+                "service TEXT, context TEXT, profile TEXT, sizes TEXT, PRIMARY KEY (pid, datastream))"
+            )
+
+    def get(self, pid, datastream):
+        """Returns the indexed parts of the info.json for a datastream as a dict, or None if it is not indexed."""
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT height, width, service, context, profile, sizes FROM dimensions WHERE pid = ? AND "
+                "datastream = ?",
+                (pid, datastream),
+            ).fetchone()
+        if row is None:
+            return None
+        info = {
+            "@context": row[3],
+            "@id": row[2],
+            "profile": loads(row[4]),
+            "height": row[0],
+            "width": row[1],
+        }
+        if row[5] is not None:
+            info["sizes"] = loads(row[5])
+        return info
+
+    def put(self, pid, datastream, info):
+        """Adds or replaces a datastream in the index from its info.json."""
+        self.put_many([(pid, datastream, info)])
+
+    def put_many(self, records):
+        """Adds or replaces many datastreams in one transaction from tuples of pid, datastream, and info.json."""
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO dimensions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        pid,
+                        datastream,
+                        info["height"],
+                        info["width"],
+                        info["@id"],
+                        info.get("@context", self.default_context),
+                        dumps(info.get("profile", self.default_profile)),
+                        dumps(info["sizes"]) if "sizes" in info else None,
+                    )
+                    for pid, datastream, info in records
+                ],
+            )
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute(
+                "SELECT COUNT(*) FROM dimensions"
+            ).fetchone()[0]
+
+    def populate_from_cache(self, cache):
+        """Indexes every info.json in a fedora.cache.ResponseCache from a previous crawl.
+
+        Returns:
+            int: The number of datastreams indexed.
+        """
+        records = []
+        for url, content in cache.items("info.json"):
+            datastream = parse_info_json_url(url)
+            if datastream is not None:
+                records.append((datastream[0], datastream[1], loads(content)))
+        self.put_many(records)
+        return len(records)
+
+    def populate_from_jp2(
+        self, directory, server="https://digital.lib.utk.edu/", skipped=None
+    ):
+        """Indexes the dimensions of every JP2 in a directory from its header without decoding the image.
+
+        Files may be named like a Fedora datastream file, info%3Afedora%2Fagrtfhs%3A2279%2FJP2%2FJP2.0, or after the
+        PID of the page with _ in place of :, like agrtfhs_2279.jp2.  Files that cannot be read or are not JP2s are
+        skipped rather than stopping the rest from being indexed.
+
+        Args:
+            directory (str): The directory of JP2 files.
+            server (str): The server written in the service id of each datastream.
+            skipped (list): Where to append a dict with the name and error of each file that was skipped, if anywhere.
+
+        Returns:
+            int: The number of datastreams indexed.
+        """
+        records = []
+        for name in sorted(os.listdir(directory)):
+            datastream = parse_jp2_filename(name)
+            if datastream is None:
+                continue
+            try:
+                height, width = read_jp2_dimensions(os.path.join(directory, name))
+            except (OSError, ValueError) as e:
+                if skipped is not None:
+                    skipped.append({"name": name, "error": repr(e)})
+                continue
+            records.append(
+                (
+                    datastream[0],
+                    datastream[1],
+                    {
+                        "@id": f"{server}iiif/2/collections%7Eislandora%7Eobject%7E{datastream[0]}%7Edatastream%7E"
+                        f"{datastream[1]}",
+                        "height": height,
+                        "width": width,
+                    },
+                )
+            )
+        self.put_many(records)
+        return len(records)
+
+
+def parse_info_json_url(url):
+    """Returns the PID and datastream an info.json url describes, or None if it is not a Fedora datastream.
+
+    Example:
+        >>> parse_info_json_url("https://digital.lib.utk.edu/iiif/2/collections%7Eislandora%7Eobject%7Eagrtfhs:2279%7Edatastream%7EJP2/info.json")
+        ('agrtfhs:2279', 'JP2')
+    """
+    match = re.search(
+        r"islandora~object~(.+)~datastream~([^/~]+)/info\.json$",
+        url.replace("%7E", "~").replace("%7e", "~"),
+    )
+    if match is None:
+        return None
+    return match.group(1), match.group(2)
+
+
+def parse_jp2_filename(name):
+    """Returns the PID and datastream a JP2 file holds based on its name, or None if it cannot be determined."""
+    fedora_name = re.fullmatch(r"info:fedora/([^/]+)/([^/]+)/[^/]+", unquote(name))
+    if fedora_name is not None:
+        return fedora_name.group(1), fedora_name.group(2)
+    if name.lower().endswith(".jp2") and "_" in name:
+        return name[:-4].replace("_", ":", 1), "JP2"
+    return None
+
+
+def read_jp2_dimensions(path):
+    """Reads the height and width of a JP2 from the image header box in its jp2h box.
+
+    Returns:
+        tuple: The height and width in pixels.
+
+    Raises:
+        ValueError: If the file is not a JP2 or ends before its image header.
+    """
+    with open(path, "rb") as jp2:
+        header = jp2.read(64 * 1024)
+    position = 0
+    while position + 8 <= len(header):
+        length, box_type = struct.unpack(">I4s", header[position : position + 8])
+        if box_type == b"jp2h":
+            position += 8
+            continue
+        if box_type == b"ihdr":
+            if position + 16 > len(header):
+                break
+            return struct.unpack(">II", header[position + 8 : position + 16])
+        if length == 0:
+            break
+        if length == 1:
+            if position + 16 > len(header):
+                break
+            length = struct.unpack(">Q", header[position + 8 : position + 16])[0]
+        position += length
+    raise ValueError(f"Could not find the image header of {path}.  Is it a JP2?")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Populate a dimension index so manifests can be built without requesting info.json"
+    )
+    parser.add_argument(
+        "-i",
+        "--index",
+        dest="index",
+        help="Specify the sqlite file of the index.",
+        required=True,
+    )
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument(
+        "--from-cache",
+        dest="from_cache",
+        help="Specify a response cache directory from a previous run to index every info.json in it.",
+    )
+    sources.add_argument(
+        "--from-jp2",
+        dest="from_jp2",
+        help="Specify a directory of JP2 files to index from their headers.",
+    )
+    parser.add_argument(
+        "-s",
+        "--server",
+        dest="server",
+        help="Specify the server that will be written in service ids when indexing JP2 files.",
+        default="https://digital.lib.utk.edu/",
+    )
+    args = parser.parse_args()
+    index = DimensionIndex(args.index)
+    if args.from_cache is not None:
+        indexed = index.populate_from_cache(ResponseCache(args.from_cache))
+    else:
+        skipped = []
+        indexed = index.populate_from_jp2(args.from_jp2, args.server, skipped)
+        for file in skipped:
+            print(f"Skipped {file['name']}: {file['error']}", file=sys.stderr)
+    print(f"Indexed {indexed} datastreams. {args.index} now holds {len(index)}.")
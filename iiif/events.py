@@ -0,0 +1,160 @@
+import threading
+import time
+
+
+class BuildListener:
+    """Receives progress events from manifest builds.  Override the events you need; the others do nothing.
+
+    Events arrive on whichever thread did the work, so a listener shared between builds has to be thread safe.
+    """
+
+    def canvas_built(self, pid, page, total):
+        """Called each time a canvas is added to a manifest.
+
+        Args:
+            pid (str): The PID of the object the manifest is for.
+            page (str): The PID of the page, or of the object itself when it has a single canvas.
+            total (int): How many canvases the manifest was expected to have.
+        """
+
+    def page_failed(self, pid, page, total, error):
+        """Called each time a page is left out of a manifest because its canvas could not be built.
+
+        Args:
+            pid (str): The PID of the object the manifest is for.
+            page (str): The PID of the page.
+            total (int): How many canvases the manifest was expected to have.
+            error (str): The repr of the exception.
+        """
+
+    def manifest_done(self, pid, canvases, failures, fetched):
+        """Called when every canvas of a manifest has been built or has failed.
+
+        Args:
+            pid (str): The PID of the object the manifest is for.
+            canvases (int): How many canvases the manifest has.
+            failures (list): The pages left out, as dicts with the page pid, page number, and error.
+            fetched (int): How many bytes were downloaded for the manifest, not counting responses already cached.
+        """
+
+
+class BuildEvents(BuildListener):
+    """Passes every event on to the listeners subscribed to it.
+
+    Example:
+        >>> events = BuildEvents()
+        >>> throughput = events.subscribe(Throughput())
+        >>> builder = ManifestBuilder(events=events)
+    """
+
+    def __init__(self, *listeners):
+        self.listeners = list(listeners)
+
+    def subscribe(self, listener):
+        """Adds a listener and returns it."""
+        self.listeners = self.listeners + [listener]
+        return listener
+
+    def unsubscribe(self, listener):
+        self.listeners = [
+            subscribed for subscribed in self.listeners if subscribed is not listener
+        ]
+
+    def canvas_built(self, pid, page, total):
+        for listener in self.listeners:
+            listener.canvas_built(pid, page, total)
+
+    def page_failed(self, pid, page, total, error):
+        for listener in self.listeners:
+            listener.page_failed(pid, page, total, error)
+
+    def manifest_done(self, pid, canvases, failures, fetched):
+        for listener in self.listeners:
+            listener.manifest_done(pid, canvases, failures, fetched)
+
+
+class Throughput(BuildListener):
+    """Counts canvases, failed pages, manifests, and bytes downloaded from the time it is created."""
+
+    def __init__(self):
+        self.canvases = 0
+        self.failures = 0
+        self.manifests = 0
+        self.fetched = 0
+        self.started = time.perf_counter()
+        self.__lock = threading.Lock()
+
+    def canvas_built(self, pid, page, total):
+        with self.__lock:
+            self.canvases += 1
+
+    def page_failed(self, pid, page, total, error):
+        with self.__lock:
+            self.failures += 1
+
+    def manifest_done(self, pid, canvases, failures, fetched):
+        with self.__lock:
+            self.manifests += 1
+            self.fetched += fetched
+
+    def snapshot(self):
+        """Returns the counts so far along with pages, manifests, and bytes per second."""
+        seconds = time.perf_counter() - self.started
+        with self.__lock:
+            counts = {
+                "pages_built": self.canvases,
+                "pages_failed": self.failures,
+                "manifests_done": self.manifests,
+                "bytes_fetched": self.fetched,
+            }
+        counts["seconds"] = seconds
+        for rate, amount in (
+            ("pages_per_second", "pages_built"),
+            ("manifests_per_second", "manifests_done"),
+            ("bytes_per_second", "bytes_fetched"),
+        ):
+            counts[rate] = counts[amount] / seconds if seconds > 0 else 0
+        return counts
+
+
+class ProgressBar(BuildListener):
+    """Draws a tqdm progress bar of pages across every manifest being built.
+
+    The total grows as each manifest reports its first page, so one bar covers a whole batch.  Only subscribe it when
+    the output is a terminal, since a bar written to a log or pipe is noise.
+
+    Args:
+        stream (file): Where to draw the bar, sys.stderr if None.
+
+    Example:
+        >>> if sys.stderr.isatty():
+        ...     events.subscribe(ProgressBar())
+    """
+
+    def __init__(self, stream=None):
+        from tqdm import tqdm
+
+        self.bar = tqdm(total=0, unit="page", file=stream)
+        self.__started = set()
+        self.__lock = threading.Lock()
+
+    def __advance(self, pid, total):
+        with self.__lock:
+            if pid not in self.__started:
+                self.__started.add(pid)
+                self.bar.total += total
+                self.bar.refresh()
+            self.bar.update(1)
+
+    def canvas_built(self, pid, page, total):
+        self.__advance(pid, total)
+
+    def page_failed(self, pid, page, total, error):
+        self.__advance(pid, total)
+
+    def manifest_done(self, pid, canvases, failures, fetched):
+        with self.__lock:
+            self.__started.discard(pid)
+
+    def close(self):
+        self.bar.close()
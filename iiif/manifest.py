@@ -1,6 +1,6 @@
-from uuid import uuid4
-from tqdm import tqdm
-import requests
+from fedora.client import default_client
+from iiif.pages import PageImages, read_info_json
+from iiif.serialize import Windowed, dumps, write_manifest
 import json
 
 
@@ -9,6 +9,14 @@ class Manifest:
 
     Note:  this class was initially inspired by the metadata generated by the Bodelian Manifest editor. Odd structural
     things that differ from the specification can be explained by this.
+
+    Identifiers are made from id_prefix, the PID, and page numbers, like {id_prefix}/{pid}/canvas/{page}, so an
+    unchanged object builds to identical bytes every time.  id_prefix defaults to {server_uri}iiif/presentation/2.
+
+    Pages are read by iiif.pages.PageImages, or taken from images when they were already read for a manifest of
+    another version, and kept as compact iiif.pages.PageImage objects.  With a chunk_size, the canvases of the
+    manifest are a iiif.serialize.Windowed list that is only built, chunk_size canvases at a time, as the manifest is
+    written, so memory stays flat for books of thousands of pages.
     """
 
     def __init__(
@@ -19,8 +27,23 @@ class Manifest:
         server_uri="https://digital.lib.utk.edu/",
         viewing_hint="paged",
         viewing_direction="left-to-right",
+        workers=8,
+        client=None,
+        dimensions=None,
+        events=None,
+        id_prefix=None,
+        chunk_size=None,
+        images=None,
     ):
-        self.identifier = f"http://{uuid4()}"
+        self.id_prefix = (
+            id_prefix if id_prefix is not None else f"{server_uri}iiif/presentation/2"
+        )
+        self.identifier = f"{self.id_prefix}/{descriptive_metadata['pid']}/manifest"
+        self.client = client if client is not None else default_client()
+        self.dimensions = dimensions
+        self.events = events
+        self.chunk_size = chunk_size
+        self.pid = descriptive_metadata["pid"]
         self.label = descriptive_metadata["label"]
         self.related = (
             f'{server_uri}/collections/islandora/object/{descriptive_metadata["pid"]}'
@@ -31,11 +54,35 @@ class Manifest:
         self.metadata = descriptive_metadata["metadata"]
         self.navigation_date = self.__check_for_navigation_date(descriptive_metadata)
         self.collection = self.__process_within_value(collection_pid, server_uri)
-        self.canvases = self.__get_canvases(pages, server_uri)
+        if images is None:
+            images = PageImages(
+                self.pid,
+                pages,
+                server_uri,
+                client=self.client,
+                dimensions=dimensions,
+                events=events,
+                workers=workers,
+                chunk_size=chunk_size,
+            )
+        self.failures = images.failures
+        self.images = images.images
+        if len(self.images) == 0:
+            raise Exception(
+                f"Could not build any canvases for {descriptive_metadata['pid']}: {self.failures}"
+            )
         self.viewing_hint = self.__validate_viewing_hint(viewing_hint)
         self.viewing_direction = self.__validate_viewing_direction(viewing_direction)
         self.manifest = self.__build_manifest()
-        self.manifest_json = json.dumps(self.manifest, indent=4)
+
+    @property
+    def manifest_json(self):
+        """The manifest serialized with an indent of 4, built only when it is asked for."""
+        return dumps(self.manifest, indent=4)
+
+    def write(self, handle, indent=4):
+        """Streams the manifest to a text file handle.  Pass an indent of None for compact output."""
+        write_manifest(self.manifest, handle, indent=indent)
 
     def __build_manifest(self):
         manifest_metadata = {
@@ -65,12 +112,16 @@ class Manifest:
             ],
             "sequences": [
                 {
-                    "@id": f"http://{uuid4()}",
+                    "@id": f"{self.id_prefix}/{self.pid}/sequence/normal",
                     "@type": "sc:Sequence",
                     "viewingHint": self.viewing_hint,
                     "viewingDirection": self.viewing_direction,
                     "label": [{"@value": "Normal Sequence", "@language": "en"}],
-                    "canvases": self.canvases,
+                    "canvases": (
+                        Windowed(self.images, self.__build_canvas, self.chunk_size)
+                        if self.chunk_size is not None
+                        else [self.__build_canvas(image) for image in self.images]
+                    ),
                 }
             ],
             "structures": [],
@@ -104,31 +155,19 @@ class Manifest:
         else:
             return value
 
-    @staticmethod
-    def __get_canvases(list_of_pages, server):
-        return [
-            Canvas(
-                page[0],
-                f"{server}iiif/2/collections%7Eislandora%7Eobject%7E{page[0]}%7Edatastream%7EJP2/info.json",
-            ).build_canvas()
-            for page in tqdm(list_of_pages)
-        ]
+    def __build_canvas(self, image):
+        return Canvas.from_image(
+            image, f"{self.id_prefix}/{self.pid}/canvas/{image.number}"
+        ).build_canvas()
 
     def __build_thumbnail_section(self):
+        canvas = self.images[0]
         return {
-            "@id": self.canvases[0]["images"][0]["resource"]["@id"].replace(
-                "full/full", "full/,150"
-            ),
+            "@id": f"{canvas.service}/full/,150/0/default.jpg",
             "service": {
-                "@context": self.canvases[0]["images"][0]["resource"]["service"][
-                    "@context"
-                ],
-                "@id": self.canvases[0]["images"][0]["resource"]["@id"].split(
-                    "full/full"
-                )[0],
-                "profile": self.canvases[0]["images"][0]["resource"]["service"][
-                    "profile"
-                ][0],
+                "@context": canvas.context,
+                "@id": f"{canvas.service}/",
+                "profile": canvas.profile[0],
             },
         }
 
@@ -150,35 +189,64 @@ class Manifest:
 class Canvas:
     """A class to represent a IIIF Canvas according to the 2.1.1 presentation specification.
 
+    Only the parts of the info.json a canvas is built from are kept, so thousands of them take little memory.
+
     Note:  this class was initially inspired by the metadata generated by the Bodelian Manifest editor. Odd structural
     things that differ from the specification can be explained by this.
     """
 
-    def __init__(self, label, info_json):
-        self.info = self.__read_info_json(info_json)
-        self.identifier = f"http://{uuid4()}"
+    __slots__ = (
+        "label",
+        "identifier",
+        "height",
+        "width",
+        "service",
+        "context",
+        "profile",
+    )
+
+    def __init__(self, label, info_json, client=None, info=None, identifier=None):
+        if info is None:
+            info = read_info_json(
+                client if client is not None else default_client(), info_json
+            )
+        self.identifier = (
+            identifier if identifier is not None else f"{info['@id']}/canvas"
+        )
         self.label = label
-        self.height = self.info["height"]
-        self.width = self.info["width"]
+        self.height = info["height"]
+        self.width = info["width"]
+        self.service = info["@id"]
+        self.context = info["@context"]
+        self.profile = info["profile"]
 
-    @staticmethod
-    def __read_info_json(uri):
-        return requests.get(uri).json()
+    @classmethod
+    def from_image(cls, image, identifier):
+        """Returns the canvas of a iiif.pages.PageImage, labelled with the PID of the page."""
+        canvas = cls.__new__(cls)
+        canvas.label = image.pid
+        canvas.identifier = identifier
+        canvas.height = image.height
+        canvas.width = image.width
+        canvas.service = image.service
+        canvas.context = image.context
+        canvas.profile = image.profile
+        return canvas
 
     def __build_images(self):
         return {
             "@context": "http://iiif.io/api/presentation/2/context.json",
-            "@id": f"http://{uuid4()}",
+            "@id": f"{self.identifier}/annotation/image",
             "@type": "oa:Annotation",
             "motivation": "sc:painting",
             "resource": {
-                "@id": f"{self.info['@id']}/full/full/0/default.jpg",
+                "@id": f"{self.service}/full/full/0/default.jpg",
                 "@type": "dctypes:Image",
                 "format": "image/jpeg",
                 "service": {
-                    "@context": self.info["@context"],
-                    "@id": self.info["@id"],
-                    "profile": self.info["profile"],
+                    "@context": self.context,
+                    "@id": self.service,
+                    "profile": self.profile,
                 },
                 "height": self.height,
                 "width": self.width,
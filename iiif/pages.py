@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fedora import codec
+from fedora.client import default_client
+from fedora.instrument import bind, count, span
+import requests
+
+
+def read_info_json(client, uri):
+    """Requests an info.json as a span of the build being recorded."""
+    with span("info.json", url=uri):
+        return client.get_json(uri)
+
+
+class PageImage:
+    """The parts of the info.json of a page that a canvas of either presentation API version is built from.
+
+    Args:
+        pid (str): The PID of the page.
+        number (int): The page number.
+        info (dict): The info.json of the JP2 datastream of the page.
+    """
+
+    __slots__ = ("pid", "number", "height", "width", "service", "context", "profile")
+
+    def __init__(self, pid, number, info):
+        self.pid = pid
+        self.number = number
+        self.height = info["height"]
+        self.width = info["width"]
+        self.service = info["@id"]
+        self.context = info["@context"]
+        self.profile = info["profile"]
+
+
+class PageImages:
+    """Reads the image of every page of a book once, so the same harvest can be rendered as a 2.1.1 manifest, a 3.0
+    manifest, or both.
+
+    Pages are read with a bounded pool of workers, from the dimension index when they are in it and from their
+    info.json when they are not.  Images are kept in page number order regardless of the order in which requests
+    complete.  Pages that cannot be read are left out and recorded in failures as a dict with the page pid, page
+    number, and error.  Each page is reported to events, if there are any, as it finishes.
+
+    Args:
+        pid (str): The PID of the book.
+        pages (list): A list of tuples with the pid of the page and the corresponding page number.
+        server_uri (str): The server uri used to find the info.json of each page.
+        client (fedora.client.HTTPClient): The client to request info.json with.
+        dimensions (iiif.dimensions.DimensionIndex): An optional index consulted before requesting info.json.  Pages
+            that have to be fetched are added to it.
+        events (iiif.events.BuildListener): Where to report each page, or None.
+        workers (int): The maximum number of info.json requests in flight at once.
+        chunk_size (int): Submit pages this many at a time so pending work stays bounded, or None to submit them all.
+
+    Example:
+        >>> images = PageImages("agrtfhs:2275", [("agrtfhs:2279", 1), ("agrtfhs:2278", 2)])
+        >>> images.images[0].width
+        2550
+    """
+
+    def __init__(
+        self,
+        pid,
+        pages,
+        server_uri="https://digital.lib.utk.edu/",
+        client=None,
+        dimensions=None,
+        events=None,
+        workers=8,
+        chunk_size=None,
+    ):
+        self.pid = pid
+        self.server_uri = server_uri
+        self.client = client if client is not None else default_client()
+        self.dimensions = dimensions
+        self.events = events
+        self.chunk_size = chunk_size
+        self.failures = []
+        self.__shared = {}
+        self.images = self.__read_pages(pages, workers)
+
+    def __read_pages(self, pages, workers):
+        ordered_pages = sorted(pages, key=lambda page: page[1])
+        images = [None] * len(ordered_pages)
+        window = self.chunk_size if self.chunk_size is not None else len(ordered_pages)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(ordered_pages), max(window, 1)):
+                self.__collect(
+                    executor,
+                    ordered_pages,
+                    range(start, min(start + window, len(ordered_pages))),
+                    images,
+                )
+        return [image for image in images if image is not None]
+
+    def __collect(self, executor, ordered_pages, positions, images):
+        futures = {
+            executor.submit(
+                bind(self.__read_page),
+                ordered_pages[position][0],
+                ordered_pages[position][1],
+            ): position
+            for position in positions
+        }
+        for future in as_completed(futures):
+            position = futures[future]
+            page = ordered_pages[position][0]
+            try:
+                images[position] = future.result()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self.failures.append(
+                    {
+                        "pid": page,
+                        "page": ordered_pages[position][1],
+                        "error": repr(e),
+                    }
+                )
+                if self.events is not None:
+                    self.events.page_failed(self.pid, page, len(ordered_pages), repr(e))
+                continue
+            if self.events is not None:
+                self.events.canvas_built(self.pid, page, len(ordered_pages))
+
+    def __read_page(self, page_pid, page_number):
+        info = (
+            self.dimensions.get(page_pid, "JP2")
+            if self.dimensions is not None
+            else None
+        )
+        if info is not None:
+            count("info.json.indexed")
+        else:
+            info = read_info_json(
+                self.client,
+                f"{self.server_uri}iiif/2/collections%7Eislandora%7Eobject%7E{page_pid}%7Edatastream%7EJP2/info.json",
+            )
+            if self.dimensions is not None:
+                self.dimensions.put(page_pid, "JP2", info)
+        image = PageImage(page_pid, page_number, info)
+        image.profile = self.__share(image.profile)
+        image.context = self.__share(image.context)
+        return image
+
+    def __share(self, value):
+        """Returns an equal value already kept by another page, so that the pages of a book share one copy."""
+        return self.__shared.setdefault(codec.dumps(value), value)
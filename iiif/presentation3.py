@@ -1,21 +1,45 @@
+from fedora.client import MemoClient, default_client
+from fedora.instrument import count, span
 from fedora.mods import MODSScraper
 from fedora.techmd import TechnicalMetadataScraper
+from iiif.pages import PageImages
+from iiif.serialize import Windowed, dumps, write_manifest
 import json
-import requests
 
 
 class Presentation3:
-    def __init__(self, server, pid):
+    def __init__(self, server, pid, client=None, dimensions=None):
         self.server_uri = server
         self.pid = pid
+        self.client = client if client is not None else default_client()
+        self.dimensions = dimensions
 
-    @staticmethod
-    def __read_info_json(uri):
-        return requests.get(uri).json()
+    def read_info_json(self, datastream, uri, needs_sizes=False):
+        """Returns the info.json of a datastream from the dimension index if it is there, or from uri if not.
+
+        Datastreams that have to be fetched are added to the index.
+
+        Args:
+            datastream (str): The datastream of self.pid the info.json describes.
+            uri (str): Where to request the info.json from.
+            needs_sizes (bool): Whether the caller uses sizes, which the index only has for some datastreams.
+        """
+        if self.dimensions is not None:
+            info = self.dimensions.get(self.pid, datastream)
+            if info is not None and (not needs_sizes or "sizes" in info):
+                count("info.json.indexed")
+                return info
+        with span("info.json", url=uri):
+            info = self.client.get_json(uri)
+        if self.dimensions is not None:
+            self.dimensions.put(self.pid, datastream, info)
+        return info
 
     def generate_thumbnail(self):
-        info = self.__read_info_json(
-            f"{self.server_uri}iiif/2/collections%7Eislandora%7Eobject%7E{self.pid}%7Edatastream%7ETN/info.json"
+        info = self.read_info_json(
+            "TN",
+            f"{self.server_uri}iiif/2/collections%7Eislandora%7Eobject%7E{self.pid}%7Edatastream%7ETN/info.json",
+            needs_sizes=True,
         )
         return [
             {
@@ -34,12 +58,25 @@ class Manifest3(Presentation3):
         descriptive_metadata,
         server_uri="https://digital.lib.utk.edu/",
         id_prefix="https://raw.githubusercontent.com/utkdigitalinitiatives/utk_iiif_recipes/main/raw_manifests",
+        client=None,
+        dimensions=None,
+        events=None,
     ):
         self.id = f'{id_prefix}/{descriptive_metadata["pid"]}.json'
         self.id_prefix = id_prefix
+        self.events = events
+        self.failures = []
         self.descriptive_metadata = descriptive_metadata
         self.server_uri = server_uri
-        Presentation3.__init__(self, server_uri, self.descriptive_metadata["pid"])
+        Presentation3.__init__(
+            self,
+            server_uri,
+            self.descriptive_metadata["pid"],
+            client=client,
+            dimensions=dimensions,
+        )
+        if not isinstance(self.client, MemoClient):
+            self.client = MemoClient(self.client)
         self.manifest = self.initialize_manifest()
 
     def initialize_manifest(self):
@@ -72,13 +109,119 @@ class Manifest3(Presentation3):
             initial_manifest["summary"] = self.descriptive_metadata["summary"]
         return initial_manifest
 
-    def build_audio_manifest(self):
+    def add_audio_canvas(self):
+        """Adds the audio canvas to the manifest and returns the manifest as a dict."""
         self.manifest["items"] = [
             AudioCanvas(
-                self.descriptive_metadata["pid"], self.server_uri, self.id_prefix
+                self.descriptive_metadata["pid"],
+                self.server_uri,
+                self.id_prefix,
+                client=self.client,
+                dimensions=self.dimensions,
             ).build_canvas()
         ]
-        return json.dumps(self.manifest, indent=4)
+        if self.events is not None:
+            self.events.canvas_built(self.pid, self.pid, 1)
+        return self.manifest
+
+    def build_audio_manifest(self):
+        return dumps(self.add_audio_canvas(), indent=4)
+
+    def add_book_canvases(
+        self,
+        pages=None,
+        images=None,
+        workers=8,
+        chunk_size=None,
+        viewing_direction="left-to-right",
+    ):
+        """Adds a canvas for each page of a book to the manifest and returns the manifest as a dict.
+
+        Pages that cannot be read are left out and recorded in self.failures.
+
+        Args:
+            pages (list): A list of tuples with the pid of the page and the corresponding page number.
+            images (iiif.pages.PageImages): Pages already read, for example for a 2.1.1 manifest of the same book, to
+                render instead of reading pages again.
+            workers (int): The maximum number of info.json requests in flight at once.
+            chunk_size (int): Build canvases this many at a time as the manifest is written, or None to build them now.
+            viewing_direction (str): The viewingDirection of the book.
+        """
+        if images is None:
+            images = PageImages(
+                self.pid,
+                pages,
+                self.server_uri,
+                client=self.client,
+                dimensions=self.dimensions,
+                events=self.events,
+                workers=workers,
+                chunk_size=chunk_size,
+            )
+        self.failures = images.failures
+        if len(images.images) == 0:
+            raise Exception(
+                f"Could not build any canvases for {self.pid}: {self.failures}"
+            )
+        self.manifest["behavior"] = ["paged"]
+        self.manifest["viewingDirection"] = viewing_direction
+        self.manifest["items"] = (
+            Windowed(images.images, self.__build_page_canvas, chunk_size)
+            if chunk_size is not None
+            else [self.__build_page_canvas(image) for image in images.images]
+        )
+        return self.manifest
+
+    def build_book_manifest(self, pages=None, images=None, workers=8):
+        return dumps(
+            self.add_book_canvases(pages, images=images, workers=workers), indent=4
+        )
+
+    def __build_page_canvas(self, image):
+        identifier = f"{self.id_prefix}/{self.pid}/canvas/{image.number}"
+        return {
+            "id": identifier,
+            "type": "Canvas",
+            "label": {"none": [image.pid]},
+            "height": image.height,
+            "width": image.width,
+            "items": [
+                {
+                    "id": f"{identifier}/page",
+                    "type": "AnnotationPage",
+                    "items": [
+                        {
+                            "id": f"{identifier}/page/annotation",
+                            "type": "Annotation",
+                            "motivation": "painting",
+                            "body": {
+                                "id": f"{image.service}/full/max/0/default.jpg",
+                                "type": "Image",
+                                "format": "image/jpeg",
+                                "height": image.height,
+                                "width": image.width,
+                                "service": [
+                                    {
+                                        "@id": image.service,
+                                        "@type": "ImageService2",
+                                        "profile": (
+                                            image.profile[0]
+                                            if isinstance(image.profile, list)
+                                            else image.profile
+                                        ),
+                                    }
+                                ],
+                            },
+                            "target": identifier,
+                        }
+                    ],
+                }
+            ],
+        }
+
+    def write(self, handle, indent=4):
+        """Streams the manifest to a text file handle.  Pass an indent of None for compact output."""
+        write_manifest(self.manifest, handle, indent=indent)
 
 
 class AudioCanvas(Presentation3):
@@ -87,12 +230,18 @@ class AudioCanvas(Presentation3):
         fedora_pid,
         server_uri="https://digital.lib.utk.edu/",
         id_prefix="https://raw.githubusercontent.com/utkdigitalinitiatives/utk_iiif_recipes/main/raw_manifests",
+        client=None,
+        dimensions=None,
     ):
         self.id = f"{id_prefix}/{fedora_pid}/canvas"
         self.pid = fedora_pid
         self.audio_uri = f"{server_uri}/collections/islandora/object/{fedora_pid}/datastream/PROXY_MP3/view"
-        Presentation3.__init__(self, server_uri, fedora_pid)
-        self.duration = TechnicalMetadataScraper(self.pid).get_nlnz_duration()
+        Presentation3.__init__(
+            self, server_uri, fedora_pid, client=client, dimensions=dimensions
+        )
+        self.duration = TechnicalMetadataScraper(
+            self.pid, islandora_frontend=f"{server_uri}collections/", client=self.client
+        ).get_nlnz_duration()
 
     def build_canvas(self):
         return {
@@ -100,7 +249,13 @@ class AudioCanvas(Presentation3):
             "type": "Canvas",
             "duration": self.duration,
             "thumbnail": self.generate_thumbnail(),
-            "accompanyingCanvas": ImageCanvas(self.pid, "TN").build_canvas(),
+            "accompanyingCanvas": ImageCanvas(
+                self.pid,
+                "TN",
+                server_uri=self.server_uri,
+                client=self.client,
+                dimensions=self.dimensions,
+            ).build_canvas(),
             "items": [
                 {
                     "id": f"{self.id}/page",
@@ -136,15 +291,19 @@ class ImageCanvas(Presentation3):
         datastream="TN",
         server_uri="https://digital.lib.utk.edu/",
         id_prefix="https://raw.githubusercontent.com/utkdigitalinitiatives/utk_iiif_recipes/main/raw_manifests",
+        client=None,
+        dimensions=None,
     ):
         self.id = f"{id_prefix}/{fedora_pid}/{datastream}/canvas"
         self.pid = fedora_pid
         self.datastream = datastream
         self.server = server_uri
+        Presentation3.__init__(
+            self, server_uri, fedora_pid, client=client, dimensions=dimensions
+        )
         self.info = self.__get_info_json()
         self.height = self.info["height"]
         self.width = self.info["width"]
-        Presentation3.__init__(self, server_uri, fedora_pid)
 
     def build_canvas(self):
         return {
@@ -164,9 +323,10 @@ class ImageCanvas(Presentation3):
         }
 
     def __get_info_json(self):
-        return requests.get(
-            f"{self.server}iiif/2/collections~islandora~object~{self.pid}~datastream~{self.datastream}/info.json"
-        ).json()
+        return self.read_info_json(
+            self.datastream,
+            f"{self.server}iiif/2/collections~islandora~object~{self.pid}~datastream~{self.datastream}/info.json",
+        )
 
     def __get_items(self):
         return [
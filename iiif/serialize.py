@@ -0,0 +1,168 @@
+from fedora import codec
+import hashlib
+import json
+import io
+
+
+class Windowed(list):
+    """A list whose values are only built when it is written, a window at a time, so that a manifest with thousands of
+    canvases never holds all of them at once.
+
+    write_manifest, dumps, and content_hash build each window, encode it in one call, and let it go before building
+    the next.  Anything else can read it like a list, and json.dumps encodes it like one by iterating over it.  It is
+    read-only, since the list it extends holds nothing.
+
+    Args:
+        items (list): Compact versions of the values, like iiif.manifest.Canvas objects.
+        build (callable): Returns the JSON value of an item.
+        size (int): How many values are built at once.
+    """
+
+    def __init__(self, items, build, size=100):
+        super().__init__()
+        self.items = items
+        self.build = build
+        self.size = size
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.build(item) for item in self.items[position]]
+        return self.build(self.items[position])
+
+    def __iter__(self):
+        for window in self.windows():
+            yield from window
+
+    def __eq__(self, other):
+        return isinstance(other, list) and list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return f"Windowed({len(self)} items in windows of {self.size})"
+
+    def windows(self):
+        for start in range(0, len(self.items), self.size):
+            yield [self.build(item) for item in self.items[start : start + self.size]]
+
+
+def _has_windows(value, depth):
+    if isinstance(value, Windowed):
+        return True
+    if depth > 0 and isinstance(value, dict):
+        return any(_has_windows(item, depth - 1) for item in value.values())
+    if depth > 0 and isinstance(value, list):
+        return any(_has_windows(item, depth - 1) for item in value)
+    return False
+
+
+def _write_compact(value, handle, depth):
+    if isinstance(value, Windowed):
+        handle.write("[")
+        for position, window in enumerate(value.windows()):
+            if position > 0:
+                handle.write(",")
+            handle.write(codec.dumps(window)[1:-1])
+        handle.write("]")
+    elif depth > 0 and isinstance(value, dict):
+        handle.write("{")
+        for position, (key, item) in enumerate(value.items()):
+            if position > 0:
+                handle.write(",")
+            handle.write(codec.dumps(key))
+            handle.write(":")
+            _write_compact(item, handle, depth - 1)
+        handle.write("}")
+    elif depth > 0 and isinstance(value, list):
+        handle.write("[")
+        for position, item in enumerate(value):
+            if position > 0:
+                handle.write(",")
+            _write_compact(item, handle, depth - 1)
+        handle.write("]")
+    else:
+        handle.write(codec.dumps(value))
+
+
+def _write_indented(value, handle, indent, level, depth):
+    padding = " " * (indent * level)
+    if isinstance(value, Windowed):
+        if len(value) == 0:
+            handle.write("[]")
+            return
+        handle.write("[\n")
+        for position, window in enumerate(value.windows()):
+            if position > 0:
+                handle.write(",\n")
+            items = json.dumps(window, indent=indent)[2:-2]
+            handle.write(padding + items.replace("\n", "\n" + padding))
+        handle.write(f"\n{padding}]")
+    elif depth > 0 and isinstance(value, (dict, list)) and len(value) > 0:
+        inner = padding + " " * indent
+        handle.write("{\n" if isinstance(value, dict) else "[\n")
+        items = value.items() if isinstance(value, dict) else enumerate(value)
+        for position, (key, item) in enumerate(items):
+            handle.write(",\n" + inner if position > 0 else inner)
+            if isinstance(value, dict):
+                handle.write(f"{json.dumps(key)}: ")
+            _write_indented(item, handle, indent, level + 1, depth - 1)
+        handle.write(f"\n{padding}" + ("}" if isinstance(value, dict) else "]"))
+    else:
+        handle.write(json.dumps(value, indent=indent).replace("\n", "\n" + padding))
+
+
+def write_manifest(manifest, handle, indent=4):
+    """Writes a manifest to a text file handle as it is encoded instead of building the whole string first.
+
+    With an indent, the output is identical to json.dumps(manifest, indent=indent).  With an indent of None, the
+    output is compact with no whitespace or escaping of non-ASCII characters.  In compact mode, each canvas is encoded
+    by the JSON backend of fedora.codec, which produces the same bytes whichever library it uses.  A Windowed list
+    anywhere in the top four levels is written a window at a time, with the same output as the list it stands for.
+
+    Args:
+        manifest (dict): The manifest to write.
+        handle (file): A text file handle open for writing.
+        indent (int): The number of spaces to indent by, or None for compact output.
+    """
+    if indent is None:
+        _write_compact(manifest, handle, 4)
+    elif _has_windows(manifest, 4):
+        _write_indented(manifest, handle, indent, 0, 4)
+    else:
+        for chunk in json.JSONEncoder(indent=indent).iterencode(manifest):
+            handle.write(chunk)
+
+
+class _HashingWriter:
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, text):
+        self.hash.update(text.encode("utf-8"))
+
+
+def content_hash(manifest, indent=4):
+    """Returns the SHA-256 hex digest of the bytes write_manifest would write, without keeping them in memory.
+
+    Example:
+        >>> content_hash(manifest) == hashlib.sha256(dumps(manifest).encode("utf-8")).hexdigest()
+        True
+    """
+    writer = _HashingWriter()
+    write_manifest(manifest, writer, indent=indent)
+    return writer.hash.hexdigest()
+
+
+def dumps(manifest, indent=4):
+    """Returns a manifest serialized the same way write_manifest would write it."""
+    if _has_windows(manifest, 4):
+        handle = io.StringIO()
+        write_manifest(manifest, handle, indent=indent)
+        return handle.getvalue()
+    if indent is None:
+        return codec.dumps(manifest)
+    return json.dumps(manifest, indent=indent)
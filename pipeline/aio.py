@@ -0,0 +1,87 @@
+from fedora.client import MemoClient
+from fedora.instrument import bind
+from iiif.presentation3 import Manifest3
+import asyncio
+
+
+class AsyncManifestBuilder:
+    """Builds manifests from a coroutine so many objects can be generated at once, for example inside a web service.
+
+    For audio objects, MODS, TECHMD, and the info.json of the TN datastream do not depend on each other, so they are
+    requested at the same time through a fedora.client.MemoClient for the build.  The manifest is then assembled from
+    those responses by the same code ManifestBuilder uses without requesting anything again.  Books are built by
+    ManifestBuilder in a thread, since their pages are already requested concurrently.
+
+    Requests are made with the blocking HTTP client of the builder in the default executor of the running loop.
+
+    Args:
+        builder (pipeline.build.ManifestBuilder): The builder to take the server, client, and caches from.
+
+    Example:
+        >>> manifests = await asyncio.gather(*(AsyncManifestBuilder(builder).build(pid) for pid in pids))
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+
+    @staticmethod
+    async def __run(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, bind(function), *args
+        )
+
+    async def build(self, pid, collection=None, model=None, pages=None):
+        """Builds the manifest for a PID.
+
+        Args:
+            pid (str): The PID of the object.
+            collection (str): The collection of the object if already known.
+            model (str): The content model of the object if already known.
+            pages (list): The pages and page numbers of a book if already known.
+
+        Returns:
+            tuple: The manifest as a dict and a list of pages that could not be added to it.
+        """
+        with self.builder.recording(pid):
+            return await self.__build(pid, collection, model, pages)
+
+    async def __build(self, pid, collection, model, pages):
+        builder = self.builder
+        if model is None:
+            collection, model = (await self.__run(builder.resolve_many, [pid]))[pid]
+        if model != "islandora:sp-audioCModel":
+            return await self.__run(builder.build, pid, collection, model, pages)
+        server_uri = f"{builder.server}/"
+        frontend = f"{server_uri}collections/"
+        client = MemoClient(builder.client)
+        requests = [
+            self.__run(builder.describe, pid, model, client),
+            self.__run(
+                client.get_content,
+                f"{frontend}/islandora/object/{pid}/datastream/TECHMD",
+            ),
+        ]
+        thumbnail = (
+            builder.dimensions.get(pid, "TN")
+            if builder.dimensions is not None
+            else None
+        )
+        if thumbnail is None or "sizes" not in thumbnail:
+            requests.append(
+                self.__run(
+                    client.get_content,
+                    f"{server_uri}iiif/2/collections~islandora~object~{pid}~datastream~TN/info.json",
+                )
+            )
+        with builder.timer.stage("fetch"):
+            metadata = (await asyncio.gather(*requests))[0]
+        with builder.timer.stage("canvases"):
+            manifest = Manifest3(
+                metadata,
+                server_uri=server_uri,
+                client=client,
+                dimensions=builder.dimensions,
+                events=builder.events,
+            ).add_audio_canvas()
+        builder.done(pid, manifest, [], client.fetched)
+        return manifest, []
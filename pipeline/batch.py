@@ -0,0 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fedora.tuples import parse_fedora_date
+from iiif.events import Throughput
+import hashlib
+import os
+import time
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _HashingFile:
+    """Writes text to a file handle while hashing the UTF-8 bytes written."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.hash = hashlib.sha256()
+
+    def write(self, text):
+        self.hash.update(text.encode("utf-8"))
+        return self.handle.write(text)
+
+
+def read_pid_list(handle):
+    """Reads one PID per line from a file handle, ignoring blank lines and lines starting with #."""
+    return [
+        line.strip()
+        for line in handle
+        if line.strip() != "" and not line.strip().startswith("#")
+    ]
+
+
+class BatchRunner:
+    """Generates manifests for many PIDs at once and writes each to its own file in an output directory.
+
+    A PID is skipped when its manifest already exists and is newer than the object's lastModifiedDate.  PIDs whose
+    content model or lastModifiedDate is not in the worklist, as with PIDs read from a file, are looked up together
+    with ManifestBuilder.resolve_many before anything is skipped.  With a
+    build state, a PID is skipped only when the state shows it was built after its lastModifiedDate, and the state is
+    updated after each successful build.  With versions, every version the PID would be written as must be current,
+    so a run with both versions after a run with one still writes the other.
+
+    A manifest that builds to the same bytes as the file already there is not written again, so unchanged objects keep
+    their files, and whatever publishes the output directory can skip them.
+
+    Args:
+        builder (pipeline.build.ManifestBuilder): The builder shared by every worker.
+        output_directory (str): Where to write manifests.
+        workers (int): How many manifests to build at once.
+        force (bool): Rebuild manifests even if they are current.
+        page_index (dict): Pages and page numbers keyed by book, like the result of TuplesSearch.get_collection_pages.
+            Books that are not in the index have their pages looked up one at a time.
+        state (pipeline.state.BuildState): Optional record of when each PID was last built.
+        versions (tuple): Presentation API versions to build each PID as from a single harvest, or None to build only
+            the version its content model uses.  See write_versions for where they are written.
+    """
+
+    def __init__(
+        self,
+        builder,
+        output_directory,
+        workers=4,
+        force=False,
+        page_index=None,
+        state=None,
+        versions=None,
+    ):
+        self.builder = builder
+        self.versions = versions
+        self.state = state
+        self.page_index = page_index if page_index is not None else {}
+        self.output_directory = output_directory
+        self.workers = workers
+        self.force = force
+        os.makedirs(output_directory, exist_ok=True)
+
+    def output_path(self, pid, version=None):
+        name = pid.replace(":", "_")
+        if version is not None:
+            name = f"{name}.v{version}"
+        return os.path.join(self.output_directory, f"{name}.json")
+
+    def extra_versions(self, model):
+        """Returns the versions written next to the manifest of a PID with a content model, as write_versions names
+        them, which are none unless versions is set."""
+        if self.versions is None:
+            return ()
+        return tuple(
+            version
+            for version in self.builder.versions(model)
+            if version in self.versions
+        )[1:]
+
+    def is_current(self, pid, modified=None, model=None):
+        """Returns True if the manifest of a PID, and every other version of it this runner writes, is newer than its
+        lastModifiedDate."""
+        if self.force:
+            return False
+        extra = self.extra_versions(model)
+        paths = [self.output_path(pid)] + [
+            self.output_path(pid, version) for version in extra
+        ]
+        if not all(os.path.exists(path) for path in paths):
+            return False
+        if self.state is not None:
+            return self.state.is_current(pid, modified, extra)
+        if modified is None:
+            return True
+        return all(
+            os.path.getmtime(path) > parse_fedora_date(modified) for path in paths
+        )
+
+    def write(self, pid, manifest, started):
+        """Writes a manifest to its output path through a temporary file and records when its build started.
+
+        The file is left alone when it already holds the same bytes.  Without a build state, its modification time is
+        set to when the build started either way, since that is what marks it current for the next run, and an object
+        changed in Fedora while it was being built is then rebuilt.
+
+        Returns:
+            bool: Whether the file was written, False if it was unchanged.
+        """
+        changed = self.__write_file(self.output_path(pid), manifest, started)
+        if self.state is not None:
+            self.state.record(pid, started)
+        return changed
+
+    def write_versions(self, pid, manifests, started):
+        """Writes the manifests returned by ManifestBuilder.build_versions the way write does.
+
+        The version the content model uses by default goes to the output path of the PID, so a run with several
+        versions leaves the same files as one without, and each other version goes next to it with its version in
+        the name, like agrtfhs_2275.v3.json.
+
+        Returns:
+            bool: Whether any file was written.
+        """
+        changed = [
+            self.__write_file(
+                self.output_path(pid, None if position == 0 else version),
+                manifest,
+                started,
+            )
+            for position, (version, (manifest, _)) in enumerate(manifests.items())
+        ]
+        if self.state is not None:
+            self.state.record(pid, started, tuple(manifests)[1:])
+        return any(changed)
+
+    def __write_file(self, path, manifest, started):
+        with open(f"{path}.tmp", "w", encoding="utf-8") as output:
+            written = _HashingFile(output)
+            self.builder.write(manifest, written)
+        changed = (
+            not os.path.exists(path) or _file_hash(path) != written.hash.hexdigest()
+        )
+        if changed:
+            os.replace(f"{path}.tmp", path)
+        else:
+            os.remove(f"{path}.tmp")
+        if self.state is None:
+            os.utime(path, (started, started))
+        return changed
+
+    def __build_and_write(self, pid, collection, model):
+        started = time.time()
+        with self.builder.recording(pid):
+            if self.versions is not None:
+                manifests = self.builder.build_versions(
+                    pid, self.versions, collection, model, self.page_index.get(pid)
+                )
+                written = self.write_versions(pid, manifests, started)
+                return next(iter(manifests.values()))[1], written
+            manifest, failures = self.builder.build(
+                pid, collection, model, self.page_index.get(pid)
+            )
+            written = self.write(pid, manifest, started)
+        return failures, written
+
+    def __resolve(self, worklist):
+        unresolved = [
+            pid
+            for pid, collection, model, modified in worklist
+            if model is None or modified is None
+        ]
+        if len(unresolved) == 0:
+            return worklist
+        resolved = self.builder.resolve_many(unresolved, last_modified=True)
+        return [
+            (
+                pid,
+                *(
+                    known if known is not None else found
+                    for known, found in zip(
+                        (collection, model, modified), resolved.get(pid, (None,) * 3)
+                    )
+                ),
+            )
+            for pid, collection, model, modified in worklist
+        ]
+
+    def run(self, worklist):
+        """Builds every manifest in a worklist.
+
+        Args:
+            worklist (list): Tuples of pid, collection, content model, and lastModifiedDate.  Anything other than the
+                pid may be None and will be looked up in the resource index in batches.  PIDs that are not in it are
+                never skipped, so they are reported as failed.
+
+        Returns:
+            dict: A summary of the run with counts, failures, throughput, and seconds spent in each stage.
+        """
+        start = time.perf_counter()
+        throughput = self.builder.events.subscribe(Throughput())
+        summary = {
+            "total": len(worklist),
+            "built": 0,
+            "skipped": 0,
+            "failed": [],
+            "pages_skipped": 0,
+            "unchanged": 0,
+        }
+        pending = []
+        for pid, collection, model, modified in self.__resolve(worklist):
+            if model is not None and self.is_current(pid, modified, model):
+                summary["skipped"] += 1
+            else:
+                pending.append((pid, collection, model))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.__build_and_write, pid, collection, model): pid
+                for pid, collection, model in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    failures, written = future.result()
+                    summary["pages_skipped"] += len(failures)
+                    summary["unchanged"] += 0 if written else 1
+                    summary["built"] += 1
+                except Exception as e:
+                    summary["failed"].append((futures[future], repr(e)))
+        summary["seconds"] = time.perf_counter() - start
+        summary["manifests_per_second"] = (
+            summary["built"] / summary["seconds"] if summary["seconds"] > 0 else 0
+        )
+        summary["stages"] = dict(self.builder.timer.seconds)
+        self.builder.events.unsubscribe(throughput)
+        add_throughput(summary, throughput)
+        return summary
+
+
+def add_throughput(summary, throughput):
+    """Adds the pages built, bytes fetched, and their rates counted by an iiif.events.Throughput to a run summary."""
+    counts = throughput.snapshot()
+    for key in ("pages_built", "pages_per_second", "bytes_fetched", "bytes_per_second"):
+        summary[key] = counts[key]
+
+
+def format_summary(summary):
+    """Formats the summary returned by BatchRunner.run as printable lines."""
+    lines = [
+        f"Built {summary['built']} of {summary['total']} manifests in {summary['seconds']:.2f}s "
+        f"({summary['manifests_per_second']:.2f} manifests/sec).",
+        f"Built {summary['pages_built']} pages ({summary['pages_per_second']:.2f} pages/sec) and fetched "
+        f"{summary['bytes_fetched']} bytes ({summary['bytes_per_second'] / 1e6:.2f} MB/sec).",
+        f"Skipped {summary['skipped']} current manifests and {summary['pages_skipped']} pages that failed.",
+        f"Left {summary['unchanged']} rebuilt manifests unwritten because their content had not changed.",
+        f"Failed {len(summary['failed'])} manifests.",
+    ]
+    lines += [f"\t{pid}: {error}" for pid, error in summary["failed"]]
+    lines.append("Time per stage, summed across workers:")
+    lines += [
+        f"\t{stage}: {seconds:.2f}s"
+        for stage, seconds in sorted(
+            summary["stages"].items(), key=lambda stage: stage[1], reverse=True
+        )
+    ]
+    return lines
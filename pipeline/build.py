@@ -0,0 +1,365 @@
+from contextlib import contextmanager, nullcontext
+from fedora.client import MemoClient, default_client
+from fedora.instrument import span
+from fedora.mods import MODSScraper
+from fedora.risearch import TuplesSearch
+from iiif.events import BuildEvents
+from iiif.serialize import content_hash, write_manifest
+import threading
+import time
+
+
+def cleanup_server_name(server_uri):
+    if server_uri.endswith("/"):
+        server_uri = server_uri[:-1]
+    return server_uri.replace("/collections", "")
+
+
+class ManifestUnavailable(LookupError):
+    """Raised when a PID has no manifest to build, because it is not in the resource index or its content model is
+    not supported."""
+
+
+class StageTimer:
+    """Accumulates wall time spent in each stage of a build across every thread that shares it.
+
+    Each stage is also a span of the build being recorded by fedora.instrument, if there is one.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.__lock:
+                self.seconds[name] = self.seconds.get(name, 0) + elapsed
+
+
+class ManifestBuilder:
+    """Generates the manifest for a single PID based on its content model.
+
+    Books are serialized as 2.1.1 manifests and audio objects as 3.0 manifests unless a version is asked for.  Books
+    can also be built as 3.0 manifests, or as both from one harvest with build_versions.
+
+    Args:
+        server (str): The server used for harvesting metadata and writing id values in the manifest.
+        risearch (str): The uri of the risearch interface.
+        client (fedora.client.HTTPClient): The HTTP client shared by every request in the build.  Each build wraps it
+            in a fedora.client.MemoClient so a resource is never downloaded twice for one manifest.
+        workers (int): How many page info.json requests can run at once for a book.
+        timer (StageTimer): Where to record time spent in risearch, mods, canvases, and serialize stages.
+        indent (int): The indent manifests are written with, or None for compact output.
+        dimensions (iiif.dimensions.DimensionIndex): An optional index consulted before requesting info.json.
+        mods_source (fedora.sources.ExportDirectorySource): An optional bulk source of MODS, like an export directory
+            or an OAI-PMH harvest, consulted before requesting the MODS datastream.
+        reports (fedora.instrument.ReportWriter): Where to write a report of the spans and counters of each build
+            recorded with recording, or None to not record builds.
+        events (iiif.events.BuildEvents): Where canvas-built, page-failed, and manifest-done events of every build
+            are sent.  Subscribe listeners to it to follow progress.
+        chunk_size (int): Build the canvases of books this many at a time as they are written instead of all at once,
+            to keep memory flat for books with thousands of pages, or None to build them with the manifest.
+    """
+
+    supported_content_models = ("islandora:bookCModel", "islandora:sp-audioCModel")
+
+    def __init__(
+        self,
+        server="https://digital.lib.utk.edu",
+        risearch="http://localhost:8080/fedora/risearch",
+        client=None,
+        workers=8,
+        timer=None,
+        indent=4,
+        dimensions=None,
+        mods_source=None,
+        reports=None,
+        events=None,
+        chunk_size=None,
+    ):
+        self.reports = reports
+        self.chunk_size = chunk_size
+        self.events = events if events is not None else BuildEvents()
+        self.server = cleanup_server_name(server)
+        self.dimensions = dimensions
+        self.mods_source = mods_source
+        self.indent = indent
+        self.client = client if client is not None else default_client()
+        self.workers = workers
+        self.timer = timer if timer is not None else StageTimer()
+        self.search = TuplesSearch(
+            language="sparql", ri_endpoint=risearch, client=self.client
+        )
+
+    def build(self, pid, collection=None, model=None, pages=None, version=None):
+        """Builds the manifest for a PID.
+
+        This runs the resolve, describe, and assemble stages one after another with a MemoClient for the build.
+
+        Args:
+            pid (str): The PID of the object.
+            collection (str): The collection of the object if already known.
+            model (str): The content model of the object if already known.
+            pages (list): The pages and page numbers of a book if already known.
+            version (int): The presentation API version to build, or None for the one the content model uses.  Audio
+                objects are always built as 3.0.
+
+        Returns:
+            tuple: The manifest as a dict and a list of pages that could not be added to it.
+        """
+        client = MemoClient(self.client)
+        collection, model, pages = self.resolve(pid, collection, model, pages)
+        metadata = self.describe(pid, model, client, version)
+        return self.assemble(collection, model, pages, metadata, client, version)
+
+    def build_versions(
+        self, pid, versions=(2, 3), collection=None, model=None, pages=None
+    ):
+        """Builds the manifest for a PID in several presentation API versions from a single harvest.
+
+        MODS and the image of every page are read once and rendered to each version, so publishing both versions costs
+        no more requests than publishing one.  Versions the content model cannot be built as are left out.
+
+        Returns:
+            dict: Tuples of the manifest as a dict and a list of pages that could not be added to it, keyed by version
+                with the version the content model uses by default first.
+
+        Example:
+            >>> manifests = builder.build_versions("agrtfhs:2275")
+            >>> v2, failures = manifests[2]
+        """
+        client = MemoClient(self.client)
+        collection, model, pages = self.resolve(pid, collection, model, pages)
+        metadata = self.describe_versions(pid, model, client, versions)
+        return self.assemble_versions(collection, model, pages, metadata, client)
+
+    def describe_versions(self, pid, model, client=None, versions=(2, 3)):
+        """Reads MODS once and returns the descriptive metadata for each version the content model can be built as."""
+        with self.timer.stage("mods"):
+            scraper = self.__scraper(pid, client if client is not None else self.client)
+            return {
+                version: self.__metadata(scraper, model, version)
+                for version in self.versions(model)
+                if version in versions
+            }
+
+    def assemble_versions(self, collection, model, pages, metadata, client=None):
+        """Reads the pages of a book once and renders them to a manifest for each version metadata was described for.
+
+        Sends a manifest-done event for each version, with the bytes downloaded counted for the first.
+        """
+        client = client if client is not None else MemoClient(self.client)
+        pid = next(iter(metadata.values()))["pid"]
+        images = None
+        if model == "islandora:bookCModel":
+            from iiif.pages import PageImages
+
+            with self.timer.stage("canvases"):
+                images = PageImages(
+                    pid,
+                    pages,
+                    f"{self.server}/",
+                    client=client,
+                    dimensions=self.dimensions,
+                    events=self.events,
+                    workers=self.workers,
+                    chunk_size=self.chunk_size,
+                )
+        manifests = {}
+        for version, described in metadata.items():
+            manifests[version] = self.__render(
+                collection, model, pages, described, client, version, images
+            )
+            self.done(
+                pid, *manifests[version], client.fetched if len(manifests) == 1 else 0
+            )
+        return manifests
+
+    def versions(self, model):
+        """Returns the presentation API versions a content model can be built as, the one it uses by default first."""
+        if model == "islandora:bookCModel":
+            return (2, 3)
+        return (3,)
+
+    def recording(self, pid):
+        """Records everything done for a PID inside the context as one build when the builder has reports.
+
+        Example:
+            >>> with builder.recording("agrtfhs:2275"):
+            ...     manifest, failures = builder.build("agrtfhs:2275")
+            ...     builder.write(manifest, output)
+        """
+        if self.reports is None:
+            return nullcontext()
+        return self.reports.recording("build", pid=pid)
+
+    def resolve(self, pid, collection=None, model=None, pages=None):
+        """Looks up whatever is not already known of the collection, content model, and pages of a PID in risearch.
+
+        Returns:
+            tuple: The collection, content model, and pages, which is None for anything but a book.
+
+        Raises:
+            ManifestUnavailable: If the PID is not in the resource index or its content model is not supported.
+        """
+        if model is None:
+            collection, model = self.resolve_many([pid])[pid]
+        self.require_supported(pid, model)
+        if model == "islandora:bookCModel" and pages is None:
+            with self.timer.stage("risearch"):
+                pages = self.search.get_pages_and_page_numbers(pid)
+        return collection, model, pages
+
+    def require_supported(self, pid, model):
+        """Raises ManifestUnavailable unless a PID was found in the resource index with a supported content model."""
+        if model is None:
+            raise ManifestUnavailable(f"{pid} is not in the resource index.")
+        if model not in self.supported_content_models:
+            raise ManifestUnavailable(
+                f"Cannot generate manifests for {model} yet. Supported content models include: {self.supported_content_models}."
+            )
+
+    def resolve_many(self, pids, chunk_size=100, last_modified=False):
+        """Looks up the collection and content model of many PIDs with one risearch query for each chunk_size of them.
+
+        A PID in several collections gets the first of them in sorted order.  A PID with several content models gets
+        the first one that can be built, or else the first one, so that resolve reports it as unsupported.  With
+        last_modified, the latest lastModifiedDate of each PID and its pages comes back from the same queries.
+
+        Returns:
+            dict: A tuple of the collection and content model keyed by every PID, both None for a PID that is not in the
+                resource index.  Pass them to resolve or require_supported to raise ManifestUnavailable for those.  With
+                last_modified, each tuple also has the lastModifiedDate, None for a PID that is not in the index.
+
+        Example:
+            >>> builder.resolve_many(["agrtfhs:2275", "wwiioh:2001"])
+            {'agrtfhs:2275': ('collections:agrtfhs', 'islandora:bookCModel'), 'wwiioh:2001': ('collections:wwiioh',
+            'islandora:sp-audioCModel')}
+        """
+        with self.timer.stage("risearch"):
+            found = self.search.get_collections_and_content_models(
+                pids, chunk_size, last_modified
+            )
+        resolved = {}
+        for pid, (collections, models, *modified) in found.items():
+            supported = [
+                model for model in models if model in self.supported_content_models
+            ]
+            resolved[pid] = (
+                collections[0] if len(collections) > 0 else None,
+                (supported + models)[0] if len(models) > 0 else None,
+                *modified,
+            )
+        return resolved
+
+    def describe(self, pid, model, client=None, version=None):
+        """Reads the descriptive metadata of a PID from MODS for a presentation API version, by default the one its
+        model uses."""
+        with self.timer.stage("mods"):
+            return self.__metadata(
+                self.__scraper(pid, client if client is not None else self.client),
+                model,
+                version,
+            )
+
+    def __scraper(self, pid, client):
+        return MODSScraper(
+            pid,
+            islandora_frontend=f"{self.server}/collections/",
+            client=client,
+            source=self.mods_source,
+        )
+
+    def __metadata(self, scraper, model, version):
+        if (
+            version if version in self.versions(model) else self.versions(model)[0]
+        ) == 2:
+            return scraper.build_iiif_descriptive_metadata_v2()
+        return scraper.build_iiif_descriptive_metadata_v3()
+
+    def assemble(self, collection, model, pages, metadata, client=None, version=None):
+        """Builds the canvases of a manifest from its descriptive metadata and sends a manifest-done event.
+
+        Args:
+            version (int): The presentation API version metadata was described for, or None for the one the content
+                model uses.
+
+        Returns:
+            tuple: The manifest as a dict and a list of pages that could not be added to it.
+        """
+        client = client if client is not None else MemoClient(self.client)
+        manifest, failures = self.__render(
+            collection, model, pages, metadata, client, version
+        )
+        self.done(metadata["pid"], manifest, failures, client.fetched)
+        return manifest, failures
+
+    def __render(
+        self, collection, model, pages, metadata, client, version, images=None
+    ):
+        if version not in self.versions(model):
+            version = self.versions(model)[0]
+        with self.timer.stage("canvases"):
+            if version == 2:
+                from iiif.manifest import Manifest
+
+                manifest_object = Manifest(
+                    metadata,
+                    pages,
+                    collection if collection is not None else "",
+                    server_uri=f"{self.server}/",
+                    workers=self.workers,
+                    client=client,
+                    dimensions=self.dimensions,
+                    events=self.events,
+                    chunk_size=self.chunk_size,
+                    images=images,
+                )
+                return manifest_object.manifest, manifest_object.failures
+            from iiif.presentation3 import Manifest3
+
+            manifest_object = Manifest3(
+                metadata,
+                server_uri=f"{self.server}/",
+                client=client,
+                dimensions=self.dimensions,
+                events=self.events,
+            )
+            if model == "islandora:bookCModel":
+                manifest = manifest_object.add_book_canvases(
+                    pages,
+                    images=images,
+                    workers=self.workers,
+                    chunk_size=self.chunk_size,
+                )
+                return manifest, manifest_object.failures
+            return manifest_object.add_audio_canvas(), []
+
+    def done(self, pid, manifest, failures, fetched):
+        """Sends the manifest-done event of a manifest that took fetched bytes of downloads to build."""
+        self.events.manifest_done(
+            pid,
+            (
+                len(manifest["sequences"][0]["canvases"])
+                if "sequences" in manifest
+                else len(manifest["items"])
+            ),
+            failures,
+            fetched,
+        )
+
+    def write(self, manifest, handle):
+        """Streams a manifest returned by build to a text file handle."""
+        with self.timer.stage("serialize"):
+            write_manifest(manifest, handle, indent=self.indent)
+
+    def content_hash(self, manifest):
+        """Returns the SHA-256 hex digest of the bytes write would write for a manifest."""
+        with self.timer.stage("serialize"):
+            return content_hash(manifest, indent=self.indent)
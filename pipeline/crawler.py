@@ -0,0 +1,247 @@
+from fedora.client import MemoClient
+from fedora.instrument import Recorder, recording
+from iiif.events import Throughput
+from pipeline.batch import BatchRunner, add_throughput
+from pipeline.state import latest_modified
+import threading
+import queue
+import time
+
+
+class CollectionCrawler(BatchRunner):
+    """Generates manifests for every member of several collections as a pipeline of stages joined by bounded queues.
+
+    One thread lists the members of each collection from risearch, and pools of workers read MODS, build canvases, and
+    serialize manifests.  Each queue holds at most queue_size objects, so a slow stage makes the stages before it wait
+    instead of piling up work in memory, and no stage runs further ahead of the others than the queues allow.  Combine
+    with a fedora.throttle.HostThrottle on the client of the builder to limit how hard each host is hit.
+
+    When the builder has reports, each object is recorded as one build with a describe, assemble, and write span
+    from whichever thread ran each stage.  An object that belongs to more than one of the collections is built once.
+    Skipping current manifests, force, build state, and versions work as they do for BatchRunner.
+
+    Args:
+        builder (pipeline.build.ManifestBuilder): The builder shared by every worker.
+        output_directory (str): Where to write manifests.
+        mods_workers (int): How many objects can have their MODS read at once.
+        canvas_workers (int): How many manifests can have their canvases built at once.
+        serialize_workers (int): How many manifests can be written at once.
+        queue_size (int): How many objects can wait between two stages.
+        force (bool): Rebuild manifests even if they are current.
+        state (pipeline.state.BuildState): Optional record of when each PID was last built.
+        versions (tuple): Presentation API versions to build each PID as from a single harvest, or None.
+    """
+
+    def __init__(
+        self,
+        builder,
+        output_directory,
+        mods_workers=4,
+        canvas_workers=4,
+        serialize_workers=1,
+        queue_size=16,
+        force=False,
+        state=None,
+        versions=None,
+    ):
+        BatchRunner.__init__(
+            self,
+            builder,
+            output_directory,
+            workers=canvas_workers,
+            force=force,
+            state=state,
+            versions=versions,
+        )
+        self.mods_workers = mods_workers
+        self.canvas_workers = canvas_workers
+        self.serialize_workers = serialize_workers
+        self.queue_size = queue_size
+        self.__lock = threading.Lock()
+
+    def __list_members(self, collections, output, summary):
+        search = self.builder.search
+        seen = set()
+        for collection in collections:
+            try:
+                with self.builder.timer.stage("risearch"):
+                    pages = search.get_collection_pages(collection)
+                    pages_modified = search.get_collection_pages_last_modified(
+                        collection
+                    )
+                    members = search.get_collection_members(collection)
+            except Exception as e:
+                self.__fail(summary, collection, e)
+                continue
+            for pid, model, modified in members:
+                if pid in seen:
+                    continue
+                seen.add(pid)
+                with self.__lock:
+                    summary["total"] += 1
+                if self.is_current(
+                    pid, latest_modified(modified, pages_modified.get(pid)), model
+                ):
+                    with self.__lock:
+                        summary["skipped"] += 1
+                    continue
+                output.put(
+                    (
+                        pid,
+                        collection,
+                        model,
+                        pages.get(pid),
+                        (
+                            Recorder("build", pid=pid)
+                            if self.builder.reports is not None
+                            else None
+                        ),
+                    )
+                )
+
+    def __describe(self, item):
+        pid, collection, model, pages, recorder = item
+        started = time.time()
+        client = MemoClient(self.builder.client)
+        with recording(recorder, "describe", pid=pid):
+            collection, model, pages = self.builder.resolve(
+                pid, collection, model, pages
+            )
+            if self.versions is not None:
+                metadata = self.builder.describe_versions(
+                    pid, model, client, self.versions
+                )
+            else:
+                metadata = self.builder.describe(pid, model, client)
+        return pid, started, collection, model, pages, metadata, client, recorder
+
+    def __assemble(self, item):
+        pid, started, collection, model, pages, metadata, client, recorder = item
+        with recording(recorder, "assemble", pid=pid):
+            if self.versions is not None:
+                manifest = self.builder.assemble_versions(
+                    collection, model, pages, metadata, client
+                )
+                failures = next(iter(manifest.values()))[1]
+            else:
+                manifest, failures = self.builder.assemble(
+                    collection, model, pages, metadata, client
+                )
+        return pid, started, manifest, failures, recorder
+
+    def __serialize(self, item, summary):
+        pid, started, manifest, failures, recorder = item
+        with recording(recorder, "write", pid=pid):
+            if self.versions is not None:
+                written = self.write_versions(pid, manifest, started)
+            else:
+                written = self.write(pid, manifest, started)
+        self.__finish(recorder)
+        with self.__lock:
+            summary["built"] += 1
+            summary["unchanged"] += 0 if written else 1
+            summary["pages_skipped"] += len(failures)
+
+    def __finish(self, recorder):
+        if recorder is not None:
+            self.builder.reports.write(recorder)
+
+    def __fail(self, summary, pid, error):
+        with self.__lock:
+            summary["failed"].append((pid, repr(error)))
+
+    def __start_stage(self, workers, work, inbox, outbox, summary, finished):
+        remaining = workers
+
+        def run():
+            nonlocal remaining
+            while True:
+                item = inbox.get()
+                if item is None:
+                    break
+                try:
+                    result = work(item)
+                    if outbox is not None:
+                        outbox.put(result)
+                except Exception as e:
+                    self.__fail(summary, item[0], e)
+                    self.__finish(item[-1])
+            with self.__lock:
+                remaining -= 1
+                last = remaining == 0
+            if last:
+                finished()
+
+        threads = [threading.Thread(target=run, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def crawl(self, collections):
+        """Builds the manifest of every member of each collection.
+
+        Args:
+            collections (list): The PIDs of the collections to crawl.
+
+        Returns:
+            dict: A summary of the run in the same form as BatchRunner.run.
+        """
+        start = time.perf_counter()
+        throughput = self.builder.events.subscribe(Throughput())
+        summary = {
+            "total": 0,
+            "built": 0,
+            "skipped": 0,
+            "failed": [],
+            "pages_skipped": 0,
+            "unchanged": 0,
+        }
+        to_describe = queue.Queue(maxsize=self.queue_size)
+        to_assemble = queue.Queue(maxsize=self.queue_size)
+        to_serialize = queue.Queue(maxsize=self.queue_size)
+
+        def close(next_queue, workers):
+            def put_sentinels():
+                for _ in range(workers):
+                    next_queue.put(None)
+
+            return put_sentinels
+
+        threads = self.__start_stage(
+            self.serialize_workers,
+            lambda item: self.__serialize(item, summary),
+            to_serialize,
+            None,
+            summary,
+            lambda: None,
+        )
+        threads += self.__start_stage(
+            self.canvas_workers,
+            self.__assemble,
+            to_assemble,
+            to_serialize,
+            summary,
+            close(to_serialize, self.serialize_workers),
+        )
+        threads += self.__start_stage(
+            self.mods_workers,
+            self.__describe,
+            to_describe,
+            to_assemble,
+            summary,
+            close(to_assemble, self.canvas_workers),
+        )
+        try:
+            self.__list_members(collections, to_describe, summary)
+        finally:
+            close(to_describe, self.mods_workers)()
+            for thread in threads:
+                thread.join()
+        summary["seconds"] = time.perf_counter() - start
+        summary["manifests_per_second"] = (
+            summary["built"] / summary["seconds"] if summary["seconds"] > 0 else 0
+        )
+        summary["stages"] = dict(self.builder.timer.seconds)
+        self.builder.events.unsubscribe(throughput)
+        add_throughput(summary, throughput)
+        return summary
@@ -0,0 +1,423 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fedora.cache import ResponseCache
+from fedora.client import HTTPClient
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from iiif.dimensions import DimensionIndex
+from iiif.events import Throughput
+from pipeline.build import ManifestBuilder, ManifestUnavailable
+from urllib.parse import parse_qs, unquote, urlsplit
+import threading
+import argparse
+import requests
+import logging
+import hashlib
+import time
+import io
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestCache:
+    """A bounded, thread-safe LRU of serialized manifests keyed by PID and presentation API version.
+
+    Args:
+        max_entries (int): How many manifests to keep before the least recently used is dropped.
+        max_age (float): Seconds a manifest is served before it is rebuilt, or None to keep it until it is dropped.
+    """
+
+    def __init__(self, max_entries=256, max_age=3600):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the body and ETag of a fresh manifest, or None if it is not cached or is too old."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            body, etag, built_at = entry
+            if self.max_age is not None and time.time() - built_at > self.max_age:
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+            return body, etag
+
+    def put(self, key, body, etag):
+        with self.__lock:
+            self.__entries[key] = (body, etag, time.time())
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+
+class ManifestService:
+    """Builds manifests on demand, keeping recently built ones in memory so they are served without building again.
+
+    Cold builds run in a bounded pool of workers.  Requests for a manifest that is already being built wait for that
+    build instead of starting another.  The content model of each PID is looked up once and remembered for as many
+    PIDs as the cache holds manifests.  It picks the version of a request without one, and rejects a version the PID
+    cannot be built as before anything is built.
+
+    Args:
+        builder (pipeline.build.ManifestBuilder): The builder whose client, caches, and dimension index stay warm
+            for the life of the service.
+        build_workers (int): How many manifests can be built at once.
+        cache (ManifestCache): Where built manifests are kept.
+    """
+
+    def __init__(self, builder, build_workers=4, cache=None):
+        self.builder = builder
+        self.cache = cache if cache is not None else ManifestCache()
+        self.executor = ThreadPoolExecutor(max_workers=build_workers)
+        self.counters = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "builds": 0,
+            "build_failures": 0,
+            "build_seconds": 0.0,
+            "not_modified": 0,
+        }
+        self.responses = {}
+        self.throughput = builder.events.subscribe(Throughput())
+        self.__building = {}
+        self.__models = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self.__lock:
+            self.counters[name] += amount
+
+    def __build(self, pid, version, collection=None, model=None):
+        start = time.perf_counter()
+        try:
+            with self.builder.recording(pid):
+                manifest, _ = self.builder.build(
+                    pid, collection, model, version=version
+                )
+                handle = io.StringIO()
+                self.builder.write(manifest, handle)
+        except Exception:
+            self.count("build_failures")
+            raise
+        finally:
+            self.count("build_seconds", time.perf_counter() - start)
+        self.count("builds")
+        version = 3 if "presentation/3" in manifest["@context"] else 2
+        body = handle.getvalue().encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        self.cache.put((pid, version), body, etag)
+        return version, body, etag
+
+    def manifest(self, pid, version=None):
+        """Returns the version, body, and ETag of the manifest for a PID, building it if it is not cached.
+
+        Args:
+            pid (str): The PID of the object.
+            version (int): The presentation API version asked for, or None for whichever the content model uses.
+                Books can be built as either version, and audio objects only as 3.
+
+        Raises:
+            ManifestUnavailable: If the PID has no manifest, or none in the version asked for.
+        """
+        collection, model = self.__resolve(pid)
+        versions = self.builder.versions(model)
+        if version is None:
+            version = versions[0]
+        elif version not in versions:
+            raise ManifestUnavailable(
+                f"{pid} is only available as a version {versions[0]} manifest."
+            )
+        key = (pid, version)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.count("cache_hits")
+            return (version,) + cached
+        self.count("cache_misses")
+        with self.__lock:
+            build = self.__building.get(key)
+            if build is None:
+                build = self.__building[key] = self.executor.submit(
+                    self.__build, pid, version, collection, model
+                )
+                build.add_done_callback(lambda done: self.__finish(key))
+        return build.result()
+
+    def __resolve(self, pid):
+        with self.__lock:
+            if pid in self.__models:
+                self.__models.move_to_end(pid)
+                return self.__models[pid]
+        collection, model = self.builder.resolve_many([pid])[pid]
+        self.builder.require_supported(pid, model)
+        with self.__lock:
+            self.__models[pid] = (collection, model)
+            while len(self.__models) > self.cache.max_entries:
+                self.__models.popitem(last=False)
+        return collection, model
+
+    def __finish(self, key):
+        with self.__lock:
+            self.__building.pop(key, None)
+
+    def metrics(self):
+        """Returns counters for the service, its manifest cache, and its HTTP client in the Prometheus text format."""
+        with self.__lock:
+            counters = dict(self.counters)
+            responses = dict(self.responses)
+            building = len(self.__building)
+        lines = [
+            f"manifest_cache_hits_total {counters['cache_hits']}",
+            f"manifest_cache_misses_total {counters['cache_misses']}",
+            f"manifest_cache_entries {len(self.cache)}",
+            f"manifest_not_modified_total {counters['not_modified']}",
+            f"manifest_builds_total {counters['builds']}",
+            f"manifest_build_failures_total {counters['build_failures']}",
+            f"manifest_build_seconds_total {counters['build_seconds']:.6f}",
+            f"manifest_builds_in_progress {building}",
+        ]
+        for status, total in sorted(responses.items()):
+            lines.append(f'manifest_http_responses_total{{status="{status}"}} {total}')
+        for stage, seconds in sorted(self.builder.timer.seconds.items()):
+            lines.append(
+                f'manifest_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}'
+            )
+        throughput = self.throughput.snapshot()
+        lines += [
+            f"manifest_pages_built_total {throughput['pages_built']}",
+            f"manifest_pages_failed_total {throughput['pages_failed']}",
+            f"manifest_bytes_fetched_total {throughput['bytes_fetched']}",
+        ]
+        stats = self.builder.client.stats()
+        lines += [
+            f"fedora_requests_total {stats['requests']}",
+            f"fedora_bytes_total {stats['bytes']}",
+            f"fedora_connections_opened_total {stats['connections_opened']}",
+            f"fedora_connections_reused_total {stats['connections_reused']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def respond(self, path, if_none_match=None):
+        """Returns the status, headers, and body for a GET request path."""
+        status, headers, body = self.__respond(path, if_none_match)
+        with self.__lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+        return status, headers, body
+
+    def __respond(self, path, if_none_match):
+        parts = urlsplit(path)
+        if parts.path == "/metrics":
+            return (
+                200,
+                {"Content-Type": "text/plain; version=0.0.4"},
+                self.metrics().encode("utf-8"),
+            )
+        if not parts.path.startswith("/manifest/"):
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+        pid = unquote(parts.path[len("/manifest/") :])
+        version = parse_qs(parts.query).get("version", [None])[0]
+        if version not in (None, "2", "3"):
+            return 400, {"Content-Type": "text/plain"}, b"version must be 2 or 3."
+        try:
+            built_version, body, etag = self.manifest(
+                pid, int(version) if version is not None else None
+            )
+        except ManifestUnavailable as e:
+            return 404, {"Content-Type": "text/plain"}, str(e).encode("utf-8")
+        except requests.RequestException:
+            logger.exception(f"Fedora could not be read to build {pid}.")
+            return 502, {"Content-Type": "text/plain"}, b"Fedora could not be read."
+        except Exception:
+            logger.exception(f"The manifest for {pid} could not be built.")
+            return (
+                500,
+                {"Content-Type": "text/plain"},
+                b"The manifest could not be built.",
+            )
+        headers = {
+            "Content-Type": f'application/ld+json;profile="http://iiif.io/api/presentation/{built_version}/context.json"',
+            "ETag": etag,
+        }
+        if if_none_match is not None and etag in [
+            tag.strip() for tag in if_none_match.split(",")
+        ]:
+            self.count("not_modified")
+            return 304, headers, b""
+        return 200, headers, body
+
+    def close(self):
+        self.builder.events.unsubscribe(self.throughput)
+        self.executor.shutdown(wait=False)
+
+
+class ManifestServer:
+    """Serves GET /manifest/{pid}?version=2|3 and GET /metrics from a ManifestService.
+
+    Args:
+        service (ManifestService): What builds and caches manifests.
+        host (str): The address to listen on.
+        port (int): The port to listen on, or 0 to pick a free one.
+    """
+
+    def __init__(self, service, host="127.0.0.1", port=8000):
+        self.service = service
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_port}"
+        self.__thread = None
+
+    def __handler(self):
+        service = self.service
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def __send(self, include_body):
+                status, headers, body = service.respond(
+                    self.path, self.headers.get("If-None-Match")
+                )
+                self.send_response(status)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self.__send(True)
+
+            def do_HEAD(self):
+                self.__send(False)
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve manifests on demand at /manifest/{pid}?version=2|3 with metrics at /metrics"
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        help="Specify the address to listen on.  Defaults to 127.0.0.1.",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        help="Specify the port to listen on.  Defaults to 8000.",
+        type=int,
+        default=8000,
+    )
+    parser.add_argument(
+        "-s",
+        "--server",
+        dest="server",
+        help="Specify a server.  This is the value that will be used for harvesting metadata and writing id values in the manifest.",
+        default="https://digital.lib.utk.edu",
+    )
+    parser.add_argument(
+        "-r",
+        "--risearch",
+        dest="risearch",
+        help="Specify the uri to your risearch interface.  Defaults to http://localhost:8080/fedora/risearch.",
+        default="http://localhost:8080/fedora/risearch",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="Specify how many info.json requests can run at once for a book.  Defaults to 8.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-j",
+        "--build-workers",
+        dest="build_workers",
+        help="Specify how many manifests can be built at once.  Defaults to 4.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--cache-entries",
+        dest="cache_entries",
+        help="Specify how many built manifests to keep in memory.  Defaults to 256.",
+        type=int,
+        default=256,
+    )
+    parser.add_argument(
+        "--max-age",
+        dest="max_age",
+        help="Specify how many seconds a built manifest is served before it is rebuilt.  Defaults to 3600.",
+        type=float,
+        default=3600,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Specify a directory to cache MODS, TECHMD, and info.json responses in.",
+    )
+    parser.add_argument(
+        "--dimension-index",
+        dest="dimension_index",
+        help="Specify an sqlite dimension index to read page sizes from before requesting info.json.",
+    )
+    parser.add_argument(
+        "--compact",
+        dest="compact",
+        help="Serve manifests without indentation.",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    builder = ManifestBuilder(
+        args.server,
+        args.risearch,
+        client=HTTPClient(
+            pool_size=args.workers * args.build_workers,
+            cache=ResponseCache(args.cache_dir) if args.cache_dir is not None else None,
+        ),
+        workers=args.workers,
+        indent=None if args.compact else 4,
+        dimensions=(
+            DimensionIndex(args.dimension_index)
+            if args.dimension_index is not None
+            else None
+        ),
+    )
+    server = ManifestServer(
+        ManifestService(
+            builder,
+            build_workers=args.build_workers,
+            cache=ManifestCache(args.cache_entries, args.max_age),
+        ),
+        args.host,
+        args.port,
+    )
+    print(f"Serving manifests at {server.url}/manifest/{{pid}}")
+    server.serve_forever()
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+import re
+
+
+def read_import_times(lines):
+    """Reads the report python -X importtime writes to stderr.
+
+    Args:
+        lines (list): Lines of stderr.  Lines that are not part of the report are ignored.
+
+    Returns:
+        list: Tuples of module name, microseconds spent importing the module itself, and microseconds including the
+            modules it imported, in the order imports finished.
+    """
+    times = []
+    for line in lines:
+        match = re.match(r"import time:\s+([0-9]+) \|\s+([0-9]+) \| ( *)(\S+)", line)
+        if match is not None:
+            times.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return times
+
+
+def format_import_times(times, limit=25):
+    """Formats import times as printable lines, slowest first by cumulative time, with the total at the end."""
+    lines = [f"{'module':<48}{'self ms':>10}{'cumulative ms':>16}"]
+    for module, own, cumulative in sorted(
+        times, key=lambda module: module[2], reverse=True
+    )[:limit]:
+        lines.append(f"{module:<48}{own / 1000:>10.2f}{cumulative / 1000:>16.2f}")
+    lines.append(
+        f"{len(times)} modules imported in {sum(own for _, own, _ in times) / 1000:.2f}ms"
+    )
+    return lines
+
+
+def profile_startup(arguments, limit=25):
+    """Runs a Python script again with -X importtime and reports which modules it imported and how long each took.
+
+    Modules that are imported lazily are included if the run reached the code that imports them.  The output of the
+    script is passed through, and the report is written to stderr after it finishes.
+
+    Args:
+        arguments (list): The script and its arguments, like sys.argv without the option that asked for the profile.
+        limit (int): How many of the slowest modules to report.
+
+    Returns:
+        int: The exit status of the script.
+    """
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", *arguments],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    lines = child.stderr.splitlines()
+    for line in lines:
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+    for line in format_import_times(read_import_times(lines), limit):
+        print(line, file=sys.stderr)
+    return child.returncode
@@ -0,0 +1,84 @@
+from fedora.tuples import parse_fedora_date
+import threading
+import sqlite3
+
+
+class BuildState:
+    """Remembers when the manifest for each PID was last built so incremental runs can skip unchanged objects.
+
+    The time recorded is when the build started rather than when it finished so that a change made in Fedora while
+    a manifest is being built is picked up on the next run.  Versions written next to the manifest of a PID, like the
+    version 3 manifest of a book built with both versions, are recorded apart so that a run asking for a version that
+    was never built does not skip it.
+
+    Args:
+        path (str): The sqlite file to keep state in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS builds (pid TEXT PRIMARY KEY, built_at REAL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS version_builds (pid TEXT, version INTEGER, built_at REAL, "
+                "PRIMARY KEY (pid, version))"
+            )
+
+    def last_built(self, pid, version=None):
+        """Returns when a PID was last built in seconds since the epoch, or None if it has never been built.
+
+        Args:
+            pid (str): The PID of the object.
+            version (int): A version written next to the manifest of the PID, or None for the manifest itself.
+        """
+        with self.__lock:
+            if version is None:
+                row = self.__connection.execute(
+                    "SELECT built_at FROM builds WHERE pid = ?", (pid,)
+                ).fetchone()
+            else:
+                row = self.__connection.execute(
+                    "SELECT built_at FROM version_builds WHERE pid = ? AND version = ?",
+                    (pid, version),
+                ).fetchone()
+        return row[0] if row is not None else None
+
+    def record(self, pid, built_at, versions=()):
+        """Records when a PID was built along with the versions that were written next to its manifest."""
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO builds VALUES (?, ?)", (pid, built_at)
+            )
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO version_builds VALUES (?, ?, ?)",
+                [(pid, version, built_at) for version in versions],
+            )
+
+    def is_current(self, pid, modified, versions=()):
+        """Returns True if a PID, and each version written next to its manifest, was built after its
+        lastModifiedDate.
+
+        Args:
+            pid (str): The PID of the object.
+            modified (str): The latest lastModifiedDate of the object and its pages.
+            versions (tuple): The versions that must also have been written next to the manifest.
+        """
+        if modified is None:
+            return False
+        for version in (None, *versions):
+            built_at = self.last_built(pid, version)
+            if built_at is None or built_at <= parse_fedora_date(modified):
+                return False
+        return True
+
+
+def latest_modified(*dates):
+    """Returns the most recent of several Fedora lastModifiedDates, ignoring any that are None."""
+    known = [date for date in dates if date is not None]
+    if len(known) == 0:
+        return None
+    return max(known, key=parse_fedora_date)
@@ -1,25 +1,46 @@
-from fedora.mods import MODSScraper
-from fedora.risearch import TuplesSearch
-from iiif.manifest import Manifest
-from iiif.presentation3 import Manifest3
+import os
 import argparse
 import json
+import sys
 
 
-def cleanup_server_name(server_uri):
-    if server_uri.endswith("/"):
-        server_uri = server_uri[:-1]
-    return server_uri.replace("/collections", "")
+def positive_rate(value):
+    """Parses a requests per second rate for argparse, which must be more than 0."""
+    rate = float(value)
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a rate above 0.")
+    return rate
+
+
+def host_rate(value):
+    """Parses a HOST=RATE argument for argparse into the host and its rate."""
+    host, separator, rate = value.rpartition("=")
+    if separator == "" or host == "":
+        raise argparse.ArgumentTypeError(f"{value} is not in the form HOST=RATE.")
+    return host, positive_rate(rate)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Manifest from a UTK Book")
-    parser.add_argument(
+    objects = parser.add_mutually_exclusive_group(required=True)
+    objects.add_argument(
         "-p",
         "--pid",
         dest="pid",
         help="Specify the pid of the book you want to base your manifest on.",
-        required=True,
+    )
+    objects.add_argument(
+        "-c",
+        "--collection",
+        dest="collection",
+        help="Specify the pids of one or more collections to generate manifests for all of their members.",
+        nargs="+",
+    )
+    objects.add_argument(
+        "-l",
+        "--pid-file",
+        dest="pid_file",
+        help="Specify a file with one pid per line to generate manifests for.  Use - to read from stdin.",
     )
     parser.add_argument(
         "-f",
@@ -28,6 +49,13 @@ if __name__ == "__main__":
         help="Specify a filename. Defaults to manifest.json.",
         default="manifest.json",
     )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        dest="output_dir",
+        help="Specify where to write manifests when using --collection or --pid-file. Defaults to manifests.",
+        default="manifests",
+    )
     parser.add_argument(
         "-s",
         "--server",
@@ -42,38 +70,346 @@ if __name__ == "__main__":
         help="Specify the uri to your risearch interface.  Defaults to http://localhost:8080/fedora/risearch.",
         default="http://localhost:8080/fedora/risearch",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="Specify how many page info.json requests can run at once.  Defaults to 8.",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-j",
+        "--batch-workers",
+        dest="batch_workers",
+        help="Specify how many manifests to build at once when using --pid-file, or how many workers read MODS and "
+        "build canvases when using --collection.  Defaults to 4.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--force",
+        dest="force",
+        help="Rebuild manifests in the output directory even if they are newer than the object.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--compact",
+        dest="compact",
+        help="Write manifests without indentation or whitespace.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--both",
+        dest="both",
+        help="Build books as both 2.1.1 and 3.0 manifests from a single harvest.  The 3.0 manifest is written next to "
+        "the 2.1.1 one with .v3 before its extension.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        help="Specify how many canvases of a book to build at a time while it is written, to keep memory flat for "
+        "books with thousands of pages.  By default every canvas is built with the manifest.",
+        type=int,
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        dest="incremental",
+        help="Only rebuild manifests whose object, MODS, or pages changed in Fedora since they were last built.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--state-file",
+        dest="state_file",
+        help="Specify where to remember when each manifest was last built.  Defaults to build_state.sqlite in the "
+        "output directory.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Specify a directory to cache MODS, TECHMD, and info.json responses in between runs.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        help="Specify the maximum size of the cache in megabytes.  Defaults to 1024.",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--dimension-index",
+        dest="dimension_index",
+        help="Specify an sqlite dimension index to read page sizes from before requesting info.json.  Pages that "
+        "are requested are added to it.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        help="Specify how many objects can wait between stages when using --collection.  Defaults to 16.",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--rate",
+        dest="rate",
+        help="Specify the most requests per second to send to each host.",
+        type=positive_rate,
+    )
+    parser.add_argument(
+        "--host-rate",
+        dest="host_rates",
+        help="Specify the most requests per second for one host as HOST=RATE, overriding --rate.  May be repeated.",
+        type=host_rate,
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--max-host-concurrency",
+        dest="max_host_concurrency",
+        help="Specify the most requests to have in flight to each host.  The limit adapts below this, backing off on "
+        "429 and 5xx responses and rising latency.",
+        type=int,
+    )
+    mods_sources = parser.add_mutually_exclusive_group()
+    mods_sources.add_argument(
+        "--mods-dir",
+        dest="mods_dir",
+        help="Specify a directory of exported MODS or FOXML files to read MODS from before requesting it.",
+    )
+    mods_sources.add_argument(
+        "--oai",
+        dest="oai",
+        help="Specify an OAI-PMH endpoint to harvest MODS from in bulk before building, like "
+        "https://digital.lib.utk.edu/oai2.",
+    )
+    parser.add_argument(
+        "--oai-set",
+        dest="oai_set",
+        help="Specify the OAI-PMH set to harvest.  Defaults to the collection with _ in place of : when using "
+        "--collection with one collection, or every record otherwise.  Required with --pid, since harvesting "
+        "every record to build one manifest costs more than requesting its MODS.",
+    )
+    parser.add_argument(
+        "--oai-prefix",
+        dest="oai_prefix",
+        help="Specify the OAI-PMH metadataPrefix that returns MODS.  Defaults to mods.",
+        default="mods",
+    )
+    parser.add_argument(
+        "--http-stats",
+        dest="http_stats",
+        help="Print request, byte, and connection reuse counters after the manifest is written.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--report",
+        dest="report",
+        help="Specify a file to write a JSON report of the time spent in each span and the counters of each build "
+        "to, one build per line.  Use - for stderr.",
+    )
+    parser.add_argument(
+        "--spans",
+        dest="spans",
+        help="Specify a file to write the spans of each build to as OpenTelemetry OTLP JSON, one build per line.",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="Specify a file to dump cProfile statistics for the whole run to, including worker threads.  The "
+        "slowest functions are also printed to stderr.",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        dest="profile_startup",
+        help="Run again with python -X importtime and report how long each module took to import, including modules "
+        "imported lazily along the way.",
+        action="store_true",
+    )
     args = parser.parse_args()
-    collection_and_model = TuplesSearch(
-        language="sparql", ri_endpoint=args.risearch
-    ).get_collection_and_content_model(args.pid)
-    supported_content_models = ("islandora:bookCModel", "islandora:sp-audioCModel")
-    if collection_and_model[1] == "islandora:bookCModel":
-        book_pages = TuplesSearch(
-            language="sparql", ri_endpoint=args.risearch
-        ).get_pages_and_page_numbers(args.pid)
-        metadata = MODSScraper(
-            args.pid,
-            islandora_frontend=f"{cleanup_server_name(args.server)}/collections/",
-        ).build_iiif_descriptive_metadata_v2()
-        manifest_object = Manifest(
-            metadata,
-            book_pages,
-            collection_and_model[0],
-            server_uri=f"{cleanup_server_name(args.server)}/",
+    if args.oai is not None and args.pid is not None and args.oai_set is None:
+        parser.error(
+            "--oai with --pid needs --oai-set, or it would harvest every record in the repository to build one "
+            "manifest."
         )
-        with open(args.filename, "w") as manifest:
-            manifest.write(json.dumps(manifest_object.manifest, indent=4))
-    elif collection_and_model[1] == "islandora:sp-audioCModel":
-        metadata = MODSScraper(
-            args.pid,
-            islandora_frontend=f"{cleanup_server_name(args.server)}/collections/",
-        ).build_iiif_descriptive_metadata_v3()
-        manifest_object = Manifest3(
-            metadata, server_uri=f"{cleanup_server_name(args.server)}/"
-        ).build_audio_manifest()
-        with open(args.filename, "w") as manifest:
-            manifest.write(manifest_object)
-    else:
-        raise Exception(
-            f"Cannot generate manifests for {collection_and_model[1]} yet. Supported content models include: {supported_content_models}."
+    if args.profile_startup:
+        from pipeline.startup import profile_startup
+
+        sys.exit(
+            profile_startup([arg for arg in sys.argv if arg != "--profile-startup"])
+        )
+    if args.profile is not None:
+        from fedora.instrument import Profiler
+        import atexit
+
+        profiler = Profiler().start()
+
+        def dump_profile():
+            profiler.stop()
+            stats = profiler.stats(sys.stderr)
+            stats.dump_stats(args.profile)
+            stats.sort_stats("cumulative").print_stats(25)
+
+        atexit.register(dump_profile)
+    from fedora.client import HTTPClient
+    from pipeline.build import ManifestBuilder
+
+    reports = None
+    if args.report is not None or args.spans is not None:
+        from fedora.instrument import ReportWriter
+
+        reports = ReportWriter(
+            reports=(
+                (sys.stderr if args.report == "-" else open(args.report, "w"))
+                if args.report is not None
+                else None
+            ),
+            spans=open(args.spans, "w") if args.spans is not None else None,
+        )
+    cache = None
+    if args.cache_dir is not None:
+        from fedora.cache import ResponseCache
+
+        cache = ResponseCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    dimensions = None
+    if args.dimension_index is not None:
+        from iiif.dimensions import DimensionIndex
+
+        dimensions = DimensionIndex(args.dimension_index)
+    throttle = None
+    if (
+        args.rate is not None
+        or len(args.host_rates) > 0
+        or args.max_host_concurrency is not None
+    ):
+        from fedora.throttle import HostThrottle
+
+        pool_size = (
+            args.workers if args.pid is not None else args.workers * args.batch_workers
         )
+        throttle = HostThrottle(
+            rate=args.rate,
+            rates=dict(args.host_rates),
+            max_concurrency=(
+                args.max_host_concurrency
+                if args.max_host_concurrency is not None
+                else pool_size
+            ),
+        )
+    client = HTTPClient(
+        pool_size=(
+            args.workers if args.pid is not None else args.workers * args.batch_workers
+        ),
+        cache=cache,
+        throttle=throttle,
+    )
+    mods_source = None
+    if args.mods_dir is not None:
+        from fedora.sources import ExportDirectorySource
+
+        mods_source = ExportDirectorySource(args.mods_dir)
+    elif args.oai is not None:
+        from fedora.sources import OAISource
+
+        mods_source = OAISource(
+            args.oai,
+            metadata_prefix=args.oai_prefix,
+            set_spec=(
+                args.oai_set
+                if args.oai_set is not None
+                or args.collection is None
+                or len(args.collection) > 1
+                else args.collection[0].replace(":", "_")
+            ),
+            client=client,
+        )
+    builder = ManifestBuilder(
+        args.server,
+        args.risearch,
+        client=client,
+        workers=args.workers,
+        indent=None if args.compact else 4,
+        chunk_size=args.chunk_size,
+        dimensions=dimensions,
+        mods_source=mods_source,
+        reports=reports,
+    )
+    progress = None
+    if sys.stderr.isatty():
+        from iiif.events import ProgressBar
+
+        progress = builder.events.subscribe(ProgressBar())
+    if args.pid is not None:
+        with builder.recording(args.pid):
+            manifests = (
+                builder.build_versions(args.pid)
+                if args.both
+                else {None: builder.build(args.pid)}
+            )
+            if progress is not None:
+                progress.close()
+            for failure in next(iter(manifests.values()))[1]:
+                print(
+                    f"Skipped page {failure['page']} ({failure['pid']}): {failure['error']}",
+                    file=sys.stderr,
+                )
+            for position, (version, (manifest, _)) in enumerate(manifests.items()):
+                root, extension = os.path.splitext(args.filename)
+                with open(
+                    (
+                        args.filename
+                        if position == 0
+                        else f"{root}.v{version}{extension}"
+                    ),
+                    "w",
+                    encoding="utf-8",
+                ) as output:
+                    builder.write(manifest, output)
+    else:
+        from pipeline.batch import BatchRunner, format_summary, read_pid_list
+
+        state = None
+        if args.incremental:
+            from pipeline.state import BuildState
+
+            os.makedirs(args.output_dir, exist_ok=True)
+            state = BuildState(
+                args.state_file
+                if args.state_file is not None
+                else os.path.join(args.output_dir, "build_state.sqlite")
+            )
+        if args.collection is not None:
+            from pipeline.crawler import CollectionCrawler
+
+            summary = CollectionCrawler(
+                builder,
+                args.output_dir,
+                mods_workers=args.batch_workers,
+                canvas_workers=args.batch_workers,
+                queue_size=args.queue_size,
+                force=args.force,
+                state=state,
+                versions=(2, 3) if args.both else None,
+            ).crawl(args.collection)
+        else:
+            if args.pid_file == "-":
+                pids = read_pid_list(sys.stdin)
+            else:
+                with open(args.pid_file) as pid_file:
+                    pids = read_pid_list(pid_file)
+            worklist = [(pid, None, None, None) for pid in pids]
+            summary = BatchRunner(
+                builder,
+                args.output_dir,
+                workers=args.batch_workers,
+                force=args.force,
+                state=state,
+                versions=(2, 3) if args.both else None,
+            ).run(worklist)
+        if progress is not None:
+            progress.close()
+        for line in format_summary(summary):
+            print(line)
+    if args.http_stats:
+        print(json.dumps(client.stats()), file=sys.stderr)
@@ -1,7 +1,46 @@
-from fedora.mods import MODSScraper
-from iiif.manifest import Manifest
+from benchmarks.standin import StandInRepository, StandInServer
+from fedora import codec
+from fedora.cache import ResponseCache
+from fedora.client import HTTPClient, MemoClient
+from fedora.instrument import ReportWriter, Recorder, bind, count, recording, span
+from fedora.mods import MODSRecord, MODSScraper, _format_navigation_date
+from fedora.sources import ExportDirectorySource, OAISource
+from fedora.throttle import AdaptiveLimit, HostThrottle, TokenBucket
+from fedora.tuples import read_csv, read_sparql_xml, read_tsv
+from iiif.dimensions import (
+    DimensionIndex,
+    parse_info_json_url,
+    parse_jp2_filename,
+    read_jp2_dimensions,
+)
+from iiif.events import BuildListener, Throughput
+from iiif.manifest import Canvas, Manifest
+from iiif.pages import PageImages
+from iiif.serialize import content_hash, dumps, write_manifest
+from pipeline.aio import AsyncManifestBuilder
+from pipeline.batch import BatchRunner, read_pid_list
+from pipeline.build import ManifestBuilder, ManifestUnavailable
+from pipeline.crawler import CollectionCrawler
+from pipeline.server import ManifestServer, ManifestService
+from pipeline.state import BuildState, latest_modified
+from pipeline.startup import read_import_times
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
 from tripoli import IIIFValidator
+import urllib.request
+import requests
+import threading
+import tempfile
+import sqlite3
+import hashlib
+import struct
 import unittest
+import asyncio
+import json
+import time
+import io
+import os
 
 
 class PresentationManifestTester(unittest.TestCase):
@@ -33,3 +72,1030 @@ class PresentationManifestTester(unittest.TestCase):
         manifest = Manifest(self.metadata, self.book_pages, self.collection)
         self.validator.validate(manifest.manifest_json)
         self.assertTrue(self.validator.is_valid)
+
+
+class CountingInfoClient:
+    """Answers info.json requests after a short wait, counting how many are in flight at once, and fails one page."""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.__lock = threading.Lock()
+
+    def get_json(self, uri):
+        with self.__lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(0.02)
+            if self.failing in uri:
+                raise requests.HTTPError(f"404 Client Error for url: {uri}")
+            return {
+                "@context": "http://iiif.io/api/image/2/context.json",
+                "@id": uri[: -len("/info.json")],
+                "profile": ["http://iiif.io/api/image/2/level2.json"],
+                "height": 3300,
+                "width": 2550,
+            }
+        finally:
+            with self.__lock:
+                self.in_flight -= 1
+
+
+class PageImagesTester(unittest.TestCase):
+    def test_pages_are_read_concurrently_in_page_order(self):
+        client = CountingInfoClient("test:7%7E")
+        pages = [(f"test:{number}", number) for number in (5, 3, 8, 1, 7, 2, 6, 4)]
+        images = PageImages("test:book", pages, client=client, workers=3)
+        self.assertEqual(
+            [image.number for image in images.images], [1, 2, 3, 4, 5, 6, 8]
+        )
+        self.assertEqual(client.most_in_flight, 3)
+        self.assertEqual(len(images.failures), 1)
+        self.assertEqual(
+            (images.failures[0]["pid"], images.failures[0]["page"]), ("test:7", 7)
+        )
+        self.assertIn("HTTPError", images.failures[0]["error"])
+
+
+class TupleReaderTester(unittest.TestCase):
+    def test_csv_with_quoted_commas(self):
+        lines = [
+            '"page","numbers","label"',
+            'info:fedora/agrtfhs:2279,1,"Cover, front"',
+            "info:fedora/agrtfhs:2278,2,Page 2",
+        ]
+        self.assertEqual(
+            list(read_csv(lines)),
+            [("agrtfhs:2279", 1, "Cover, front"), ("agrtfhs:2278", 2, "Page 2")],
+        )
+
+    def test_tsv_with_ntriples_terms(self):
+        lines = ['"page"\t"numbers"', '<info:fedora/agrtfhs:2279>\t"1"', ""]
+        self.assertEqual(list(read_tsv(lines)), [("agrtfhs:2279", 1)])
+        escaped = ['"label"', '"C:\\\\temp\\tnotes \\"draft\\" caf\\u00E9"@en', ""]
+        self.assertEqual(list(read_tsv(escaped)), [('C:\\temp\tnotes "draft" café',)])
+
+    def test_sparql_xml_in_chunks(self):
+        document = (
+            b'<sparql xmlns="http://www.w3.org/2001/sw/DataAccess/rf1/result"><head><variable name="page"/>'
+            b'<variable name="numbers"/></head><results><result><page uri="info:fedora/agrtfhs:2279"/>'
+            b'<numbers>1</numbers></result><result><page uri="info:fedora/agrtfhs:2278"/><numbers>2</numbers>'
+            b"</result></results></sparql>"
+        )
+        chunks = [document[i : i + 16] for i in range(0, len(document), 16)]
+        self.assertEqual(
+            list(read_sparql_xml(chunks)), [("agrtfhs:2279", 1), ("agrtfhs:2278", 2)]
+        )
+
+
+class CodecTester(unittest.TestCase):
+    def setUp(self):
+        self.json_backend = codec.json_backend
+        self.xml_backend = codec.xml_backend
+
+    def tearDown(self):
+        codec.use_backends(json_name=self.json_backend, xml_name=self.xml_backend)
+
+    def test_compact_json_is_the_same_from_every_backend(self):
+        value = {
+            "label": 'Ćélébrating "Rocky Top"\n\t\u0001',
+            "height": 3300,
+            "duration": 2825.339,
+            "items": [None, True, []],
+        }
+        for backend in codec.JSON_BACKENDS:
+            codec.use_backends(json_name=backend)
+            self.assertEqual(
+                codec.dumps(value),
+                json.dumps(value, separators=(",", ":"), ensure_ascii=False),
+            )
+            self.assertEqual(codec.loads(codec.dumps(value).encode("utf-8")), value)
+
+    def test_comments_are_skipped_by_every_backend(self):
+        document = b'<mods xmlns="http://www.loc.gov/mods/v3"><!-- note --><titleInfo><title>Title</title></titleInfo></mods>'
+        for backend in codec.XML_BACKENDS:
+            codec.use_backends(xml_name=backend)
+            self.assertEqual(MODSRecord(document).title, "Title")
+
+
+class ChunkRecorder:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, text):
+        self.chunks.append(text)
+
+
+class StreamingWriterTester(unittest.TestCase):
+    manifest = {
+        "@id": "https://digital.lib.utk.edu/iiif/presentation/2/test:1/manifest",
+        "label": "Café",
+        "sequences": [
+            {"canvases": [{"@id": f"canvas/{n}", "height": 3300} for n in range(3)]}
+        ],
+        "structures": [],
+    }
+
+    def test_indented_output_matches_json_dumps(self):
+        handle = ChunkRecorder()
+        write_manifest(self.manifest, handle, indent=4)
+        self.assertGreater(len(handle.chunks), 1)
+        self.assertEqual("".join(handle.chunks), json.dumps(self.manifest, indent=4))
+
+    def test_compact_output(self):
+        handle = io.StringIO()
+        write_manifest(self.manifest, handle, indent=None)
+        self.assertEqual(
+            handle.getvalue(),
+            json.dumps(self.manifest, separators=(",", ":"), ensure_ascii=False),
+        )
+        self.assertEqual(dumps(self.manifest, indent=None), handle.getvalue())
+
+
+class MODSRecordTester(unittest.TestCase):
+    def test_single_pass_record(self):
+        record = MODSRecord(
+            '<mods:mods xmlns:mods="http://www.loc.gov/mods/v3" xmlns:xlink="http://www.w3.org/1999/xlink">'
+            '<mods:titleInfo type="alternative"><mods:title>Alternative</mods:title></mods:titleInfo>'
+            "<mods:titleInfo><mods:title>Main</mods:title></mods:titleInfo>"
+            "<mods:subject><mods:topic>Farming</mods:topic><mods:topic>Cattle</mods:topic></mods:subject>"
+            '<mods:originInfo><mods:dateIssued>Spring 1963</mods:dateIssued><mods:dateIssued encoding="edtf">'
+            "1963-04</mods:dateIssued></mods:originInfo>"
+            '<mods:accessCondition xlink:href="http://rightsstatements.org/vocab/InC/1.0/">In Copyright'
+            "</mods:accessCondition><mods:relatedItem><mods:titleInfo><mods:title>Series</mods:title>"
+            "</mods:titleInfo></mods:relatedItem></mods:mods>"
+        )
+        self.assertEqual(record.title, "Alternative")
+        self.assertEqual(record.main_title, "Main")
+        self.assertEqual(record.topics, ["Farming", "Cattle"])
+        self.assertEqual(record.publisher, "")
+        self.assertIsNone(record.table_of_contents)
+        self.assertEqual(record.navigation_date, "1963-04-01T00:00:00Z")
+        self.assertEqual(record.rights, "http://rightsstatements.org/vocab/InC/1.0/")
+        self.assertEqual(record.attribution, "In Copyright")
+
+    def test_navigation_dates_without_arrow_match_arrow(self):
+        import arrow
+
+        for value in ("1963", "1963-04", "1963-04-05", "1963-04-05T10:30:00Z"):
+            self.assertEqual(
+                _format_navigation_date(value),
+                f"{arrow.get(value).format('YYYY-MM-DD')}T00:00:00Z",
+            )
+        with self.assertRaises(ValueError):
+            _format_navigation_date("1963-13")
+
+    def test_dates_and_topics_like_the_dictionary_parser(self):
+        mods = (
+            '<mods xmlns="http://www.loc.gov/mods/v3"><subject><topic>Farming</topic></subject>'
+            "<subject><topic>Cattle</topic><topic>Dairy</topic><geographic>Knox County</geographic></subject>"
+            '<originInfo>{dates}<dateCreated encoding="edtf">1950</dateCreated></originInfo></mods>'
+        )
+        for dates, navigation_date in (
+            (
+                '<dateIssued qualifier="approximate">1963</dateIssued>',
+                "1963-01-01T00:00:00Z",
+            ),
+            (
+                '<dateIssued qualifier="approximate">circa 1963</dateIssued>',
+                "1950-01-01T00:00:00Z",
+            ),
+            ("<dateIssued>1963</dateIssued>", "1950-01-01T00:00:00Z"),
+            (
+                '<dateIssued qualifier="approximate">1960</dateIssued><dateIssued>1963</dateIssued>',
+                "1950-01-01T00:00:00Z",
+            ),
+        ):
+            record = MODSRecord(mods.format(dates=dates))
+            self.assertEqual(record.navigation_date, navigation_date)
+        self.assertEqual(record.topics, ["Farming", "Cattle", "Dairy"])
+
+
+class StartupProfileTester(unittest.TestCase):
+    def test_read_import_times(self):
+        times = read_import_times(
+            [
+                "import time: self [us] | cumulative | imported package",
+                "import time:       180 |        180 |   _io",
+                "import time:      1430 |       1803 | datetime",
+                "Traceback (most recent call last):",
+            ]
+        )
+        self.assertEqual(times, [("_io", 180, 180), ("datetime", 1430, 1803)])
+
+
+class StandInBuildTester(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInRepository(books={"bench:book": 5}, audio=["bench:audio"])
+        ).start()
+        self.builder = ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(),
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_book_manifest(self):
+        manifest, failures = self.builder.build("bench:book")
+        self.assertEqual(failures, [])
+        self.assertEqual(len(manifest["sequences"][0]["canvases"]), 5)
+        validator = IIIFValidator(debug=True, collect_warnings=False)
+        validator.validate(dumps(manifest))
+        self.assertTrue(validator.is_valid)
+
+    def test_rebuilds_are_identical(self):
+        manifest, _ = self.builder.build("bench:book")
+        rebuilt, _ = self.builder.build("bench:book")
+        self.assertEqual(dumps(rebuilt), dumps(manifest))
+        self.assertEqual(
+            manifest["sequences"][0]["canvases"][2]["@id"],
+            f"{self.server.url}/iiif/presentation/2/bench:book/canvas/3",
+        )
+        for indent in (4, None):
+            self.assertEqual(
+                content_hash(manifest, indent=indent),
+                hashlib.sha256(
+                    dumps(manifest, indent=indent).encode("utf-8")
+                ).hexdigest(),
+            )
+
+    def test_chunked_manifest_is_written_the_same(self):
+        manifest, _ = self.builder.build("bench:book")
+        self.builder.chunk_size = 2
+        chunked, _ = self.builder.build("bench:book")
+        self.assertEqual(len(chunked["sequences"][0]["canvases"]), 5)
+        self.assertEqual(json.loads(json.dumps(chunked)), manifest)
+        self.assertEqual(json.dumps(chunked, indent=4), dumps(manifest, indent=4))
+        self.assertEqual(chunked, manifest)
+        v3 = self.builder.build("bench:book", version=3)[0]
+        self.assertEqual(json.loads(json.dumps(v3)), json.loads(dumps(v3)))
+        self.assertEqual(len(v3["items"]), 5)
+        for indent in (4, None):
+            handle = io.StringIO()
+            self.builder.indent = indent
+            self.builder.write(chunked, handle)
+            self.assertEqual(handle.getvalue(), dumps(manifest, indent=indent))
+            self.assertEqual(dumps(chunked, indent=indent), handle.getvalue())
+
+    def test_book_manifest_in_both_versions(self):
+        manifest, _ = self.builder.build("bench:book")
+        requests_made = self.server.requests
+        manifests = self.builder.build_versions("bench:book")
+        self.assertEqual(self.server.requests - requests_made, 9)
+        self.assertEqual(list(manifests), [2, 3])
+        self.assertEqual(dumps(manifests[2][0]), dumps(manifest))
+        v3, failures = manifests[3]
+        self.assertEqual(failures, [])
+        self.assertEqual(v3, self.builder.build("bench:book", version=3)[0])
+        self.assertEqual(v3["behavior"], ["paged"])
+        self.assertEqual(len(v3["items"]), 5)
+        body = v3["items"][0]["items"][0]["items"][0]["body"]
+        self.assertEqual((body["width"], body["height"]), (2550, 3300))
+        self.assertEqual(
+            body["service"],
+            [
+                {
+                    "@id": f"{self.server.url}/iiif/2/collections~islandora~object~bench:book-1~datastream~JP2",
+                    "@type": "ImageService2",
+                    "profile": "http://iiif.io/api/image/2/level2.json",
+                }
+            ],
+        )
+
+    def test_resolve_many(self):
+        requests_made = self.server.requests
+        resolved = self.builder.resolve_many(
+            ["bench:book", "bench:audio", "bench:book-1", "bench:missing"],
+            chunk_size=2,
+        )
+        self.assertEqual(self.server.requests - requests_made, 2)
+        self.assertEqual(
+            resolved,
+            {
+                "bench:book": ("collections:bench", "islandora:bookCModel"),
+                "bench:audio": ("collections:bench", "islandora:sp-audioCModel"),
+                "bench:book-1": (None, None),
+                "bench:missing": (None, None),
+            },
+        )
+        with self.assertRaises(ManifestUnavailable):
+            self.builder.build("bench:missing")
+
+    def test_long_lookups_are_sent_by_post(self):
+        pids = ["bench:book", "bench:a&b+c%22"] + [
+            f"bench:missing-{n}" for n in range(200)
+        ]
+        requests_made = self.server.requests
+        resolved = self.builder.resolve_many(pids, chunk_size=len(pids))
+        self.assertEqual(self.server.requests - requests_made, 1)
+        self.assertEqual(self.server.posts, 1)
+        self.assertEqual(
+            resolved["bench:book"], ("collections:bench", "islandora:bookCModel")
+        )
+        self.assertEqual(resolved["bench:a&b+c%22"], (None, None))
+        self.assertEqual(
+            self.builder.resolve_many(["bench:a&b+c%22"]),
+            {"bench:a&b+c%22": (None, None)},
+        )
+        self.assertEqual(self.server.posts, 1)
+        with self.assertRaises(Exception):
+            self.builder.search.get_last_modified("bench:book> . }")
+
+    def test_pid_list_is_skipped_until_modified(self):
+        pids = ["bench:book", "bench:audio", "bench:missing"]
+        with tempfile.TemporaryDirectory() as directory:
+            runner = BatchRunner(self.builder, directory)
+            summary = runner.run([(pid, None, None, None) for pid in pids])
+            self.assertEqual(summary["built"], 2)
+            self.assertEqual([pid for pid, _ in summary["failed"]], ["bench:missing"])
+            requests_made = self.server.requests
+            summary = runner.run([(pid, None, None, None) for pid in pids[:2]])
+            self.assertEqual((summary["built"], summary["skipped"]), (0, 2))
+            self.assertEqual(self.server.requests - requests_made, 1)
+            self.server.repository.modified = "2100-01-01T00:00:00.000Z"
+            summary = runner.run([(pid, None, None, None) for pid in pids[:2]])
+            self.assertEqual((summary["built"], summary["skipped"]), (2, 0))
+            self.assertEqual(summary["unchanged"], 2)
+
+    def test_incremental_pid_list(self):
+        pids = ["bench:book", "bench:audio"]
+        with tempfile.TemporaryDirectory() as directory:
+            runner = BatchRunner(
+                self.builder,
+                directory,
+                state=BuildState(os.path.join(directory, "build_state.sqlite")),
+            )
+            self.assertEqual(
+                runner.run([(pid, None, None, None) for pid in pids])["built"], 2
+            )
+            requests_made = self.server.requests
+            summary = runner.run([(pid, None, None, None) for pid in pids])
+            self.assertEqual((summary["built"], summary["skipped"]), (0, 2))
+            self.assertEqual(self.server.requests - requests_made, 1)
+            self.server.repository.modified = "2100-01-01T00:00:00.000Z"
+            summary = runner.run([(pid, None, None, None) for pid in pids])
+            self.assertEqual((summary["built"], summary["skipped"]), (2, 0))
+
+    def test_both_versions_after_a_plain_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for state in (None, BuildState(os.path.join(directory, "state.sqlite"))):
+                output = os.path.join(directory, "state" if state else "mtime")
+                BatchRunner(self.builder, output, state=state).run(
+                    [("bench:book", None, None, None)]
+                )
+                runner = BatchRunner(self.builder, output, state=state, versions=(2, 3))
+                summary = runner.run([("bench:book", None, None, None)])
+                self.assertEqual((summary["built"], summary["skipped"]), (1, 0))
+                self.assertTrue(os.path.exists(runner.output_path("bench:book", 3)))
+                summary = runner.run([("bench:book", None, None, None)])
+                self.assertEqual((summary["built"], summary["skipped"]), (0, 1))
+
+    def test_chunked_write_builds_canvases_once(self):
+        self.builder.chunk_size = 2
+        edited = []
+
+        def edit_while_building(canvas):
+            time.sleep(0.05)
+            edited.append(time.time())
+            return build_canvas(canvas)
+
+        build_canvas = Canvas.build_canvas
+        with tempfile.TemporaryDirectory() as directory:
+            runner = BatchRunner(self.builder, directory)
+            with mock.patch.object(
+                Canvas, "build_canvas", autospec=True, side_effect=edit_while_building
+            ):
+                self.assertEqual(
+                    runner.run([("bench:book", None, None, None)])["built"], 1
+                )
+            self.assertEqual(len(edited), 5)
+            modified = datetime.fromtimestamp(edited[0], timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f"
+            )[:-3]
+            summary = runner.run(
+                [
+                    (
+                        "bench:book",
+                        "collections:bench",
+                        "islandora:bookCModel",
+                        f"{modified}Z",
+                    )
+                ]
+            )
+            self.assertEqual((summary["built"], summary["unchanged"]), (1, 1))
+
+    def test_audio_manifest(self):
+        manifest, _ = self.builder.build("bench:audio")
+        self.assertEqual(manifest["items"][0]["duration"], 2825.339)
+
+    def test_async_audio_manifest(self):
+        manifest, _ = self.builder.build("bench:audio")
+        requests_made = self.server.requests
+        async_manifest, _ = asyncio.run(
+            AsyncManifestBuilder(self.builder).build("bench:audio")
+        )
+        self.assertEqual(async_manifest, manifest)
+        self.assertEqual(self.server.requests - requests_made, 4)
+
+    def test_memo_client_fetches_once(self):
+        client = MemoClient(HTTPClient())
+        urls = [
+            f"{self.server.url}/iiif/2/collections%7Eislandora%7Eobject%7Ebench:audio%7Edatastream%7ETN/info.json",
+            f"{self.server.url}/iiif/2/collections~islandora~object~bench:audio~datastream~TN/info.json",
+        ] * 4
+        requests_made = self.server.requests
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            infos = list(executor.map(client.get_json, urls))
+        self.assertEqual(self.server.requests - requests_made, 1)
+        self.assertEqual(client.hits, 7)
+        self.assertEqual(infos[0]["height"], infos[-1]["height"])
+
+    def test_manifest_server(self):
+        server = ManifestServer(ManifestService(self.builder), port=0).start()
+        try:
+            with urllib.request.urlopen(
+                f"{server.url}/manifest/bench:book"
+            ) as response:
+                etag = response.headers["ETag"]
+                self.assertIn("canvases", response.read().decode("utf-8"))
+            requests_made = self.server.requests
+            with self.assertRaises(urllib.error.HTTPError) as not_modified:
+                urllib.request.urlopen(
+                    urllib.request.Request(
+                        f"{server.url}/manifest/bench:book?version=2",
+                        headers={"If-None-Match": etag},
+                    )
+                )
+            self.assertEqual(not_modified.exception.code, 304)
+            self.assertEqual(self.server.requests, requests_made)
+            with urllib.request.urlopen(
+                f"{server.url}/manifest/bench:book?version=3"
+            ) as response:
+                self.assertIn("presentation/3", response.headers["Content-Type"])
+            with urllib.request.urlopen(f"{server.url}/metrics") as response:
+                self.assertIn(
+                    "manifest_builds_total 2", response.read().decode("utf-8")
+                )
+        finally:
+            server.stop()
+
+    def test_manifest_server_default_version(self):
+        service = ManifestService(self.builder)
+        try:
+            self.assertEqual(service.manifest("bench:book", 3)[0], 3)
+            version, body, _ = service.manifest("bench:book")
+            self.assertEqual(version, 2)
+            self.assertIn(b"canvases", body)
+            self.assertEqual(service.manifest("bench:book", 2)[1], body)
+            self.assertEqual(service.manifest("bench:audio")[0], 3)
+            self.assertEqual(service.counters["builds"], 3)
+        finally:
+            service.close()
+
+    def test_manifest_server_unavailable_version(self):
+        server = ManifestServer(ManifestService(self.builder), port=0).start()
+        try:
+            for _ in range(3):
+                with self.assertRaises(urllib.error.HTTPError) as unavailable:
+                    urllib.request.urlopen(
+                        f"{server.url}/manifest/bench:audio?version=2"
+                    )
+                self.assertEqual(unavailable.exception.code, 404)
+                self.assertEqual(
+                    unavailable.exception.read(),
+                    b"bench:audio is only available as a version 3 manifest.",
+                )
+            self.assertEqual(server.service.counters["builds"], 0)
+            self.assertEqual(self.server.requests, 1)
+        finally:
+            server.stop()
+
+    def test_manifest_server_missing_pid(self):
+        server = ManifestServer(ManifestService(self.builder), port=0).start()
+        try:
+            with self.assertRaises(urllib.error.HTTPError) as missing:
+                urllib.request.urlopen(f"{server.url}/manifest/bench:missing")
+            self.assertEqual(missing.exception.code, 404)
+            self.assertEqual(
+                missing.exception.read(), b"bench:missing is not in the resource index."
+            )
+        finally:
+            server.stop()
+
+    def test_oai_source(self):
+        source = OAISource(f"{self.server.url}/oai2", client=HTTPClient())
+        self.server.oai_page_size = 1
+        self.assertEqual(source.harvest(), 2)
+        requests_made = self.server.requests
+        manifest, failures = ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(),
+            mods_source=source,
+        ).build("bench:book")
+        self.assertEqual(manifest["label"], "Stand-in object bench:book")
+        self.assertEqual(self.server.requests - requests_made, 7)
+
+    def test_collection_crawler(self):
+        builder = ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(throttle=HostThrottle(rate=1000, max_concurrency=4)),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            crawler = CollectionCrawler(builder, directory, queue_size=1)
+            summary = crawler.crawl(["collections:bench", "collections:bench"])
+            self.assertEqual((summary["total"], summary["built"]), (2, 2))
+            self.assertEqual(summary["failed"], [])
+            self.assertEqual(
+                sorted(os.listdir(directory)), ["bench_audio.json", "bench_book.json"]
+            )
+            self.assertEqual(summary["pages_built"], 6)
+            self.assertEqual(crawler.crawl(["collections:bench"])["skipped"], 2)
+            crawler.force = True
+            self.assertEqual(crawler.crawl(["collections:bench"])["unchanged"], 2)
+            threads = threading.active_count()
+            with mock.patch.object(
+                crawler, "is_current", side_effect=OSError("unreadable")
+            ):
+                with self.assertRaises(OSError):
+                    crawler.crawl(["collections:bench"])
+            self.assertEqual(threading.active_count(), threads)
+
+    def test_build_report(self):
+        reports = io.StringIO()
+        builder = ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(),
+            reports=ReportWriter(reports=reports),
+        )
+        with builder.recording("bench:book"):
+            manifest, _ = builder.build("bench:book")
+            builder.write(manifest, io.StringIO())
+        report = json.loads(reports.getvalue())
+        self.assertEqual(report["attributes"], {"pid": "bench:book"})
+        self.assertEqual(report["spans"]["info.json"]["count"], 5)
+        self.assertEqual(report["spans"]["risearch.query"]["count"], 2)
+        self.assertIn("serialize", report["spans"])
+        self.assertEqual(report["counters"]["http.requests"], 8)
+
+    def test_build_events(self):
+        class EventLog(BuildListener):
+            def __init__(self):
+                self.events = []
+
+            def canvas_built(self, pid, page, total):
+                self.events.append(("canvas_built", pid, total))
+
+            def manifest_done(self, pid, canvases, failures, fetched):
+                self.events.append(("manifest_done", pid, canvases, fetched > 0))
+
+        log = self.builder.events.subscribe(EventLog())
+        throughput = self.builder.events.subscribe(Throughput())
+        self.builder.build("bench:book")
+        self.builder.build("bench:audio")
+        self.assertEqual(
+            log.events,
+            [("canvas_built", "bench:book", 5)] * 5
+            + [("manifest_done", "bench:book", 5, True)]
+            + [("canvas_built", "bench:audio", 1)]
+            + [("manifest_done", "bench:audio", 1, True)],
+        )
+        counts = throughput.snapshot()
+        self.assertEqual((counts["pages_built"], counts["manifests_done"]), (6, 2))
+        self.assertEqual(counts["pages_failed"], 0)
+
+
+class HTTPClientTester(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(StandInRepository(books={"bench:book": 2})).start()
+        self.mods = (
+            f"{self.server.url}/collections/islandora/object/bench:book/datastream/MODS"
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connections_are_reused(self):
+        client = HTTPClient(pool_size=2)
+        bodies = [client.get_content(self.mods) for _ in range(4)]
+        stats = client.stats()
+        self.assertEqual((stats["requests"], stats["bytes"]), (4, 4 * len(bodies[0])))
+        self.assertEqual(
+            (stats["connections_opened"], stats["connections_reused"]), (1, 3)
+        )
+
+    def test_pool_size_bounds_connections(self):
+        client = HTTPClient(pool_size=8, pool_sizes={"127.0.0.1": 2})
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: client.get_text(self.mods), range(10)))
+        stats = client.stats()
+        self.assertEqual(stats["requests"], 10)
+        self.assertLessEqual(stats["connections_opened"], 2)
+        self.assertEqual(self.server.requests, 10)
+        with self.assertRaises(requests.HTTPError):
+            client.get_content(self.mods.replace("bench:book", "bench:missing"))
+
+
+class BatchRunnerTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_read_pid_list(self):
+        handle = io.StringIO("# books\nagrtfhs:2275\n\n  wwiioh:2001  \n")
+        self.assertEqual(read_pid_list(handle), ["agrtfhs:2275", "wwiioh:2001"])
+
+    def test_existing_manifests_newer_than_the_object_are_current(self):
+        runner = BatchRunner(None, self.directory.name)
+        self.assertFalse(runner.is_current("test:1", "2020-01-01T00:00:00.000Z"))
+        path = runner.output_path("test:1")
+        self.assertEqual(os.path.basename(path), "test_1.json")
+        with open(path, "w") as manifest:
+            manifest.write("{}")
+        built = datetime(2021, 1, 1, tzinfo=timezone.utc).timestamp()
+        os.utime(path, (built, built))
+        self.assertTrue(runner.is_current("test:1", "2020-12-31T23:59:59.999Z"))
+        self.assertFalse(runner.is_current("test:1", "2021-01-01T00:00:01Z"))
+        runner.force = True
+        self.assertFalse(runner.is_current("test:1", "2020-12-31T23:59:59.999Z"))
+
+    def test_summary(self):
+        with StandInServer(StandInRepository(audio=["bench:audio"])) as server:
+            builder = ManifestBuilder(
+                server.url, f"{server.url}/fedora/risearch", client=HTTPClient()
+            )
+            summary = BatchRunner(builder, self.directory.name, workers=2).run(
+                [("bench:audio", None, None, None), ("bench:missing", None, None, None)]
+            )
+        self.assertEqual((summary["total"], summary["built"]), (2, 1))
+        self.assertEqual([pid for pid, _ in summary["failed"]], ["bench:missing"])
+        self.assertGreater(summary["manifests_per_second"], 0)
+        self.assertIn("risearch", summary["stages"])
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory.name, "bench_audio.json"))
+        )
+
+
+class CollectionPageIndexTester(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInRepository(books={"bench:a": 3, "bench:b": 2}, audio=["bench:audio"])
+        ).start()
+        self.builder = ManifestBuilder(
+            self.server.url, f"{self.server.url}/fedora/risearch", client=HTTPClient()
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_one_query_for_every_page(self):
+        index = self.builder.search.get_collection_pages("collections:bench")
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(
+            index,
+            {
+                "bench:a": [("bench:a-1", 1), ("bench:a-2", 2), ("bench:a-3", 3)],
+                "bench:b": [("bench:b-1", 1), ("bench:b-2", 2)],
+            },
+        )
+        members = self.builder.search.get_collection_members("collections:bench")
+        self.assertEqual(
+            [(pid, model) for pid, model, _ in members],
+            [
+                ("bench:a", "islandora:bookCModel"),
+                ("bench:audio", "islandora:sp-audioCModel"),
+                ("bench:b", "islandora:bookCModel"),
+            ],
+        )
+
+    def test_indexed_books_skip_their_page_query(self):
+        index = self.builder.search.get_collection_pages("collections:bench")
+        requests_made = self.server.requests
+        manifest, _ = self.builder.build(
+            "bench:a", "collections:bench", "islandora:bookCModel", index["bench:a"]
+        )
+        self.assertEqual(len(manifest["sequences"][0]["canvases"]), 3)
+        self.assertEqual(self.server.requests - requests_made, 4)
+
+
+class BuildStateTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "build_state.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_builds_after_the_last_change_are_current(self):
+        state = BuildState(self.path)
+        modified = "2021-01-01T00:00:00.000Z"
+        self.assertIsNone(state.last_built("test:1"))
+        self.assertFalse(state.is_current("test:1", modified))
+        state.record("test:1", datetime(2021, 1, 2, tzinfo=timezone.utc).timestamp())
+        self.assertTrue(state.is_current("test:1", modified))
+        self.assertFalse(state.is_current("test:1", "2021-01-03T00:00:00Z"))
+        self.assertFalse(state.is_current("test:1", None))
+        self.assertFalse(state.is_current("test:1", modified, (3,)))
+        self.assertTrue(BuildState(self.path).is_current("test:1", modified))
+
+    def test_latest_modified(self):
+        self.assertEqual(
+            latest_modified(
+                "2021-01-01T00:00:00.000Z",
+                None,
+                "2021-03-01T00:00:00Z",
+                "2021-02-01T00:00:00.000Z",
+            ),
+            "2021-03-01T00:00:00Z",
+        )
+        self.assertIsNone(latest_modified(None, None))
+
+
+class ResponseCacheTester(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(
+            StandInRepository(books={"bench:book": 5}, audio=["bench:audio"])
+        ).start()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def builder(self, cache):
+        return ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(cache=cache),
+        )
+
+    def test_warm_rebuild_is_revalidated(self):
+        cache = ResponseCache(
+            self.directory.name, ttls={"info.json": None, "MODS": 0, "TECHMD": 0}
+        )
+        manifest, _ = self.builder(cache).build("bench:book")
+        self.assertEqual(cache.misses, 6)
+        requests_made = self.server.requests
+        rebuilt, _ = self.builder(cache).build("bench:book")
+        self.assertEqual(rebuilt, manifest)
+        self.assertEqual((cache.hits, cache.revalidations, cache.misses), (5, 1, 6))
+        self.assertEqual(self.server.requests - requests_made, 3)
+        self.assertEqual(self.server.not_modified, 1)
+
+    def test_spellings_share_an_entry_and_credentials_do_not(self):
+        cache = ResponseCache(self.directory.name)
+        client = HTTPClient(cache=cache)
+        info = f"{self.server.url}/iiif/2/collections%7Eislandora%7Eobject%7Ebench:audio%7Edatastream%7ETN/info.json"
+        client.get_content(info)
+        client.get_content(info.replace("%7E", "~"))
+        client.get_content(info, auth=("fedoraAdmin", "fedoraAdmin"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(self.server.requests, 2)
+        reopened = ResponseCache(self.directory.name)
+        self.assertEqual(
+            reopened.key(info, ("fedoraAdmin", "fedoraAdmin")),
+            cache.key(info, ("fedoraAdmin", "fedoraAdmin")),
+        )
+        with tempfile.TemporaryDirectory() as other:
+            self.assertNotEqual(
+                ResponseCache(other).key(info, ("fedoraAdmin", "fedoraAdmin")),
+                cache.key(info, ("fedoraAdmin", "fedoraAdmin")),
+            )
+        unsalted = hashlib.sha256(
+            repr(("fedoraAdmin", "fedoraAdmin")).encode("utf-8")
+        ).hexdigest()
+        index = sqlite3.connect(os.path.join(self.directory.name, "index.sqlite"))
+        keys = [row[0] for row in index.execute("SELECT url FROM responses")]
+        index.close()
+        self.assertIn(cache.key(info, ("fedoraAdmin", "fedoraAdmin")), keys)
+        self.assertFalse(any(unsalted[:16] in key for key in keys))
+
+    def test_eviction_respects_max_bytes(self):
+        cache = ResponseCache(self.directory.name, max_bytes=250)
+        urls = [f"http://localhost/iiif/2/{name}/info.json" for name in "abc"]
+        cache.store(urls[0], b"a" * 100)
+        cache.store(urls[1], b"b" * 100)
+        cache.lookup(urls[0])
+        cache.store(urls[2], b"c" * 100)
+        self.assertLessEqual(cache.size(), 250)
+        self.assertIsNone(cache.lookup(urls[1]))
+        self.assertIsNotNone(cache.lookup(urls[0]))
+        self.assertEqual(sorted(url for url, _ in cache.items()), [urls[0], urls[2]])
+        cache.max_bytes = 50
+        with mock.patch.object(cache, "size", wraps=cache.size) as size:
+            cache.evict()
+        self.assertEqual(size.call_count, 1)
+        self.assertEqual(list(cache.items()), [])
+
+
+def jp2_header(height, width):
+    """Returns the signature, file type, and header boxes of a JP2 of a size, which is all the index reads."""
+    ihdr = struct.pack(">I4sIIHBBBB", 22, b"ihdr", height, width, 3, 7, 7, 0, 0)
+    return (
+        struct.pack(">I4sI", 12, b"jP  ", 0x0D0A870A)
+        + struct.pack(">I4s4sI4s", 20, b"ftyp", b"jp2 ", 0, b"jp2 ")
+        + struct.pack(">I4s", 8 + len(ihdr), b"jp2h")
+        + ihdr
+    )
+
+
+class DimensionIndexTester(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer(StandInRepository(books={"bench:book": 5})).start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.index = DimensionIndex(os.path.join(self.directory.name, "index.sqlite"))
+
+    def tearDown(self):
+        self.server.stop()
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        os.makedirs(os.path.join(self.directory.name, "jp2"), exist_ok=True)
+        with open(os.path.join(self.directory.name, "jp2", name), "wb") as jp2:
+            jp2.write(content)
+        return os.path.join(self.directory.name, "jp2", name)
+
+    def test_names_and_headers(self):
+        self.assertEqual(
+            parse_jp2_filename("info%3Afedora%2Fagrtfhs%3A2279%2FJP2%2FJP2.0"),
+            ("agrtfhs:2279", "JP2"),
+        )
+        self.assertEqual(
+            parse_jp2_filename("agrtfhs_2279.jp2"), ("agrtfhs:2279", "JP2")
+        )
+        self.assertIsNone(parse_jp2_filename("notes.txt"))
+        self.assertEqual(
+            parse_info_json_url(
+                "http://localhost/iiif/2/collections%7Eislandora%7Eobject%7Eagrtfhs:2279%7Edatastream%7EJP2/info.json"
+            ),
+            ("agrtfhs:2279", "JP2"),
+        )
+        self.assertEqual(
+            read_jp2_dimensions(self.write("a_1.jp2", jp2_header(3300, 2550))),
+            (3300, 2550),
+        )
+        with self.assertRaises(ValueError):
+            read_jp2_dimensions(self.write("a_2.jp2", jp2_header(3300, 2550)[:-10]))
+
+    def test_bad_files_are_skipped(self):
+        self.write("bench_book-1.jp2", jp2_header(3300, 2550))
+        self.write("bench_book-2.jp2", b"not a jp2 at all")
+        self.write("bench_book-3.jp2", jp2_header(3300, 2550)[:40])
+        self.write("info%3Afedora%2Fbench%3Abook-4%2FJP2%2FJP2.0", jp2_header(10, 20))
+        skipped = []
+        indexed = self.index.populate_from_jp2(
+            os.path.join(self.directory.name, "jp2"), skipped=skipped
+        )
+        self.assertEqual(indexed, 2)
+        self.assertEqual(
+            [file["name"] for file in skipped], ["bench_book-2.jp2", "bench_book-3.jp2"]
+        )
+        self.assertEqual(self.index.get("bench:book-4", "JP2")["width"], 20)
+
+    def test_indexed_book_makes_no_image_requests(self):
+        for n in range(1, 6):
+            self.write(f"bench_book-{n}.jp2", jp2_header(3300, 2550))
+        self.index.populate_from_jp2(
+            os.path.join(self.directory.name, "jp2"), f"{self.server.url}/"
+        )
+        builder = ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(),
+            dimensions=self.index,
+        )
+        manifest, failures = builder.build("bench:book")
+        self.assertEqual(failures, [])
+        self.assertEqual(len(manifest["sequences"][0]["canvases"]), 5)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_populate_from_cache(self):
+        cache = ResponseCache(os.path.join(self.directory.name, "cache"))
+        ManifestBuilder(
+            self.server.url,
+            f"{self.server.url}/fedora/risearch",
+            client=HTTPClient(cache=cache),
+        ).build("bench:book")
+        self.assertEqual(self.index.populate_from_cache(cache), 5)
+        info = self.index.get("bench:book-3", "JP2")
+        self.assertEqual((info["height"], info["width"]), (3300, 2550))
+
+
+class InstrumentTester(unittest.TestCase):
+    def test_spans_in_worker_threads_have_the_caller_as_parent(self):
+        def read_info_json():
+            with span("info.json"):
+                pass
+
+        recorder = Recorder("build", pid="test:1")
+        with recording(recorder):
+            with span("canvases"):
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    for _ in range(4):
+                        executor.submit(bind(read_info_json))
+                count("http.requests", 4)
+        spans = recorder.otel()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        names = {item["spanId"]: item["name"] for item in spans}
+        parents = [
+            names[item["parentSpanId"]] for item in spans if item["name"] == "info.json"
+        ]
+        self.assertEqual(parents, ["canvases"] * 4)
+        self.assertEqual(recorder.report()["counters"], {"http.requests": 4})
+
+    def test_nothing_is_recorded_outside_a_recording(self):
+        with span("info.json"):
+            count("http.requests")
+        self.assertEqual(bind(len), len)
+
+
+class AdaptiveLimitTester(unittest.TestCase):
+    def test_halves_on_congestion(self):
+        limit = AdaptiveLimit(initial=8, cooldown=60)
+        limit.acquire()
+        limit.release(False, 0.01)
+        self.assertGreater(limit.limit, 8)
+        limit.acquire()
+        limit.release(True, 0.01)
+        self.assertLess(limit.limit, 4.2)
+        limit.acquire()
+        limit.release(True, 0.01)
+        self.assertEqual(limit.decreases, 1)
+
+    def test_rates_must_be_above_zero(self):
+        for rate, rates in ((0, None), (None, {"localhost": 0}), (-1, None)):
+            with self.assertRaises(ValueError):
+                HostThrottle(rate=rate, rates=rates)
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+    def test_recovers_from_one_fast_response(self):
+        limit = AdaptiveLimit(initial=8, cooldown=0)
+        limit.acquire()
+        limit.release(False, 0.001)
+        for _ in range(200):
+            limit.acquire()
+            limit.release(False, 0.1)
+        self.assertGreater(limit.decreases, 0)
+        self.assertLess(limit.latency, limit.best_latency * limit.latency_tolerance)
+        self.assertGreater(limit.limit, 8)
+
+    def test_streams_hold_their_slot_until_read(self):
+        server = StandInServer(StandInRepository(books={"bench:book": 5})).start()
+        try:
+            throttle = HostThrottle()
+            client = HTTPClient(throttle=throttle)
+            lines = client.iter_lines(
+                f"{server.url}/collections/islandora/object/bench:book/datastream/MODS"
+            )
+            next(lines)
+            self.assertEqual(
+                [host["in_flight"] for host in throttle.stats().values()], [1]
+            )
+            list(lines)
+            self.assertEqual(
+                [host["in_flight"] for host in throttle.stats().values()], [0]
+            )
+            with self.assertRaises(requests.HTTPError):
+                list(
+                    client.iter_lines(
+                        f"{server.url}/collections/islandora/object/bench:missing/datastream/MODS"
+                    )
+                )
+            self.assertEqual(
+                [host["decreases"] for host in throttle.stats().values()], [0]
+            )
+        finally:
+            server.stop()
+
+
+class ExportDirectorySourceTester(unittest.TestCase):
+    def test_mods_and_foxml_files(self):
+        mods = b'<mods xmlns="http://www.loc.gov/mods/v3"><titleInfo><title>Exported</title></titleInfo></mods>'
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "test_1.xml"), "wb") as export:
+                export.write(mods)
+            with open(
+                os.path.join(directory, "info%3Afedora%2Ftest%3A2"), "wb"
+            ) as export:
+                export.write(
+                    b'<foxml:digitalObject xmlns:foxml="info:fedora/fedora-system:def/foxml#" PID="test:2">'
+                    b'<foxml:datastream ID="MODS" CONTROL_GROUP="X"><foxml:datastreamVersion ID="MODS.0">'
+                    b'<foxml:xmlContent><mods xmlns="http://www.loc.gov/mods/v3"><titleInfo><title>Old</title>'
+                    b"</titleInfo></mods></foxml:xmlContent></foxml:datastreamVersion>"
+                    b'<foxml:datastreamVersion ID="MODS.1"><foxml:xmlContent>'
+                    + mods
+                    + b"</foxml:xmlContent></foxml:datastreamVersion></foxml:datastream></foxml:digitalObject>"
+                )
+            source = ExportDirectorySource(directory)
+            self.assertEqual(source.get("test:1"), mods)
+            self.assertEqual(MODSRecord(source.get("test:2")).title, "Exported")
+            self.assertIsNone(source.get("test:3"))